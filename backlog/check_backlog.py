@@ -15,9 +15,16 @@ import os
 import re
 import sys
 import datetime
+import time
 from dateutil.relativedelta import relativedelta
 import requests
 
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
+from etlcommon.chunking import AdaptiveChunkSizer, is_timeout_error
+from etlcommon.sodarows import soda_row_to_values, CRASH_COLUMN_NAMES
+
 
 #
 # constants and defines
@@ -30,7 +37,11 @@ CARTO_CRASHES_TABLE = 'crashes_all_prod'
 CARTO_SQL_API_BASEURL = 'https://%s.carto.com/api/v2/sql' % CARTO_USER_NAME
 SODA_API_COLLISIONS_BASEURL = 'https://data.cityofnewyork.us/resource/qiz3-axqb.json'
 
-INSERT_CHUNK_SIZE = 40  # inserting into CARTO, do this many records at a time, API time limit
+INSERT_CHUNK_SIZE = 40  # inserting into CARTO, start with this many records at a time, API time limit
+INSERT_CHUNK_MAX = 500  # the chunk size adapts to how long CARTO takes, but never more than this
+INSERT_TARGET_SECONDS = 5  # ...aiming for each INSERT to take under this long
+INSERT_RETRIES = 3  # a chunk which fails other than by timing out is tried again this many times, before giving up
+INSERT_RETRY_SECONDS = 20  # ...waiting this long between tries
 
 
 #
@@ -52,7 +63,7 @@ def yyyymm2daterange(yyyymm):
 def getcartoalreadyids(startdate, enddate):
     try:
         sql = "SELECT DISTINCT socrata_id FROM {0} WHERE socrata_id IS NOT NULL AND date_val >= '{1}' AND date_val < '{2}'".format(CARTO_CRASHES_TABLE, startdate, enddate)
-        alreadydata = requests.get(
+        alreadydata = httpclient.get(
             CARTO_SQL_API_BASEURL,
             params={
                 'q': sql,
@@ -74,7 +85,7 @@ def getcartoalreadyids(startdate, enddate):
 def getsodacrashes(startdate, enddate):
     try:
         whereclause = "crash_date >= '{0}' AND crash_date < '{1}'".format(startdate, enddate)
-        crashdata = requests.get(
+        crashdata = httpclient.get(
             SODA_API_COLLISIONS_BASEURL,
             params={
                 '$where': whereclause,
@@ -107,153 +118,11 @@ def filtertomissingcrashes(allcrashes, idsalready):
 
 def soda2data(datarows):
     """
-    Transforms the JSON SODA response into rows for the SQL insert query
+    Transforms the JSON SODA response into rows for the SQL insert query, same as the nightly ETL does
+    see etlcommon/sodarows.py
     @param {list} data
     """
-    # array to store insert value strings
-    vals = []
-
-    # create our value template string once then copy it using string.slice when iterating over data list
-    insert_val_template_string = format_string_for_insert_val()
-
-    # iterate over data array and format each dictionary's values into strings for the INSERT SQL query
-    for row in datarows:
-        datestring = "%sT%s" % (row['crash_date'].split('T')[0], row['crash_time'])
-        date_time = datetime.datetime.strptime(datestring, '%Y-%m-%dT%H:%M')
-
-        # latitude and longitude may or may not be present
-        if 'longitude' in row:
-            lng = row['longitude']
-        else:
-            lng = None
-
-        if 'latitude' in row:
-            lat = row['latitude']
-        else:
-            lat = None
-
-        if lat and lng:
-            the_geom = "ST_GeomFromText('Point({0} {1})', 4326)".format(lng, lat)
-        else:
-            the_geom = 'null'
-            lat = 'null'
-            lng = 'null'
-
-        # ditto for on_street_name
-        # dollar quote strings to escape single quotes in street names like "O'Brien"
-        if 'on_street_name' in row:
-            on_street_name = row['on_street_name'].strip()
-        else:
-            on_street_name = ''
-
-        # ditto for off_street_name
-        if 'off_street_name' in row:
-            off_street_name = row['off_street_name'].strip()
-        else:
-            off_street_name = ''
-
-        # ditto for cross_street_name
-        if 'cross_street_name' in row:
-            cross_street_name = row['cross_street_name'].strip()
-        else:
-            cross_street_name = ''
-
-        # ditto for zip_code
-        if 'zip_code' in row:
-            zipcode = row['zip_code']
-        else:
-            zipcode = ''
-
-        # format 5 potential values for contributing_factor into a string formatted for a Postgres array
-        # ditto for 5 potential vehicle_type values
-        contributing_factor = format_string_for_postgres_array(row, 'contributing_factor_vehicle')
-        vehicle_type = format_string_for_postgres_array(row, 'vehicle_type_code')
-
-        # copy our template value string
-        val_string = insert_val_template_string[:]
-
-        # a few rare records lack number_of_persons_X fields, which is a fatal error if we let it go
-        if 'number_of_persons_killed' not in row:
-            row['number_of_persons_killed'] = int(row['number_of_motorist_killed']) + int(row['number_of_cyclist_killed']) + int(row['number_of_pedestrians_killed'])
-        if 'number_of_persons_injured' not in row:
-            row['number_of_persons_injured'] = int(row['number_of_motorist_injured']) + int(row['number_of_cyclist_injured']) + int(row['number_of_pedestrians_injured'])
-
-        # create the sql value string
-        vals.append(val_string.format(
-            row['number_of_motorist_killed'],
-            row['number_of_motorist_injured'],
-            row['number_of_cyclist_killed'],
-            row['number_of_cyclist_injured'],
-            row['number_of_pedestrians_killed'],
-            row['number_of_pedestrians_injured'],
-            row['number_of_persons_killed'],
-            row['number_of_persons_injured'],
-            zipcode,
-            off_street_name,
-            cross_street_name,
-            on_street_name,
-            '',  # leave borough blank, update_borough() does a better job
-            date_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
-            lng,
-            lat,
-            the_geom,
-            vehicle_type,
-            contributing_factor,
-            date_time.strftime('%Y'),
-            date_time.strftime('%m'),
-            '1',
-            str(row['collision_id'])
-        ))
-
-    # ready; return the list of massaged SQL strings
-    return vals
-
-
-def format_string_for_postgres_array(values, field_name):
-    """
-    Takes a values dictionary and field_name string as input and
-    converts them to a string formatted for a postgres text array.
-    @param {values} dictionary
-    @param {field_name} string
-    Any value for either contributing_factor_vehicle_* or vehicle_type_code*
-    from the SODA response are joined into a single string surrounded by {}
-    """
-    tmp_list = []
-
-    if field_name != 'contributing_factor_vehicle' and field_name != 'vehicle_type_code':
-        print('format_postgres_array must take a valid field name type, %s provided' % field_name)
-        sys.exit(2)
-
-    # if field name matches contributing_factor_vehicle_{n} or vehicle_type_code{n}
-    for i in range(1, 6):
-        if field_name == 'contributing_factor_vehicle' or (field_name == 'vehicle_type_code' and i > 2):
-            field_name_full = "{0}_{1}".format(field_name, i)
-        else:
-            field_name_full = "{0}{1}".format(field_name, i)
-
-        if field_name_full in values:
-            tmp_list.append("'{0}'".format(values[field_name_full]))
-
-    return "ARRAY[%s]::text[]" % ','.join(tmp_list)
-
-
-def format_string_for_insert_val():
-    """
-    Creates a placeholder string like \"({0}, {1}, {2}, {3}, {4}, ...)\" for the
-    Postgres INSERT value. Some of the {0} get \"dollar\" quotes for fields in the
-    crashes table that are of type text
-    """
-    val_string_tmp = []
-
-    for i in range(0, 23):
-        if i < 8 or i >= 14:
-            val_string_tmp.append("{%d}" % i)
-        elif i == 13:
-            val_string_tmp.append("'{%d}'::timestamptz" % i)
-        else:
-            val_string_tmp.append("$${%d}$$" % i)
-
-    return '(' + ','.join(val_string_tmp) + ')'
+    return [soda_row_to_values(row) for row in datarows]
 
 
 def create_sql_insert(vals):
@@ -262,34 +131,7 @@ def create_sql_insert(vals):
     each row being inserted.
     @param {vals} list of strings
     """
-    # field names for the crashes table which get values inserted into them
-    column_names_string = '''
-    number_of_motorist_killed
-    number_of_motorist_injured
-    number_of_cyclist_killed
-    number_of_cyclist_injured
-    number_of_pedestrian_killed
-    number_of_pedestrian_injured
-    number_of_persons_killed
-    number_of_persons_injured
-    zip_code
-    off_street_name
-    cross_street_name
-    on_street_name
-    borough
-    date_val
-    longitude
-    latitude
-    the_geom
-    vehicle_type
-    contributing_factor
-    year
-    month
-    crash_count
-    socrata_id
-    '''
-    column_name_list_tmp = [n.strip() for n in column_names_string.split('\n')]
-    column_name_list = [n for n in column_name_list_tmp if n != '']
+    # the field names for the crashes table which get values inserted into them are CRASH_COLUMN_NAMES, in the same order as the rows
 
     # only insert data that doesn't exist in our table already
     sql = '''
@@ -298,35 +140,13 @@ def create_sql_insert(vals):
     VALUES {1}
     )
     INSERT INTO {2} ({0})
-    SELECT n.number_of_motorist_killed,
-    n.number_of_motorist_injured,
-    n.number_of_cyclist_killed,
-    n.number_of_cyclist_injured,
-    n.number_of_pedestrian_killed,
-    n.number_of_pedestrian_injured,
-    n.number_of_persons_killed,
-    n.number_of_persons_injured,
-    n.zip_code,
-    n.off_street_name,
-    n.cross_street_name,
-    n.on_street_name,
-    n.borough,
-    n.date_val,
-    n.longitude,
-    n.latitude,
-    n.the_geom,
-    n.vehicle_type,
-    n.contributing_factor,
-    n.year,
-    n.month,
-    n.crash_count,
-    n.socrata_id
+    SELECT {3}
     FROM n
     WHERE n.socrata_id NOT IN (
     SELECT socrata_id FROM {2}
     WHERE socrata_id IS NOT NULL
     )
-    '''.format(','.join(column_name_list), ','.join(vals), CARTO_CRASHES_TABLE)
+    '''.format(','.join(CRASH_COLUMN_NAMES), ','.join(vals), CARTO_CRASHES_TABLE, ','.join(['n.' + name for name in CRASH_COLUMN_NAMES]))
     # print('SQL UPSERT query:\n %s' % sql)
 
     return sql
@@ -337,16 +157,15 @@ def performcartoquery(query):
     Takes an SQL query and uses it with a POST request to
     the CARTO SQL API. Passing the API key allows for doing
     INSERT, UPDATE, and DELETE queries.
+    Returns CARTO's reply; a failed request or a reply which isn't JSON e.g. a 504 page is returned as an error reply too.
     @param {query} string
     """
     payload = {'q': query, 'api_key': CARTO_API_KEY}
 
     try:
-        r = requests.post(CARTO_SQL_API_BASEURL, data=payload)
-        print(r.text)
-    except requests.exceptions.RequestException as e:
-        print(e.message)
-        sys.exit(2)
+        return httpclient.post(CARTO_SQL_API_BASEURL, data=payload).json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return {'error': [str(e)]}
 
 
 # https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks
@@ -394,13 +213,46 @@ if __name__ == '__main__':
     soda2data = soda2data(crashesfromsoda)
 
     # loop over the insertions in chunks, create SQL, and run it
+    # the chunk size grows and shrinks with how long CARTO takes; a chunk which times out is split in half and tried again
     done = 0
-    insert_chunks = list_chunks(soda2data, INSERT_CHUNK_SIZE)
-    for chunk in insert_chunks:
-        done += 1
-        print("Inserting chunk {} of {}".format(done, len(insert_chunks)))
+    position = 0
+    retries = []
+    failedtries = 0
+    sizer = AdaptiveChunkSizer(initial=INSERT_CHUNK_SIZE, maximum=INSERT_CHUNK_MAX, target_seconds=INSERT_TARGET_SECONDS)
+    while retries or position < len(soda2data):
+        if retries:
+            chunk = retries.pop(0)
+        else:
+            chunk = soda2data[position:position + sizer.size]
+            position += len(chunk)
+
+        print("Inserting chunk of {}, {} of {} done".format(len(chunk), done, len(soda2data)))
         insertsql = create_sql_insert(chunk)
-        performcartoquery(insertsql)
+        reply = performcartoquery(insertsql)
+
+        if 'error' in reply and is_timeout_error(reply['error']) and len(chunk) > 1:
+            sizer.timed_out()
+            half = len(chunk) // 2
+            retries += [chunk[:half], chunk[half:]]
+            print("Timed out, retrying in halves; chunk size now {}".format(sizer.size))
+            continue
+
+        # any other error, try the same chunk again a few times; if it still fails, stop rather than skip it
+        # the crashes already inserted stay, so running this again picks up where it left off
+        if 'error' in reply:
+            failedtries += 1
+            if failedtries > INSERT_RETRIES:
+                print("Insert failed {} times, giving up with {} of {} done: {}".format(failedtries, done, len(soda2data), reply['error']))
+                sys.exit(2)
+            print("Insert failed, retrying: {}".format(reply['error']))
+            retries.insert(0, chunk)
+            time.sleep(INSERT_RETRY_SECONDS)
+            continue
+
+        failedtries = 0
+        done += len(chunk)
+        if 'time' in reply:
+            sizer.record(float(reply['time']))
 
     # done
     print("Done")
@@ -0,0 +1,92 @@
+#!/bin/env python3
+"""
+Compare the scalar haversine() against the vectorized haversine_array(), for a findgeomupdates-sized set of crashes.
+Checks that both give the same distances and the same set of records over the threshold, then reports timings.
+
+Usage: python3 bench_haversine.py [HOWMANY]
+"""
+
+import os
+import sys
+import time
+import random
+
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon.geo import haversine, haversine_array, coordinate_array
+
+import numpy as np
+
+
+HOWMANY = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+DISTANCE_THRESHOLD = 15
+NULL_FRACTION = 0.1  # about this share of the crashes lack coordinates, like the real data
+
+
+def make_crashes(howmany):
+    # points around NYC; most barely move, some move a few hundred meters, some lack coordinates on either side
+    random.seed(1)
+    lats_old, lngs_old, lats_new, lngs_new = [], [], [], []
+    for i in range(howmany):
+        lat = random.uniform(40.5, 40.9)
+        lng = random.uniform(-74.25, -73.7)
+        jitter = 0.003 if random.random() < 0.05 else 0.00005
+        lats_old.append(lat if random.random() > NULL_FRACTION else '')
+        lngs_old.append(lng)
+        lats_new.append(lat + random.uniform(-jitter, jitter))
+        lngs_new.append(lng + random.uniform(-jitter, jitter) if random.random() > NULL_FRACTION else '')
+    return lats_old, lngs_old, lats_new, lngs_new
+
+
+def run_scalar(lats_old, lngs_old, lats_new, lngs_new):
+    # the way the scripts did it: parse and compare row by row
+    moved = []
+    for i in range(len(lats_old)):
+        lat_old = float(lats_old[i]) if lats_old[i] else None
+        lng_old = float(lngs_old[i]) if lngs_old[i] else None
+        lat_new = float(lats_new[i]) if lats_new[i] else None
+        lng_new = float(lngs_new[i]) if lngs_new[i] else None
+        if lat_old and lng_old and lat_new and lng_new:
+            meters = haversine(lat_old, lng_old, lat_new, lng_new)
+            if meters > DISTANCE_THRESHOLD:
+                moved.append((i, meters))
+    return moved
+
+
+def run_vectorized(lats_old, lngs_old, lats_new, lngs_new):
+    distances = haversine_array(
+        coordinate_array(lats_old),
+        coordinate_array(lngs_old),
+        coordinate_array(lats_new),
+        coordinate_array(lngs_new),
+    )
+    return [(i, int(distances[i])) for i in np.flatnonzero(distances > DISTANCE_THRESHOLD)]
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    print(f"Generating {HOWMANY} synthetic crashes")
+    crashes = make_crashes(HOWMANY)
+
+    scalar, scalar_seconds = timed(run_scalar, *crashes)
+    vectorized, vectorized_seconds = timed(run_vectorized, *crashes)
+
+    if scalar != vectorized:
+        mismatches = len(set(scalar) ^ set(vectorized))
+        print(f"MISMATCH: {len(scalar)} moved per haversine(), {len(vectorized)} per haversine_array(), {mismatches} differ")
+        sys.exit(1)
+
+    # the kernel alone, with the coordinates already parsed into arrays
+    arrays = [coordinate_array(coords) for coords in crashes]
+    _, kernel_seconds = timed(haversine_array, *arrays)
+
+    print(f"Both found the same {len(scalar)} crashes moved over {DISTANCE_THRESHOLD} meters")
+    print(f"    haversine()          {scalar_seconds:.2f} seconds")
+    print(f"    haversine_array()    {vectorized_seconds:.2f} seconds, including parsing")
+    print(f"    haversine_array()    {kernel_seconds:.2f} seconds, distances only")
+    print(f"    speedup              {scalar_seconds / vectorized_seconds:.1f}x")
@@ -0,0 +1,137 @@
+#!/bin/env python3
+"""
+Time the compiled SODA row transformer from etlcommon/sodarows.py, on a batch of synthetic SODA records.
+Also runs the per-row loop which format_soda_response() used before, to check both give identical VALUES rows.
+
+Usage: python3 bench_transform.py [HOWMANY]
+"""
+
+import os
+import re
+import sys
+import time
+import random
+from datetime import datetime
+
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon.sodarows import soda_row_to_values
+
+
+HOWMANY = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+STREETS = ['BROADWAY', "O'BRIEN PLACE", '  ATLANTIC AVENUE  ', 'WEST 42 STREET', 'FDR DRIVE']
+FACTORS = ['Unspecified', 'Driver Inattention/Distraction', 'Following Too Closely', "Driver's Inexperience", 'Unsafe Speed, Passing Too Closely']
+VEHICLES = ['Sedan', 'Station Wagon/Sport Utility Vehicle', 'Taxi', 'Bike', 'Box Truck', 'E-Bike', 'Pick-up Truck,Bus']
+
+
+def make_rows(howmany):
+    # shaped like the SODA API's records, including the optional fields which are often missing
+    random.seed(1)
+    rows = []
+    for i in range(howmany):
+        row = {
+            'collision_id': str(4000000 + i),
+            'crash_date': '2024-{:02d}-{:02d}T00:00:00.000'.format(random.randint(1, 12), random.randint(1, 28)),
+            'crash_time': '{}:{:02d}'.format(random.randint(0, 23), random.randint(0, 59)),
+        }
+        for mode in ('motorist', 'cyclist', 'pedestrians'):
+            row['number_of_{}_killed'.format(mode)] = str(random.choice([0, 0, 0, 0, 1]))
+            row['number_of_{}_injured'.format(mode)] = str(random.choice([0, 0, 1, 2]))
+        if random.random() > 0.01:
+            row['number_of_persons_killed'] = str(sum([int(row['number_of_{}_killed'.format(mode)]) for mode in ('motorist', 'cyclist', 'pedestrians')]))
+            row['number_of_persons_injured'] = str(sum([int(row['number_of_{}_injured'.format(mode)]) for mode in ('motorist', 'cyclist', 'pedestrians')]))
+        if random.random() > 0.1:
+            row['latitude'] = '{:.6f}'.format(random.uniform(40.5, 40.9))
+            row['longitude'] = '{:.6f}'.format(random.uniform(-74.25, -73.7))
+            row['zip_code'] = str(random.randint(10001, 11697))
+        for fieldname in random.sample(['on_street_name', 'off_street_name', 'cross_street_name'], random.randint(1, 3)):
+            row[fieldname] = random.choice(STREETS)
+        howmanyvehicles = random.randint(1, 5)
+        for n in range(1, howmanyvehicles + 1):
+            row['contributing_factor_vehicle_{}'.format(n)] = random.choice(FACTORS)
+            row['vehicle_type_code{}{}'.format('' if n <= 2 else '_', n)] = random.choice(VEHICLES)
+        rows.append(row)
+    return rows
+
+
+def previous_transform(datarows):
+    # the loop from format_soda_response() as it was, condensed; for checking the output only
+    def postgres_array(values, field_name):
+        tmp_list = []
+        for i in range(1, 6):
+            if field_name == 'contributing_factor_vehicle' or (field_name == 'vehicle_type_code' and i > 2):
+                field_name_full = "{0}_{1}".format(field_name, i)
+            else:
+                field_name_full = "{0}{1}".format(field_name, i)
+            if field_name_full in values:
+                for thisvalue in re.split(r'\s*,\s*', values[field_name_full]):
+                    toinsert = thisvalue.replace("'", "").strip()
+                    if toinsert:
+                        tmp_list.append("'{0}'".format(toinsert))
+        return "ARRAY[%s]::text[]" % ','.join(tmp_list)
+
+    template = []
+    for i in range(0, 23):
+        if i < 8 or i >= 14:
+            template.append("{%d}" % i)
+        elif i == 13:
+            template.append("'{%d}'::timestamptz" % i)
+        else:
+            template.append("$${%d}$$" % i)
+    template = '(' + ','.join(template) + ')'
+
+    vals = []
+    for row in datarows:
+        row = dict(row)
+        date_time = datetime.strptime("%sT%s" % (row['crash_date'].split('T')[0], row['crash_time']), '%Y-%m-%dT%H:%M')
+        lng = row['longitude'] if 'longitude' in row else None
+        lat = row['latitude'] if 'latitude' in row else None
+        if lat and lng:
+            the_geom = "ST_GeomFromText('Point({0} {1})', 4326)".format(lng, lat)
+        else:
+            the_geom = lat = lng = 'null'
+        if 'number_of_persons_killed' not in row:
+            row['number_of_persons_killed'] = int(row['number_of_motorist_killed']) + int(row['number_of_cyclist_killed']) + int(row['number_of_pedestrians_killed'])
+        if 'number_of_persons_injured' not in row:
+            row['number_of_persons_injured'] = int(row['number_of_motorist_injured']) + int(row['number_of_cyclist_injured']) + int(row['number_of_pedestrians_injured'])
+        vals.append(template.format(
+            row['number_of_motorist_killed'], row['number_of_motorist_injured'],
+            row['number_of_cyclist_killed'], row['number_of_cyclist_injured'],
+            row['number_of_pedestrians_killed'], row['number_of_pedestrians_injured'],
+            row['number_of_persons_killed'], row['number_of_persons_injured'],
+            row.get('zip_code', ''),
+            row.get('off_street_name', '').strip(), row.get('cross_street_name', '').strip(), row.get('on_street_name', '').strip(),
+            '',
+            date_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            lng, lat, the_geom,
+            postgres_array(row, 'vehicle_type_code'), postgres_array(row, 'contributing_factor_vehicle'),
+            date_time.strftime('%Y'), date_time.strftime('%m'),
+            '1',
+            str(row['collision_id'])
+        ))
+    return vals
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    print(f"Generating {HOWMANY} synthetic SODA records")
+    rows = make_rows(HOWMANY)
+
+    previous, previous_seconds = timed(previous_transform, rows)
+    compiled, compiled_seconds = timed(lambda rows: [soda_row_to_values(row) for row in rows], rows)
+
+    mismatches = [i for i in range(len(rows)) if previous[i] != compiled[i]]
+    if mismatches:
+        print(f"MISMATCH on {len(mismatches)} rows, e.g.\n    {previous[mismatches[0]]}\n    {compiled[mismatches[0]]}")
+        sys.exit(1)
+
+    print(f"Both gave the same {len(compiled)} VALUES rows")
+    print(f"    previous loop          {previous_seconds:.2f} seconds, {HOWMANY / previous_seconds:,.0f} rows/sec")
+    print(f"    soda_row_to_values()   {compiled_seconds:.2f} seconds, {HOWMANY / compiled_seconds:,.0f} rows/sec")
+    print(f"    speedup                {previous_seconds / compiled_seconds:.1f}x")
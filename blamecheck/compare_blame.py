@@ -0,0 +1,110 @@
+#!/bin/env python3
+"""
+Run the blame allocation SQL and the NumPy allocate_blame() over the same synthetic crashes, and check they agree exactly.
+See README.md
+"""
+
+import os
+import sys
+import random
+import itertools
+
+import requests
+
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
+from etlcommon.blame import BLAME_PASSES, BLAME_COLUMNS, VEHICLE_FLAGS, COUNT_FIELDS, allocate_blame
+
+
+CARTO_USER_NAME = 'chekpeds'
+CARTO_SQL_API_BASEURL = 'https://%s.carto.com/api/v2/sql' % CARTO_USER_NAME
+
+COUNTS_PER_COMBINATION = 4  # how many sets of injury/fatality counts to try, for each combination of vehicle flags
+MAX_COUNT = 5  # counts are 0 through this
+SHOW_MISMATCHES = 10
+
+
+def make_corpus():
+    # every combination of the 8 flags, each with a few sets of counts, including all zeroes
+    random.seed(1)
+    corpus = []
+    for flagvalues in itertools.product([False, True], repeat=len(VEHICLE_FLAGS)):
+        for i in range(COUNTS_PER_COMBINATION):
+            counts = [0] * len(COUNT_FIELDS) if i == 0 else [random.randint(0, MAX_COUNT) for field in COUNT_FIELDS]
+            corpus.append((dict(zip(VEHICLE_FLAGS, flagvalues)), dict(zip(COUNT_FIELDS, counts))))
+    return corpus
+
+
+def run_sql(corpus):
+    """
+    The three passes from BLAME_PASSES, each as a SELECT on top of the one before, over the corpus as a VALUES list
+    Returns a list of dicts, one per crash in the same order
+    """
+    corpuscolumns = ['id'] + ['hasvehicle_{}'.format(flag) for flag in VEHICLE_FLAGS] + COUNT_FIELDS
+    values = ','.join([
+        '({})'.format(','.join([str(i)] + ['true' if flags[flag] else 'false' for flag in VEHICLE_FLAGS] + [str(counts[field]) for field in COUNT_FIELDS]))
+        for i, (flags, counts) in enumerate(corpus)
+    ])
+
+    passes = []
+    previous = 'corpus'
+    for i, (expressions, where) in enumerate(BLAME_PASSES):
+        passes.append("pass{0} AS (SELECT {1}.*, {2} FROM {1})".format(
+            i, previous, ', '.join(['{} AS {}'.format(expression, column) for column, expression in expressions.items()])
+        ))
+        previous = 'pass{}'.format(i)
+
+    # full float precision in the output, so the comparison can be exact
+    sql = """
+    SET extra_float_digits = 3;
+    WITH corpus ({0}) AS (VALUES {1}),
+    {2}
+    SELECT id, {3} FROM {4} ORDER BY id
+    """.format(','.join(corpuscolumns), values, ',\n    '.join(passes), ', '.join(BLAME_COLUMNS), previous)
+
+    try:
+        reply = httpclient.post(CARTO_SQL_API_BASEURL, data={'q': sql}).json()
+    except requests.exceptions.RequestException as e:
+        print(e)
+        sys.exit(2)
+    if 'rows' not in reply:
+        print("SQL failed: {}".format(reply.get('error')))
+        sys.exit(2)
+    return reply['rows']
+
+
+def run_numpy(corpus):
+    flags = {flag: [crashflags[flag] for crashflags, counts in corpus] for flag in VEHICLE_FLAGS}
+    counts = {field: [crashcounts[field] for flags, crashcounts in corpus] for field in COUNT_FIELDS}
+    return allocate_blame(flags, counts)
+
+
+if __name__ == '__main__':
+    corpus = make_corpus()
+    print("Comparing {} synthetic crashes, {} blame fields each".format(len(corpus), len(BLAME_COLUMNS)))
+
+    sqlrows = run_sql(corpus)
+    local = run_numpy(corpus)
+    if len(sqlrows) != len(corpus):
+        print("SQL returned {} rows, expected {}".format(len(sqlrows), len(corpus)))
+        sys.exit(1)
+
+    mismatches = []
+    for i, sqlrow in enumerate(sqlrows):
+        for column in BLAME_COLUMNS:
+            sqlvalue = sqlrow[column]
+            localvalue = local[column][i].item()
+            if sqlvalue != localvalue:
+                mismatches.append((i, column, sqlvalue, localvalue))
+
+    if mismatches:
+        print("{} values differ".format(len(mismatches)))
+        for i, column, sqlvalue, localvalue in mismatches[:SHOW_MISMATCHES]:
+            flags, counts = corpus[i]
+            print("    crash {} {}: SQL {} local {}".format(i, column, sqlvalue, localvalue))
+            print("        flags {}".format(', '.join([flag for flag in VEHICLE_FLAGS if flags[flag]]) or 'none'))
+            print("        counts {}".format(counts))
+        sys.exit(1)
+
+    print("All {} values agree".format(len(corpus) * len(BLAME_COLUMNS)))
@@ -0,0 +1,3 @@
+"""
+Shared code for the nightly ETL script (main.py) and the one-off helper programs in the subfolders
+"""
@@ -0,0 +1,169 @@
+"""
+Run a set of CARTO Batch API jobs which depend on one another, e.g. the blame allocations need the hasvehicle flags first
+
+Each BatchJob names the jobs it must run after. Jobs whose dependencies are done are submitted right away,
+so independent jobs are in CARTO's queue together, and all of them are polled from one asyncio loop.
+Polling starts quick and backs off, since most jobs take seconds but a VACUUM FULL can take an hour.
+
+A job which fails means those depending on it are skipped, but unrelated jobs carry on.
+The result for each job includes how long it sat in CARTO's queue and how long it ran;
+these are as seen by our polling, so they're only as precise as the poll interval at the time.
+"""
+
+import asyncio
+import logging
+import time
+from collections import namedtuple
+
+from etlcommon import httpclient
+
+
+logger = logging.getLogger()
+
+
+# name is for logging and for other jobs' after lists; queries is the list of SQL statements run in sequence
+# queries may instead be a function returning that list, called once the job's dependencies are done,
+# e.g. for maintenance which depends on what those jobs changed; an empty list means nothing to do, and the job is done
+# on_done is called with the job's name once it finishes successfully, e.g. to save checkpoints which depended on it
+BatchJob = namedtuple('BatchJob', ['name', 'queries', 'after', 'on_done'], defaults=[(), None])
+
+# status is done, failed, skipped, or timeout if we gave up waiting on it
+BatchJobResult = namedtuple('BatchJobResult', ['name', 'jobid', 'status', 'queued_seconds', 'run_seconds', 'message'])
+
+
+class BatchJobScheduler:
+    def __init__(self, batchapiurl, apikey, poll_initial=5, poll_max=120, poll_backoff=1.5, wait_max=4 * 3600):
+        self.batchapiurl = batchapiurl
+        self.apikey = apikey
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.poll_backoff = poll_backoff
+        self.wait_max = wait_max
+
+    def run(self, jobs):
+        """
+        Submit and wait for all of the given jobs, each only once those in its after list are done.
+        Returns a dict of job name => BatchJobResult
+        @param {jobs} list of BatchJob
+        """
+        check_job_graph(jobs)
+        return asyncio.run(self._run_all(jobs))
+
+    async def _run_all(self, jobs):
+        self.deadline = time.monotonic() + self.wait_max
+        results = {}
+        tasks = {}
+        for job in jobs:
+            tasks[job.name] = asyncio.ensure_future(self._run_job(job, tasks, results))
+        await asyncio.gather(*tasks.values())
+        return results
+
+    async def _run_job(self, job, tasks, results):
+        for dependency in job.after:
+            await tasks[dependency]
+
+        notdone = [dependency for dependency in job.after if results[dependency].status != 'done']
+        if notdone:
+            logger.warning('Batch job {} skipped, since {} did not finish'.format(job.name, ', '.join(notdone)))
+            results[job.name] = BatchJobResult(job.name, None, 'skipped', None, None, 'after {} did not finish'.format(', '.join(notdone)))
+            return
+
+        loop = asyncio.get_running_loop()
+        queries = job.queries
+        if callable(queries):
+            try:
+                queries = await loop.run_in_executor(None, queries)
+            except Exception as e:
+                logger.error('Batch job {} could not work out its queries: {}'.format(job.name, e))
+                results[job.name] = BatchJobResult(job.name, None, 'failed', None, None, str(e))
+                return
+            if not queries:
+                logger.info('Batch job {} has nothing to do'.format(job.name))
+                results[job.name] = BatchJobResult(job.name, None, 'done', 0, 0, 'nothing to do')
+                return
+
+        try:
+            jobid = await loop.run_in_executor(None, self._submit, queries)
+        except Exception as e:
+            logger.error('Batch job {} could not be submitted: {}'.format(job.name, e))
+            results[job.name] = BatchJobResult(job.name, None, 'failed', None, None, str(e))
+            return
+        logger.info('Batch job {} submitted, CARTO Batch Job ID: {}'.format(job.name, jobid))
+
+        submitted = time.monotonic()
+        started = None
+        delay = self.poll_initial
+        while True:
+            if time.monotonic() + delay > self.deadline:
+                logger.error('Batch job {} ({}) still not finished, giving up waiting on it'.format(job.name, jobid))
+                results[job.name] = BatchJobResult(job.name, jobid, 'timeout', None, None, 'still running when we gave up waiting')
+                return
+
+            await asyncio.sleep(delay)
+            delay = min(delay * self.poll_backoff, self.poll_max)
+
+            try:
+                jobstatus = await loop.run_in_executor(None, self._status, jobid)
+            except Exception as e:  # a blip polling doesn't mean the job failed, so check again next time
+                logger.warning('Batch job {} ({}) status check failed: {}'.format(job.name, jobid, e))
+                continue
+
+            status = jobstatus.get('status')
+            if status == 'pending':
+                continue
+
+            polled = time.monotonic()
+            if started is None:  # first time we've seen it out of the queue
+                started = polled
+            if status == 'running':
+                continue
+
+            queued_seconds = int(started - submitted)
+            run_seconds = int(polled - started)
+            if status == 'done':
+                logger.info('Batch job {} ({}) done: queued {} seconds, ran {} seconds'.format(job.name, jobid, queued_seconds, run_seconds))
+                results[job.name] = BatchJobResult(job.name, jobid, 'done', queued_seconds, run_seconds, None)
+                if job.on_done:
+                    try:
+                        job.on_done(job.name)
+                    except Exception as e:
+                        logger.error('Batch job {} on_done failed: {}'.format(job.name, e))
+            else:  # failed, cancelled, or something unexpected
+                message = jobstatus.get('failed_reason') or 'status {}'.format(status)
+                logger.error('Batch job {} ({}) failed after queued {} seconds, ran {} seconds: {}'.format(job.name, jobid, queued_seconds, run_seconds, message))
+                results[job.name] = BatchJobResult(job.name, jobid, 'failed', queued_seconds, run_seconds, message)
+            return
+
+    def _submit(self, queries):
+        url = "{}?api_key={}".format(self.batchapiurl, self.apikey)
+        jobinfo = httpclient.post(url, json={'query': queries}).json()
+        if 'error' in jobinfo and jobinfo['error']:
+            raise ValueError(jobinfo['error'])
+        return jobinfo['job_id']
+
+    def _status(self, jobid):
+        url = "{}/{}?api_key={}".format(self.batchapiurl, jobid, self.apikey)
+        return httpclient.get(url).json()
+
+
+def check_job_graph(jobs):
+    """
+    Make sure every job's after list names other jobs in the list, and that there are no cycles,
+    which would otherwise leave those jobs waiting on one another forever.
+    """
+    byname = {job.name: job for job in jobs}
+    if len(byname) != len(jobs):
+        raise ValueError('Batch job names must be unique')
+
+    for job in jobs:
+        for dependency in job.after:
+            if dependency not in byname:
+                raise ValueError('Batch job {} is after {}, which is not one of the jobs'.format(job.name, dependency))
+
+    # peel off jobs whose dependencies are all peeled off already; whatever's left over is a cycle
+    remaining = set(byname)
+    while remaining:
+        ready = [name for name in remaining if not remaining.intersection(byname[name].after)]
+        if not ready:
+            raise ValueError('Batch jobs depend on one another in a cycle: {}'.format(', '.join(sorted(remaining))))
+        remaining.difference_update(ready)
@@ -0,0 +1,135 @@
+"""
+Dan's formulas for allocating blame for fatalities & injuries, as SQL and as NumPy
+
+BLAME_PASSES holds the SQL for the three passes, as column => expression, which main.py's update_blame_allocations() runs as UPDATEs:
+* define crashes with no known vehicle types, and those with only bikes & scooters to take the blame
+* multiply blame coefficient * injury/fatality count to get number to blame per mode
+* assign the per mode injury/fatality blames, usually all-or-nothing
+
+allocate_blame() does the same arithmetic on arrays, for a batch of crashes whose hasvehicle flags and counts we have in hand,
+so they can be INSERTed or corrected with their blame already filled in, instead of waiting for those three passes.
+The two must stay in agreement; see blamecheck/compare_blame.py which runs both over a synthetic set of crashes.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+# the hasvehicle_XXX flags which the formulas look at
+VEHICLE_FLAGS = ['bicycle', 'motorcycle', 'scooter', 'busvan', 'car', 'suv', 'truck', 'other']
+
+# the counts which get allocated, and the crashes table fields they come from; persons is the sum of the other three
+ALLOCATED_COUNTS = ['cyclist_injured', 'cyclist_killed', 'motorist_injured', 'motorist_killed', 'pedestrian_injured', 'pedestrian_killed', 'persons_injured', 'persons_killed']
+COUNT_FIELDS = ['number_of_{}_{}'.format(mode, outcome) for mode in ('cyclist', 'motorist', 'pedestrian') for outcome in ('injured', 'killed')]
+
+# the per-mode blame columns e.g. pedestrian_killed_bytruck, and when that mode gets the blame
+BLAME_BY = [
+    ('bike', "bike_blame is TRUE AND hasvehicle_bicycle is TRUE"),
+    ('scooter', "bike_blame is TRUE AND hasvehicle_scooter is TRUE"),
+    ('motorcycle', "hasvehicle_motorcycle is TRUE"),
+    ('busvan', "hasvehicle_busvan is TRUE"),
+    ('car', "hasvehicle_car is TRUE"),
+    ('suv', "hasvehicle_suv is TRUE"),
+    ('truck', "hasvehicle_truck is TRUE"),
+    ('other', "hasvehicle_other_unspecified is TRUE"),
+]
+
+TOTAL8 = "hasvehicle_bicycle::int + hasvehicle_motorcycle::int + hasvehicle_scooter::int + hasvehicle_busvan::int + hasvehicle_car::int + hasvehicle_suv::int + hasvehicle_truck::int + hasvehicle_other::int"
+MOTOR6 = "hasvehicle_motorcycle::int + hasvehicle_busvan::int + hasvehicle_car::int + hasvehicle_suv::int + hasvehicle_truck::int + hasvehicle_other::int"
+
+
+def allocated_expression(countname):
+    mode, outcome = countname.split('_')
+    if mode == 'persons':
+        return "(blame_factor * (number_of_pedestrian_{0} + number_of_cyclist_{0} + number_of_motorist_{0}) )".format(outcome)
+    return "(blame_factor * number_of_{0}_{1})".format(mode, outcome)
+
+
+# each pass is (column => SQL expression, WHERE clause for which rows still need it)
+BLAME_PASSES = [
+    (OrderedDict([
+        # set other to TRUE if nothing else is selected, which catches crashes with no vtype data
+        ('hasvehicle_other_unspecified', "CASE WHEN ({0} = 0) THEN TRUE ELSE hasvehicle_other END".format(TOTAL8)),
+        # Determine if this record will "blame" bikes or scooters for injuries or deaths, only in cases with no other motor vehicles
+        ('bike_blame', "CASE WHEN (hasvehicle_bicycle OR hasvehicle_scooter) AND ({0} = 0) THEN TRUE ELSE FALSE END".format(MOTOR6)),
+        # determine the number of blameable vehicles involved and then turn to percentage blame
+        ('blame_factor', """CASE
+            WHEN (hasvehicle_bicycle OR hasvehicle_scooter) AND ({1} = 0)
+            THEN (1 / CAST (NULLIF((hasvehicle_bicycle::int + hasvehicle_scooter::int),0) as FLOAT))
+            ELSE (1 / CAST (NULLIF(({1}) + (CASE WHEN ({0} = 0) THEN 1 ELSE 0 END),0) as FLOAT))
+        END""".format(TOTAL8, MOTOR6)),
+    ]), "hasvehicle_other_unspecified IS NULL"),
+    (OrderedDict([
+        ('{}_allocated'.format(countname), allocated_expression(countname)) for countname in ALLOCATED_COUNTS
+    ]), "persons_injured_allocated IS NULL"),
+    (OrderedDict([
+        ('{}_by{}'.format(countname, bymode), "CASE WHEN ({0}) THEN {1}_allocated ELSE 0 END".format(condition, countname))
+        for bymode, condition in BLAME_BY for countname in ALLOCATED_COUNTS
+    ]), "cyclist_injured_bycar IS NULL"),
+]
+
+# every column which the blame passes fill in, in order
+BLAME_COLUMNS = [column for expressions, where in BLAME_PASSES for column in expressions]
+
+
+def allocate_blame(flags, counts):
+    """
+    The NumPy equivalent of BLAME_PASSES, for a batch of crashes.
+    Returns an OrderedDict of each of BLAME_COLUMNS => array, booleans for the flags and floats for the rest
+    @param {flags} dict of VEHICLE_FLAGS e.g. car => boolean array
+    @param {counts} dict of COUNT_FIELDS e.g. number_of_cyclist_injured => integer array
+    """
+    has = {name: np.asarray(flags[name], dtype=bool) for name in VEHICLE_FLAGS}
+    asint = {name: has[name].astype(np.int64) for name in VEHICLE_FLAGS}
+    total8 = sum([asint[name] for name in VEHICLE_FLAGS])
+    motor6 = sum([asint[name] for name in ('motorcycle', 'busvan', 'car', 'suv', 'truck', 'other')])
+
+    result = OrderedDict()
+
+    # pass 1
+    result['hasvehicle_other_unspecified'] = np.where(total8 == 0, True, has['other'])
+    bike_blame = (has['bicycle'] | has['scooter']) & (motor6 == 0)
+    result['bike_blame'] = bike_blame
+    # the denominators are never 0: bike_blame means a bike or scooter, otherwise there's a motor vehicle or the 1 for no vehicles
+    bikes = asint['bicycle'] + asint['scooter']
+    others = motor6 + (total8 == 0).astype(np.int64)
+    with np.errstate(divide='ignore'):
+        blame_factor = np.where(bike_blame, 1 / bikes.astype(np.float64), 1 / others.astype(np.float64))
+    result['blame_factor'] = blame_factor
+
+    # pass 2
+    count = {name: np.asarray(counts[name], dtype=np.int64) for name in COUNT_FIELDS}
+    allocated = {}
+    for countname in ALLOCATED_COUNTS:
+        mode, outcome = countname.split('_')
+        if mode == 'persons':
+            howmany = count['number_of_pedestrian_{}'.format(outcome)] + count['number_of_cyclist_{}'.format(outcome)] + count['number_of_motorist_{}'.format(outcome)]
+        else:
+            howmany = count['number_of_{}_{}'.format(mode, outcome)]
+        allocated[countname] = blame_factor * howmany
+        result['{}_allocated'.format(countname)] = allocated[countname]
+
+    # pass 3
+    blamed = {
+        'bike': bike_blame & has['bicycle'],
+        'scooter': bike_blame & has['scooter'],
+        'motorcycle': has['motorcycle'],
+        'busvan': has['busvan'],
+        'car': has['car'],
+        'suv': has['suv'],
+        'truck': has['truck'],
+        'other': result['hasvehicle_other_unspecified'],
+    }
+    for bymode, condition in BLAME_BY:
+        for countname in ALLOCATED_COUNTS:
+            result['{}_by{}'.format(countname, bymode)] = np.where(blamed[bymode], allocated[countname], 0.0)
+
+    return result
+
+
+def sql_literal(value):
+    # a value from allocate_blame() for a VALUES list; repr() of a float round-trips exactly
+    if isinstance(value, (bool, np.bool_)):
+        return 'true' if value else 'false'
+    return repr(float(value))
@@ -0,0 +1,84 @@
+"""
+Checkpoints which persist from one run to the next, e.g. the high-water marks of what we've already fetched from SODA
+
+These are kept in a small CARTO table of name/value text pairs, since the Heroku dyno's filesystem doesn't persist.
+Values set during a run are only written by save(), so a run which fails partway doesn't advance anything.
+If the table can't be read, we start with no checkpoints, and callers should fall back to their full fetch.
+
+The table is created once, by hand:
+    CREATE TABLE etl_checkpoints (name text PRIMARY KEY, value text, updated_at timestamptz)
+"""
+
+import logging
+
+import requests
+
+from etlcommon import httpclient
+
+
+logger = logging.getLogger()
+
+
+class CheckpointStore:
+    def __init__(self, sqlapiurl, tablename):
+        self.sqlapiurl = sqlapiurl
+        self.tablename = tablename
+        self.values = {}
+        self.changed = {}
+
+    def load(self):
+        sql = "SELECT name, value FROM {}".format(self.tablename)
+        try:
+            reply = httpclient.get(self.sqlapiurl, params={'q': sql}).json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            reply = {'error': str(e)}
+
+        if 'rows' not in reply:
+            logger.warning('Could not load checkpoints from {}, starting without them: {}'.format(self.tablename, reply.get('error')))
+            return
+
+        self.values = {row['name']: row['value'] for row in reply['rows']}
+        logger.info('Loaded {} checkpoints from {}'.format(len(self.values), self.tablename))
+
+    def get(self, name, default=None):
+        if name in self.changed:
+            return self.changed[name]
+        return self.values.get(name, default)
+
+    def set(self, name, value):
+        self.changed[name] = str(value)
+
+    def discard(self, name):
+        # forget a value set during this run, so the saved one stands e.g. if what it describes didn't all get done
+        self.changed.pop(name, None)
+
+    def upsert_sql(self, values):
+        """
+        The INSERT which writes the given checkpoints, e.g. to run in the same statement as the update they describe
+        @param {values} dict of name => value
+        """
+        values = ','.join(["($${}$$, $${}$$, now())".format(name, value) for name, value in values.items()])
+        return """
+        INSERT INTO {0} (name, value, updated_at) VALUES {1}
+        ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+        """.format(self.tablename, values)
+
+    def save(self):
+        if not self.changed:
+            return True
+
+        sql = self.upsert_sql(self.changed)
+
+        try:
+            reply = httpclient.post(self.sqlapiurl, data={'q': sql}).json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            reply = {'error': str(e)}
+
+        if 'error' in reply:
+            logger.warning('Could not save checkpoints to {}: {}'.format(self.tablename, reply['error']))
+            return False
+
+        logger.info('Saved checkpoints: {}'.format(', '.join(['{}={}'.format(name, value) for name, value in sorted(self.changed.items())])))
+        self.values.update(self.changed)
+        self.changed = {}
+        return True
@@ -0,0 +1,42 @@
+"""
+Adaptive sizing for the chunks of records INSERTed via the CARTO SQL API
+
+CARTO keeps lowering their query timeouts, and the safe number of records per INSERT
+depends on the day's load over there. Rather than hand-tuning a constant, grow the chunk
+a little after each quick query and cut it sharply after a slow one or a timeout (AIMD),
+aiming for a query time under the target.
+"""
+
+
+class AdaptiveChunkSizer:
+    def __init__(self, initial=50, minimum=1, maximum=500, target_seconds=5.0, increase=10, decrease_factor=0.5):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+
+    def record(self, seconds):
+        # a chunk went through, taking this many seconds per CARTO's "time" field
+        if seconds > self.target_seconds:
+            self.size = max(self.minimum, int(self.size * self.decrease_factor))
+        else:
+            self.size = min(self.maximum, self.size + self.increase)
+
+    def timed_out(self):
+        # a chunk hit the query timeout; it will be split and sent again, and later chunks should be smaller too
+        self.size = max(self.minimum, int(self.size * self.decrease_factor))
+
+
+def is_timeout_error(error):
+    """
+    Does this CARTO SQL API error indicate a query timeout, as opposed to something which retrying won't fix?
+    That's CARTO cancelling the statement, so nothing went in and a smaller chunk may make it.
+    Not our own request timing out e.g. requests' "read timeout=300", since the INSERT may well have committed over there.
+    The error may be a list of messages as CARTO gives it, or a single string.
+    """
+    if isinstance(error, (list, tuple)):
+        error = ' '.join(str(e) for e in error)
+    error = str(error).lower()
+    return 'statement timeout' in error or 'query timeout' in error
@@ -0,0 +1,63 @@
+"""
+Distance calculations for comparing crash locations, e.g. finding crashes which SODA has since moved
+
+haversine() compares a single pair of points, as the scripts have always done.
+haversine_array() does the same for whole columns of points at once via NumPy, which matters when
+comparing the whole crash table; a missing coordinate gives a NaN distance for that row.
+within_extent() checks a point against a bounding box e.g. NYC's, to reject badly geocoded crashes e.g. null island.
+"""
+
+from math import radians, cos, sin, asin, sqrt
+
+import numpy as np
+
+
+EARTH_RADIUS_METERS = 6372800
+
+
+# a Haversine implementationm in Python, modified to return integer meters
+# https://stackoverflow.com/questions/4913349/haversine-formula-in-python-bearing-and-distance-between-two-gps-points
+def haversine(lat1, lon1, lat2, lon2):
+    dLat = radians(lat2 - lat1)
+    dLon = radians(lon2 - lon1)
+    lat1 = radians(lat1)
+    lat2 = radians(lat2)
+
+    a = sin(dLat / 2)**2 + cos(lat1) * cos(lat2) * sin(dLon / 2)**2
+    c = 2 * asin(sqrt(a))
+
+    return int(round(EARTH_RADIUS_METERS * c))
+
+
+def coordinate_array(values):
+    """
+    Convert a list of coordinates as they come from CSVs and APIs into a float array, with None and '' becoming NaN.
+    @param {values} list of numbers or numeric strings, maybe None or ''
+    """
+    return np.array([float(value) if value not in (None, '') else np.nan for value in values], dtype=np.float64)
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    """
+    Vectorized version of haversine(), returning meters for each row, rounded same as haversine() does.
+    Rows with any missing coordinate come back as NaN, which compares False against any threshold.
+    @param {lat1, lon1, lat2, lon2} arrays of equal length, e.g. from coordinate_array()
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64))
+
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+
+    # np.round() rounds half to even, but haversine() uses Python's round() which does too
+    return np.round(EARTH_RADIUS_METERS * c)
+
+
+def within_extent(extent, lng, lat):
+    """
+    Is the point within the extent, edges included, same as ST_Intersects() with a box?
+    @param {extent} tuple of (xmin, ymin, xmax, ymax)
+    """
+    return extent[0] <= lng <= extent[2] and extent[1] <= lat <= extent[3]
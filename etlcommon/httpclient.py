@@ -0,0 +1,111 @@
+"""
+One pooled HTTP client for all of the CARTO and SODA requests
+
+A single requests.Session keeps connections alive between requests, instead of a new TLS handshake for every call.
+This also fills in what every caller would otherwise have to remember:
+* a default timeout, so a hung connection can't stall a run forever
+* gzip-compressed responses, which requests decodes for us
+* the Socrata app token on SODA requests, so we get the higher rate limits
+* the CARTO API key on CARTO SQL API requests, unless the caller already gave one (e.g. the master key)
+and it tallies requests and bytes per host, see stats_lines()
+
+Usage is the same as requests.get() and requests.post(), and errors are still requests.exceptions.RequestException
+"""
+
+import os
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+CARTO_API_KEY = os.environ.get('CARTO_API_KEY')
+SOCRATA_APP_TOKEN_PUBLIC = os.environ.get('SOCRATA_APP_TOKEN_PUBLIC')
+
+SODA_HOSTS = ('data.cityofnewyork.us', )
+CARTO_HOST_SUFFIX = '.carto.com'
+
+DEFAULT_TIMEOUT = (15, 300)  # seconds to connect, seconds to wait for a response; SODA pages and CARTO queries can be slow
+POOL_SIZE = 16  # connections kept open per host; more than our largest worker pool
+
+
+_session = None
+_sessionlock = threading.Lock()
+
+_stats = {}  # hostname => {'requests': N, 'bytes': N}
+_statslock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _sessionlock:
+        if _session is None:
+            _session = requests.Session()
+
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+
+            _session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _session.hooks['response'].append(_count_response)
+        return _session
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    _add_credentials(method, url, kwargs)
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def stats_lines():
+    # one line of text per host, for logging at the end of a run
+    with _statslock:
+        return [
+            "{}: {} requests, {:.1f} KB".format(host, info['requests'], info['bytes'] / 1024.0)
+            for host, info in sorted(_stats.items())
+        ]
+
+
+def _add_credentials(method, url, kwargs):
+    host = urlparse(url).hostname or ''
+
+    if host in SODA_HOSTS and SOCRATA_APP_TOKEN_PUBLIC:
+        headers = dict(kwargs.get('headers') or {})
+        headers.setdefault('X-App-Token', SOCRATA_APP_TOKEN_PUBLIC)
+        kwargs['headers'] = headers
+    elif host.endswith(CARTO_HOST_SUFFIX) and CARTO_API_KEY and 'api_key=' not in url:
+        # GETs carry the key in the query string, POSTs in the form body; the Batch API always gives its own key in the URL
+        if method == 'GET':
+            params = dict(kwargs.get('params') or {})
+            params.setdefault('api_key', CARTO_API_KEY)
+            kwargs['params'] = params
+        elif isinstance(kwargs.get('data'), dict):
+            data = dict(kwargs['data'])
+            data.setdefault('api_key', CARTO_API_KEY)
+            kwargs['data'] = data
+
+
+def _count_response(response, *args, **kwargs):
+    # Content-Length is the size on the wire, i.e. compressed; if it's not given, count the decoded body unless it's streamed
+    size = response.headers.get('Content-Length')
+    if size:
+        size = int(size)
+    elif not kwargs.get('stream'):
+        size = len(response.content)
+    else:
+        size = 0
+
+    host = urlparse(response.url).hostname
+    with _statslock:
+        info = _stats.setdefault(host, {'requests': 0, 'bytes': 0})
+        info['requests'] += 1
+        info['bytes'] += size
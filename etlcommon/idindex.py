@@ -0,0 +1,75 @@
+"""
+A compact on-disk index of the socrata_id values already loaded into CARTO
+
+The collision_id values from SODA are sequential integers in the low millions,
+so a bitmap with one bit per possible ID is only a few hundred KB
+and answers "do we already have this crash?" in constant time.
+
+The file also records the highest cartodb_id seen, so the ETL can catch up on
+new CARTO records (including ones loaded by the backlog script) with a cheap query
+instead of re-reading every socrata_id in the table.
+"""
+
+import os
+import struct
+
+
+# file layout: magic, then the cartodb_id high-water mark, then the raw bitmap bytes
+FILE_MAGIC = b'SIDX1'
+FILE_HEADER = struct.Struct('<5sQ')
+
+# bits set in each possible byte value, for counting without a loop over every bit
+BITS_PER_BYTE = bytes(bin(i).count('1') for i in range(256))
+
+
+class SocrataIdIndex:
+    def __init__(self, filename=None):
+        # filename may be None for an in-memory index which is never saved
+        self.filename = filename
+        self.bitmap = bytearray()
+        self.max_cartodb_id = 0
+        self.howmany = 0
+
+        if self.filename and os.path.exists(self.filename):
+            self.load()
+
+    def __contains__(self, socrata_id):
+        # CARTO and SODA hand these back as ints, floats, or numeric strings; normalize so they always compare
+        socrata_id = int(float(socrata_id))
+        byteindex = socrata_id >> 3
+        return byteindex < len(self.bitmap) and bool(self.bitmap[byteindex] & (1 << (socrata_id & 7)))
+
+    def __len__(self):
+        return self.howmany
+
+    def add(self, socrata_id):
+        socrata_id = int(float(socrata_id))
+        byteindex = socrata_id >> 3
+        if byteindex >= len(self.bitmap):
+            # grow with some headroom, so a night's worth of new IDs doesn't reallocate every time
+            self.bitmap.extend(bytes(byteindex - len(self.bitmap) + 1 + 65536))
+
+        bit = 1 << (socrata_id & 7)
+        if not self.bitmap[byteindex] & bit:
+            self.bitmap[byteindex] |= bit
+            self.howmany += 1
+
+    def load(self):
+        with open(self.filename, 'rb') as fh:
+            (magic, self.max_cartodb_id) = FILE_HEADER.unpack(fh.read(FILE_HEADER.size))
+            if magic != FILE_MAGIC:
+                raise ValueError("{} is not a socrata_id index file".format(self.filename))
+            self.bitmap = bytearray(fh.read())
+
+        self.howmany = sum(self.bitmap.translate(BITS_PER_BYTE))
+
+    def save(self):
+        if not self.filename:
+            return
+
+        # write to a temp file and swap it in, so a crash mid-write can't leave a truncated index
+        tempfilename = self.filename + '.tmp'
+        with open(tempfilename, 'wb') as fh:
+            fh.write(FILE_HEADER.pack(FILE_MAGIC, self.max_cartodb_id))
+            fh.write(self.bitmap)
+        os.replace(tempfilename, self.filename)
@@ -0,0 +1,133 @@
+"""
+Find which nyc_intersections circle a crash is in, locally, so each crash carries an intersection_id
+and the intersection crash counts are a GROUP BY instead of a nightly ST_CONTAINS join
+
+The circles are fetched from CARTO as their center and radius in meters, not as polygons,
+and cached on disk keyed by a checksum of the table the same as the boundary polygons, see etlcommon/places.py
+Points are projected into meters around the circles' mean latitude, which over the few km of NYC is well under a meter off,
+and a grid of cells as big as the largest circle means a point only needs to be compared to the circles in its own and the 8 neighboring cells.
+
+Circles can overlap at closely-spaced intersections; a crash in more than one is assigned to the one whose center is nearest.
+intersection_id is 0 for a crash which was looked up but isn't in any circle, so it's not looked up again;
+NULL means not yet looked up, and the nightly intersections batch job fills those in.
+"""
+
+import json
+import logging
+import math
+import os
+
+import requests
+
+from etlcommon.places import carto_rows
+
+
+logger = logging.getLogger()
+
+
+METERS_PER_DEGREE = 111320.0  # along a meridian; along a parallel it's this times cos(latitude)
+
+NO_INTERSECTION = 0  # intersection_id for a crash which isn't in any circle
+
+
+class IntersectionFinder:
+    """
+    @param {circles} list of (cartodb_id, lng, lat, radius in meters)
+    """
+    def __init__(self, circles):
+        self.circles = circles
+        self.reflat = sum([lat for cartodb_id, lng, lat, radius in circles]) / len(circles)
+        self.xscale = METERS_PER_DEGREE * math.cos(math.radians(self.reflat))
+        self.cellsize = max([radius for cartodb_id, lng, lat, radius in circles])
+
+        self.grid = {}  # (col, row) => list of (cartodb_id, x, y, radius) with the center in that cell
+        for cartodb_id, lng, lat, radius in circles:
+            x, y = self.project(lng, lat)
+            self.grid.setdefault(self.cell(x, y), []).append((cartodb_id, x, y, radius))
+
+    def project(self, lng, lat):
+        return (lng * self.xscale, lat * METERS_PER_DEGREE)
+
+    def cell(self, x, y):
+        return (int(x // self.cellsize), int(y // self.cellsize))
+
+    def find(self, lng, lat):
+        """
+        The cartodb_id of the intersection circle containing the point, or NO_INTERSECTION
+        """
+        x, y = self.project(lng, lat)
+        col, row = self.cell(x, y)
+
+        found = NO_INTERSECTION
+        nearest = None
+        for neighbor in ((col + i, row + j) for i in (-1, 0, 1) for j in (-1, 0, 1)):
+            for cartodb_id, cx, cy, radius in self.grid.get(neighbor, ()):
+                distance = math.hypot(x - cx, y - cy)
+                if distance <= radius and (nearest is None or distance < nearest):
+                    found = cartodb_id
+                    nearest = distance
+        return found
+
+
+def has_intersection_id(sqlapiurl, crashestable):
+    """
+    Does the crashes table have its intersection_id column yet? It's added by hand, see the README.
+    Until it does, crashes are inserted without it and the intersections batch job is skipped, rather than both failing every night.
+    Returns False if the column is missing, or if we couldn't tell.
+    @param {sqlapiurl} CARTO SQL API URL
+    @param {crashestable} e.g. crashes_all_prod
+    """
+    sql = "SELECT column_name FROM information_schema.columns WHERE table_name = '{}' AND column_name = 'intersection_id'".format(crashestable)
+    try:
+        found = len(carto_rows(sqlapiurl, sql)) > 0
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning('Could not check {} for intersection_id, leaving it alone this run: {}'.format(crashestable, e))
+        return False
+
+    if not found:
+        logger.warning('{} has no intersection_id column yet, so the intersection crash counts are skipped; see the README'.format(crashestable))
+    return found
+
+
+def load_intersection_finder(sqlapiurl, intersectionstable, cachedir):
+    """
+    Load the intersection circles from the cache or from CARTO, and index them.
+    Returns an IntersectionFinder, or None if they couldn't be loaded; crashes would then get their intersection_id from the batch job.
+    @param {sqlapiurl} CARTO SQL API URL
+    @param {intersectionstable} e.g. nyc_intersections
+    @param {cachedir} folder for the cached circles, created if needed
+    """
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        circles = load_circles(sqlapiurl, intersectionstable, cachedir)
+        finder = IntersectionFinder(circles)
+    except (requests.exceptions.RequestException, ValueError, KeyError, OSError, ZeroDivisionError) as e:
+        logger.warning('Could not load intersections, new crashes will get their intersection_id from the batch job instead: {}'.format(e))
+        return None
+
+    logger.info('Intersections {}: {} circles'.format(intersectionstable, len(circles)))
+    return finder
+
+
+def load_circles(sqlapiurl, intersectionstable, cachedir):
+    sql = "SELECT md5(string_agg(md5(ST_AsEWKB(the_geom)), ',' ORDER BY cartodb_id)) AS checksum FROM {} WHERE the_geom IS NOT NULL".format(intersectionstable)
+    checksum = carto_rows(sqlapiurl, sql)[0]['checksum']
+
+    cachefile = os.path.join(cachedir, '{}-{}.json'.format(intersectionstable, checksum))
+    if os.path.exists(cachefile):
+        with open(cachefile) as fh:
+            return json.load(fh)
+
+    # the distance from the center to the nearest point on the edge, so a point within the radius is within the polygon
+    sql = """
+    SELECT cartodb_id, ST_X(center) AS lng, ST_Y(center) AS lat, ST_Distance(center::geography, ST_Boundary(the_geom)::geography) AS radius
+    FROM (SELECT cartodb_id, the_geom, ST_Centroid(the_geom) AS center FROM {} WHERE the_geom IS NOT NULL) circles
+    ORDER BY cartodb_id
+    """.format(intersectionstable)
+    circles = [(row['cartodb_id'], row['lng'], row['lat'], row['radius']) for row in carto_rows(sqlapiurl, sql)]
+
+    # write then rename, so a run which dies partway doesn't leave a broken cache file
+    with open(cachefile + '.tmp', 'w') as fh:
+        json.dump(circles, fh)
+    os.replace(cachefile + '.tmp', cachefile)
+    return circles
@@ -0,0 +1,135 @@
+"""
+Decide what maintenance a table needs, from its dead-tuple and size stats, instead of a VACUUM FULL every time
+
+VACUUM FULL rewrites the whole table under an exclusive lock; that's worth it when the table file is mostly empty space
+e.g. after a big backlog update, since the bloat counts against our CARTO storage quota, but not after a night of a few hundred updates.
+The stats come from pg_stat_user_tables, plus an estimate of how big the table would be if packed tight
+from the rows' average width in pg_stats, the same estimate check_postgres and the like use, since pgstattuple isn't available on CARTO.
+
+The actions, from most to least drastic:
+* full = VACUUM FULL ANALYZE, if the table file is mostly empty space and that's a lot of bytes
+* vacuum = VACUUM ANALYZE, if there are a lot of dead rows; this frees their space for reuse but doesn't shrink the file
+* analyze = ANALYZE, if a lot of rows changed since the planner stats were last updated
+* none, if none of the above
+"""
+
+import logging
+from collections import namedtuple
+
+import requests
+
+from etlcommon import httpclient
+
+
+logger = logging.getLogger()
+
+
+MaintenanceThresholds = namedtuple('MaintenanceThresholds', [
+    'full_bloat_ratio',  # VACUUM FULL if at least this fraction of the table file is estimated to be empty space...
+    'full_min_bytes',  # ...and that's at least this many bytes
+    'vacuum_dead_ratio',  # VACUUM if at least this fraction of the rows are dead...
+    'vacuum_min_dead',  # ...or at least this many
+    'analyze_min_modified',  # ANALYZE if at least this many rows changed since the last ANALYZE
+])
+
+DEFAULT_THRESHOLDS = MaintenanceThresholds(
+    full_bloat_ratio=0.4,
+    full_min_bytes=200 * 1024 * 1024,
+    vacuum_dead_ratio=0.05,
+    vacuum_min_dead=20000,
+    analyze_min_modified=1000,
+)
+
+# per-row overhead when estimating the packed size: 23 byte tuple header plus alignment, and the 4 byte line pointer
+ROW_OVERHEAD_BYTES = 28
+PAGE_FILL = 0.9  # pages are never packed completely full
+
+TableStats = namedtuple('TableStats', ['live_rows', 'dead_rows', 'modified_since_analyze', 'table_bytes', 'total_bytes', 'packed_bytes'])
+
+# action is full, vacuum, analyze, or none; sql is None for none
+MaintenancePlan = namedtuple('MaintenancePlan', ['action', 'sql', 'reason', 'stats'])
+
+
+def fetch_table_stats(sqlapiurl, apikey, tablename):
+    """
+    The table's stats, see TableStats; or None if they couldn't be fetched
+    @param {sqlapiurl} CARTO SQL API URL
+    @param {apikey} CARTO API key which can read the table's stats
+    @param {tablename} e.g. crashes_all_prod
+    """
+    sql = """
+    SELECT
+        s.n_live_tup AS live_rows, s.n_dead_tup AS dead_rows, s.n_mod_since_analyze AS modified_since_analyze,
+        pg_relation_size(s.relid) AS table_bytes, pg_total_relation_size(s.relid) AS total_bytes,
+        (SELECT SUM(avg_width) FROM pg_stats WHERE schemaname = s.schemaname AND tablename = s.relname) AS row_width
+    FROM pg_stat_user_tables s
+    WHERE s.relname = '{}'
+    """.format(tablename)
+
+    try:
+        reply = httpclient.post(sqlapiurl, data={'q': sql, 'api_key': apikey}).json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        reply = {'error': str(e)}
+    if not reply.get('rows'):
+        logger.warning('Could not fetch table stats for {}: {}'.format(tablename, reply.get('error')))
+        return None
+
+    row = reply['rows'][0]
+    live_rows = int(row['live_rows'] or 0)
+    # no pg_stats means the table has never been analyzed, so we can't tell how packed it is; call it packed
+    if row['row_width'] is None:
+        packed_bytes = int(row['table_bytes'])
+    else:
+        packed_bytes = int(live_rows * (float(row['row_width']) + ROW_OVERHEAD_BYTES) / PAGE_FILL)
+
+    return TableStats(
+        live_rows=live_rows,
+        dead_rows=int(row['dead_rows'] or 0),
+        modified_since_analyze=int(row['modified_since_analyze'] or 0),
+        table_bytes=int(row['table_bytes']),
+        total_bytes=int(row['total_bytes']),
+        packed_bytes=packed_bytes,
+    )
+
+
+def choose_maintenance(tablename, stats, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Pick the maintenance for the table per its TableStats, see the module docstring
+    Returns a MaintenancePlan
+    """
+    wasted_bytes = max(stats.table_bytes - stats.packed_bytes, 0)
+    bloat_ratio = float(wasted_bytes) / stats.table_bytes if stats.table_bytes else 0.0
+    dead_ratio = float(stats.dead_rows) / (stats.live_rows + stats.dead_rows) if stats.live_rows + stats.dead_rows else 0.0
+
+    # dead rows will be empty space once vacuumed, so a FULL now saves a plain VACUUM then a FULL later
+    if bloat_ratio >= thresholds.full_bloat_ratio and wasted_bytes >= thresholds.full_min_bytes:
+        return MaintenancePlan('full', 'VACUUM FULL ANALYZE {}'.format(tablename), 'an estimated {:.0%} of the table, {} MB, is empty space'.format(bloat_ratio, wasted_bytes // (1024 * 1024)), stats)
+    if dead_ratio >= thresholds.vacuum_dead_ratio or stats.dead_rows >= thresholds.vacuum_min_dead:
+        return MaintenancePlan('vacuum', 'VACUUM ANALYZE {}'.format(tablename), '{} dead rows, {:.1%} of the table'.format(stats.dead_rows, dead_ratio), stats)
+    if stats.modified_since_analyze >= thresholds.analyze_min_modified:
+        return MaintenancePlan('analyze', 'ANALYZE {}'.format(tablename), '{} rows changed since the last ANALYZE'.format(stats.modified_since_analyze), stats)
+    return MaintenancePlan('none', None, 'only {} dead rows, {} changed rows, and an estimated {:.0%} empty space'.format(stats.dead_rows, stats.modified_since_analyze, bloat_ratio), stats)
+
+
+def plan_table_maintenance(sqlapiurl, apikey, tablename, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Fetch the table's stats and pick its maintenance, logging what was measured and what was decided.
+    If the stats can't be fetched, fall back to a plain VACUUM ANALYZE, which is safe to run any time.
+    Returns a MaintenancePlan
+    @param {sqlapiurl} CARTO SQL API URL
+    @param {apikey} CARTO API key which can read the table's stats
+    @param {tablename} e.g. crashes_all_prod
+    @param {thresholds} MaintenanceThresholds
+    """
+    stats = fetch_table_stats(sqlapiurl, apikey, tablename)
+    if stats is None:
+        plan = MaintenancePlan('vacuum', 'VACUUM ANALYZE {}'.format(tablename), 'no table stats', None)
+    else:
+        logger.info('Table {}: {} live rows, {} dead rows, {} changed since ANALYZE, table {} MB of which an estimated {} MB packed, {} MB with indexes'.format(
+            tablename, stats.live_rows, stats.dead_rows, stats.modified_since_analyze,
+            stats.table_bytes // (1024 * 1024), stats.packed_bytes // (1024 * 1024), stats.total_bytes // (1024 * 1024)
+        ))
+        plan = choose_maintenance(tablename, stats, thresholds)
+
+    logger.info('Table {} maintenance: {}, since {}'.format(tablename, plan.action, plan.reason))
+    return plan
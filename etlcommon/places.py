@@ -0,0 +1,185 @@
+"""
+Find which borough, city council district, precinct, etc. a crash is in, locally, so new crashes can be inserted already tagged
+
+The boundary polygons are downloaded from CARTO as GeoJSON, and cached on disk keyed by a checksum of the table,
+so they're only downloaded again when the polygons have changed. The checksum is calculated by CARTO, so it's one small query.
+Each layer gets a grid index of its polygons' bounding boxes, then a point-in-polygon test on the few candidates,
+allowing for multipolygons and holes.
+
+This is meant to match PostGIS ST_Within() for all but points right on a boundary line;
+the nightly places batch job stays in place to catch any crash this missed.
+"""
+
+import json
+import logging
+import os
+
+import requests
+
+from etlcommon import httpclient
+
+
+logger = logging.getLogger()
+
+
+GRID_CELL_DEGREES = 0.01  # about 1 km; a point only needs to be tested against the polygons touching its cell
+
+
+class LayerIndex:
+    """
+    The polygons of one boundary layer, e.g. nyc_nypd_precinct, with a grid index to look up points
+    @param {features} list of (value, geojson geometry dict) where the geometry is a Polygon or MultiPolygon
+    """
+    def __init__(self, features):
+        self.parts = []  # tuples of (value, bbox, rings) for each polygon; a MultiPolygon is several
+        self.grid = {}  # (col, row) => indexes into self.parts
+
+        for value, geometry in features:
+            if geometry['type'] == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry['type'] == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+
+            for rings in polygons:
+                rings = [[(point[0], point[1]) for point in ring] for ring in rings]
+                xs = [x for x, y in rings[0]]
+                ys = [y for x, y in rings[0]]
+                bbox = (min(xs), min(ys), max(xs), max(ys))
+
+                partindex = len(self.parts)
+                self.parts.append((value, bbox, rings))
+                for cell in grid_cells(bbox):
+                    self.grid.setdefault(cell, []).append(partindex)
+
+    def find(self, x, y):
+        """
+        The value of the polygon containing the point, or None
+        """
+        for partindex in self.grid.get(grid_cell(x, y), ()):
+            value, (xmin, ymin, xmax, ymax), rings = self.parts[partindex]
+            if x < xmin or x > xmax or y < ymin or y > ymax:
+                continue
+            # inside the exterior ring, and not inside any of the holes
+            if point_in_ring(x, y, rings[0]) and not any([point_in_ring(x, y, hole) for hole in rings[1:]]):
+                return value
+        return None
+
+
+def grid_cell(x, y):
+    return (int(x // GRID_CELL_DEGREES), int(y // GRID_CELL_DEGREES))
+
+
+def grid_cells(bbox):
+    (colmin, rowmin) = grid_cell(bbox[0], bbox[1])
+    (colmax, rowmax) = grid_cell(bbox[2], bbox[3])
+    return [(col, row) for col in range(colmin, colmax + 1) for row in range(rowmin, rowmax + 1)]
+
+
+def point_in_ring(x, y, ring):
+    # ray casting: count how many edges a ray going east from the point crosses; odd means inside
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+class PlaceFinder:
+    """
+    All of the boundary layers, see load_place_finder()
+    @param {layers} list of dicts like main.py's BOUNDARY_LAYERS
+    @param {indexes} dict of targetnamefield => LayerIndex
+    @param {columntypes} dict of targetnamefield => the crashes table column's SQL type, for casting literals
+    """
+    def __init__(self, layers, indexes, columntypes):
+        self.layers = layers
+        self.indexes = indexes
+        self.columntypes = columntypes
+        self.lastpoint = None
+        self.lastfound = None
+
+    def lookup(self, lng, lat):
+        """
+        A dict of targetnamefield => the value of the polygon containing the point, or None
+        The boundary columns each ask about the same point one after another, so remember the last one.
+        """
+        if (lng, lat) != self.lastpoint:
+            self.lastfound = {name: index.find(lng, lat) for name, index in self.indexes.items()}
+            self.lastpoint = (lng, lat)
+        return self.lastfound
+
+
+def load_place_finder(sqlapiurl, crashestable, layers, cachedir):
+    """
+    Load the boundary polygons for each of the layers, from the cache or from CARTO, and index them.
+    Returns a PlaceFinder, or None if any of it couldn't be loaded; crashes would then be inserted untagged as before.
+    @param {sqlapiurl} CARTO SQL API URL
+    @param {crashestable} name of the crashes table, to find the boundary columns' types
+    @param {layers} list of dicts like main.py's BOUNDARY_LAYERS
+    @param {cachedir} folder for the cached GeoJSON, created if needed
+    """
+    try:
+        columnnames = ','.join(["'{}'".format(boundinfo['targetnamefield']) for boundinfo in layers])
+        sql = "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = '{}' AND column_name IN ({})".format(crashestable, columnnames)
+        columntypes = {row['column_name']: row['data_type'] for row in carto_rows(sqlapiurl, sql)}
+
+        os.makedirs(cachedir, exist_ok=True)
+        indexes = {}
+        for boundinfo in layers:
+            features = load_layer_features(sqlapiurl, boundinfo, cachedir)
+            indexes[boundinfo['targetnamefield']] = LayerIndex(features)
+            logger.info('Boundaries {}: {} polygons'.format(boundinfo['polygontable'], len(features)))
+    except (requests.exceptions.RequestException, ValueError, KeyError, OSError) as e:
+        logger.warning('Could not load boundary polygons, new crashes will be tagged by the places batch job instead: {}'.format(e))
+        return None
+
+    return PlaceFinder(layers, indexes, columntypes)
+
+
+def load_layer_features(sqlapiurl, boundinfo, cachedir):
+    # the checksum covers each polygon's geometry and name, so any edit to the table means a new cache file
+    polygonname = "{}::text".format(boundinfo['polygonname'])
+    sql = "SELECT md5(string_agg(md5(ST_AsEWKB(the_geom)) || ':' || COALESCE({1}, ''), ',' ORDER BY cartodb_id)) AS checksum FROM {0} WHERE the_geom IS NOT NULL".format(boundinfo['polygontable'], polygonname)
+    checksum = carto_rows(sqlapiurl, sql)[0]['checksum']
+
+    cachefile = os.path.join(cachedir, '{}-{}.json'.format(boundinfo['polygontable'], checksum))
+    if os.path.exists(cachefile):
+        with open(cachefile) as fh:
+            return json.load(fh)
+
+    sql = "SELECT {1} AS value, ST_AsGeoJSON(the_geom, 6) AS geom FROM {0} WHERE the_geom IS NOT NULL ORDER BY cartodb_id".format(boundinfo['polygontable'], polygonname)
+    features = [(row['value'], json.loads(row['geom'])) for row in carto_rows(sqlapiurl, sql)]
+
+    # write then rename, so a run which dies partway doesn't leave a broken cache file
+    with open(cachefile + '.tmp', 'w') as fh:
+        json.dump(features, fh)
+    os.replace(cachefile + '.tmp', cachefile)
+    return features
+
+
+def carto_rows(sqlapiurl, sql):
+    reply = httpclient.get(sqlapiurl, params={'q': sql}).json()
+    if 'rows' not in reply:
+        raise ValueError('CARTO query failed: {}'.format(reply.get('error')))
+    return reply['rows']
+
+
+def load_extent(sqlapiurl, polygontable):
+    """
+    The bounding box of all of a layer's polygons e.g. nyc_borough, as (xmin, ymin, xmax, ymax)
+    Returns None if it couldn't be loaded.
+    """
+    sql = "SELECT ST_XMin(extent) AS xmin, ST_YMin(extent) AS ymin, ST_XMax(extent) AS xmax, ST_YMax(extent) AS ymax FROM (SELECT ST_Extent(the_geom) AS extent FROM {}) box".format(polygontable)
+    try:
+        row = carto_rows(sqlapiurl, sql)[0]
+        extent = (float(row['xmin']), float(row['ymin']), float(row['xmax']), float(row['ymax']))
+    except (requests.exceptions.RequestException, ValueError, KeyError, IndexError, TypeError) as e:
+        logger.warning('Could not load the extent of {}: {}'.format(polygontable, e))
+        return None
+
+    logger.info('Extent of {}: {}'.format(polygontable, extent))
+    return extent
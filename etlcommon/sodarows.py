@@ -0,0 +1,261 @@
+"""
+Transform SODA crash records into VALUES rows for INSERTing into the CARTO crashes table
+
+The crashes table's columns are listed once in CRASH_COLUMNS: the column name, what kind of SQL literal it is,
+and a getter which pulls its value from a SODA record. compile_transformer() turns that into one function
+which formats a whole row with a single str.format() call, and the INSERT queries take their column lists
+from CRASH_COLUMN_NAMES, so the two can't get out of step.
+
+This is run for every record loaded, so the getters avoid strptime() and the like:
+SODA dates are fixed-format strings, so we slice them instead.
+"""
+
+import re
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from etlcommon.blame import allocate_blame, sql_literal
+from etlcommon.geo import within_extent
+
+
+Column = namedtuple('Column', ['name', 'kind', 'getter'])
+
+# how each kind of column is written into the VALUES row
+# text is dollar quoted to escape single quotes in street names like "O'Brien"
+# sql means the getter already gives a complete SQL expression, e.g. null or ARRAY[...]
+PLACEHOLDERS = {
+    'int': '{}',
+    'text': '$${}$$',
+    'timestamptz': "'{}'::timestamptz",
+    'sql': '{}',
+}
+
+# the 5 potential values for contributing_factor and for vehicle_type; note the inconsistent naming from SODA
+CONTRIBUTING_FACTOR_FIELDS = ['contributing_factor_vehicle_{}'.format(i) for i in range(1, 6)]
+VEHICLE_TYPE_FIELDS = ['vehicle_type_code1', 'vehicle_type_code2'] + ['vehicle_type_code_{}'.format(i) for i in range(3, 6)]
+
+COMMA_SPLIT = re.compile(r'\s*,\s*')
+
+
+def crash_datetime(row):
+    """
+    The crash's date and time as an ISO string for date_val, from crash_date e.g. 2024-03-05T00:00:00.000
+    and crash_time which may have a single-digit hour e.g. 9:05
+    """
+    hhmm = row['crash_time']
+    if len(hhmm) != 5:
+        hour, minute = hhmm.split(':')
+        hhmm = '{:0>2}:{:0>2}'.format(hour, minute)
+    return '{}T{}:00Z'.format(row['crash_date'][:10], hhmm)
+
+
+def has_latlng(row):
+    # latitude and longitude may or may not be present
+    return row.get('latitude') and row.get('longitude')
+
+
+def the_geom(row):
+    if not has_latlng(row):
+        return 'null'
+    return "ST_GeomFromText('Point({0} {1})', 4326)".format(row['longitude'], row['latitude'])
+
+
+def the_geom_within(extent):
+    """
+    A Column for the_geom which is null if the point is outside the extent e.g. NYC's,
+    so badly geocoded crashes e.g. null island are inserted without a location, instead of being cleared afterward
+    The latitude and longitude columns keep SODA's values either way.
+    """
+    def getter(row):
+        if not has_latlng(row) or not within_extent(extent, float(row['longitude']), float(row['latitude'])):
+            return 'null'
+        return the_geom(row)
+    return Column('the_geom', 'sql', getter)
+
+
+def coordinate(fieldname):
+    return lambda row: row[fieldname] if has_latlng(row) else 'null'
+
+
+def stripped_text(fieldname):
+    return lambda row: row.get(fieldname, '').strip()
+
+
+def persons_count(which):
+    # Nov 2018, a few rare records (4022160, 4051650) lacks number_of_persons_X fields, which is a fatal error if we let it go
+    fieldname = 'number_of_persons_{}'.format(which)
+    parts = ['number_of_{}_{}'.format(mode, which) for mode in ('motorist', 'cyclist', 'pedestrians')]
+
+    def getter(row):
+        if fieldname in row:
+            return row[fieldname]
+        return sum([int(row[part]) for part in parts])
+    return getter
+
+
+def clean_text_value(value):
+    # quotes removed, spaces stripped
+    return value.replace("'", "").strip()
+
+
+def text_values(row, fieldnames):
+    """
+    Any values of the given fields e.g. vehicle_type_code1 through vehicle_type_code_5, as a list
+    A value may itself be a comma-separated list; these are split, cleaned, and blanks skipped.
+    """
+    items = []
+    for fieldname in fieldnames:
+        if fieldname not in row:
+            continue
+        value = row[fieldname]
+        for thisvalue in (COMMA_SPLIT.split(value) if ',' in value else (value,)):
+            toinsert = clean_text_value(thisvalue)
+            if toinsert:
+                items.append(toinsert)
+    return items
+
+
+def text_array(fieldnames):
+    # the text_values() formatted into a Postgres text array
+    def getter(row):
+        return "ARRAY[%s]::text[]" % ','.join(["'{0}'".format(value) for value in text_values(row, fieldnames)])
+    return getter
+
+
+CRASH_COLUMNS = [
+    Column('number_of_motorist_killed', 'int', lambda row: row['number_of_motorist_killed']),
+    Column('number_of_motorist_injured', 'int', lambda row: row['number_of_motorist_injured']),
+    Column('number_of_cyclist_killed', 'int', lambda row: row['number_of_cyclist_killed']),
+    Column('number_of_cyclist_injured', 'int', lambda row: row['number_of_cyclist_injured']),
+    Column('number_of_pedestrian_killed', 'int', lambda row: row['number_of_pedestrians_killed']),
+    Column('number_of_pedestrian_injured', 'int', lambda row: row['number_of_pedestrians_injured']),
+    Column('number_of_persons_killed', 'int', persons_count('killed')),
+    Column('number_of_persons_injured', 'int', persons_count('injured')),
+    Column('zip_code', 'text', lambda row: row.get('zip_code', '')),
+    Column('off_street_name', 'text', stripped_text('off_street_name')),
+    Column('cross_street_name', 'text', stripped_text('cross_street_name')),
+    Column('on_street_name', 'text', stripped_text('on_street_name')),
+    Column('borough', 'text', lambda row: ''),  # leave borough blank, the places updates do a better job
+    Column('date_val', 'timestamptz', crash_datetime),
+    Column('longitude', 'sql', coordinate('longitude')),
+    Column('latitude', 'sql', coordinate('latitude')),
+    Column('the_geom', 'sql', the_geom),
+    Column('vehicle_type', 'sql', text_array(VEHICLE_TYPE_FIELDS)),
+    Column('contributing_factor', 'sql', text_array(CONTRIBUTING_FACTOR_FIELDS)),
+    Column('year', 'int', lambda row: row['crash_date'][0:4]),
+    Column('month', 'int', lambda row: row['crash_date'][5:7]),
+    Column('crash_count', 'int', lambda row: 1),
+    Column('socrata_id', 'int', lambda row: row['collision_id']),
+]
+
+CRASH_COLUMN_NAMES = [column.name for column in CRASH_COLUMNS]
+
+# the counts which the blame allocations are calculated from, see vehicle_columns()
+BLAME_COUNT_GETTERS = [(column.name, column.getter) for column in CRASH_COLUMNS if column.name in (
+    'number_of_cyclist_injured', 'number_of_cyclist_killed',
+    'number_of_motorist_injured', 'number_of_motorist_killed',
+    'number_of_pedestrian_injured', 'number_of_pedestrian_killed',
+)]
+
+
+def place_column(placefinder, boundinfo):
+    """
+    A Column for one of the boundary layers e.g. borough or nypd_precinct, looked up locally by the PlaceFinder
+    Values are cast to the crashes table column's type, NULLs too, since a VALUES list can't otherwise tell what they are.
+    """
+    name = boundinfo['targetnamefield']
+    cast = placefinder.columntypes.get(name, 'text')
+    notfound = "''::{}".format(cast) if boundinfo.get('blankismissing') else "NULL::{}".format(cast)
+
+    def getter(row):
+        if has_latlng(row):
+            value = placefinder.lookup(float(row['longitude']), float(row['latitude']))[name]
+            if value is not None:
+                return "$${}$$::{}".format(value, cast)
+        return notfound
+    return Column(name, 'sql', getter)
+
+
+def intersection_column(intersectionfinder):
+    """
+    A Column for intersection_id, the nyc_intersections circle the crash is in, looked up locally by the IntersectionFinder
+    0 if it's not in any, NULL if it has no location yet; see etlcommon/intersections.py
+    """
+    def getter(row):
+        if not has_latlng(row):
+            return 'null'
+        return intersectionfinder.find(float(row['longitude']), float(row['latitude']))
+    return Column('intersection_id', 'int', getter)
+
+
+def vehicle_columns(classifier, rows):
+    """
+    Columns for the hasvehicle_XXX flags per the VehicleClassifier, and the blame allocations which follow from them
+    These are worked out for the whole batch of rows at once, see etlcommon/blame.py; the getters then look up each row's values.
+    @param {classifier} VehicleClassifier
+    @param {rows} list of the SODA records which will be transformed
+    """
+    flaglist = [classifier.flags(text_values(row, VEHICLE_TYPE_FIELDS)) for row in rows]
+    flags = {fieldsuffix: np.array([rowflags[fieldsuffix] for rowflags in flaglist], dtype=bool) for fieldsuffix, category in classifier.categories}
+    counts = {fieldname: np.array([int(getter(row)) for row in rows], dtype=np.int64) for fieldname, getter in BLAME_COUNT_GETTERS}
+
+    values = OrderedDict([('hasvehicle_{}'.format(fieldsuffix), flags[fieldsuffix]) for fieldsuffix, category in classifier.categories])
+    values.update(allocate_blame(flags, counts))
+
+    # the rows are the very same objects which will be transformed, so find each one's position by its identity
+    positions = {id(row): i for i, row in enumerate(rows)}
+
+    def value_getter(array):
+        return lambda row: sql_literal(array[positions[id(row)]])
+
+    return [Column(name, 'sql', value_getter(array)) for name, array in values.items()]
+
+
+def crash_columns(placefinder=None, vehicleclassifier=None, rows=None, intersectionfinder=None, extent=None):
+    """
+    CRASH_COLUMNS, plus the boundary columns if we have a PlaceFinder (see etlcommon/places.py) to fill them in,
+    plus the hasvehicle_XXX flags and blame allocations if we have a VehicleClassifier (see etlcommon/vehicletypes.py),
+    plus intersection_id if we have an IntersectionFinder (see etlcommon/intersections.py)
+    The crashes are then INSERTed already tagged, instead of leaving these for the batch jobs.
+    @param {placefinder} PlaceFinder or None
+    @param {vehicleclassifier} VehicleClassifier or None
+    @param {rows} list of the SODA records which will be transformed, needed for the vehicleclassifier
+    @param {intersectionfinder} IntersectionFinder or None
+    @param {extent} (xmin, ymin, xmax, ymax) outside which the_geom is left null, or None to insert every point
+    """
+    columns = CRASH_COLUMNS
+
+    if extent:
+        columns = [the_geom_within(extent) if column.name == 'the_geom' else column for column in columns]
+
+    if placefinder:
+        places = [place_column(placefinder, boundinfo) for boundinfo in placefinder.layers]
+        placenames = [column.name for column in places]
+        columns = [column for column in columns if column.name not in placenames] + places
+
+    if vehicleclassifier and rows is not None:
+        columns = columns + vehicle_columns(vehicleclassifier, rows)
+
+    if intersectionfinder:
+        columns = columns + [intersection_column(intersectionfinder)]
+
+    return columns
+
+
+def compile_transformer(columns):
+    """
+    Compile a list of Column into a function which takes a SODA record,
+    and returns its VALUES row string e.g. (0,1,0,0,...,$$BROADWAY$$,...)
+    The row template is built once here, so each row is just the getters and one format() call.
+    @param {columns} list of Column
+    """
+    formatrow = ('(' + ','.join([PLACEHOLDERS[column.kind] for column in columns]) + ')').format
+    getters = tuple([column.getter for column in columns])
+
+    def transform(row):
+        return formatrow(*[getter(row) for getter in getters])
+    return transform
+
+
+soda_row_to_values = compile_transformer(CRASH_COLUMNS)
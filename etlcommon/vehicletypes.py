@@ -0,0 +1,93 @@
+"""
+Classify crashes' vehicle types into the hasvehicle_XXX flags locally, so new crashes can be inserted already flagged
+
+vehicletype_crosswalk_prod maps each free-form vehicle_type value seen from SODA (nyc_vehicletype)
+onto one of our domain values e.g. CAR, TRUCK (crashmapper_vehicletype). The whole table is a few thousand rows,
+so it's fetched once per run into a dict of alias => categories.
+
+A crash has a vehicle category if any of its vehicle_type values is one of that category's aliases, exactly;
+same as the array overlap in main.py's update_hasvehicle(). The aliases are cleaned the same way the vehicle_type values
+are when inserted, see etlcommon/sodarows.py, both here and in main.py's crosswalk_aliases_array(), so the two always agree
+
+The crosswalk gets new aliases now and then e.g. "tesla 5" or "morotcycel". crosswalk_snapshot() and changed_aliases()
+let main.py compare it to the last run's, and re-flag only the crashes with an alias which was added, removed, or recategorized.
+"""
+
+import logging
+
+import requests
+
+from etlcommon import httpclient
+from etlcommon.sodarows import clean_text_value
+
+
+logger = logging.getLogger()
+
+
+class VehicleClassifier:
+    """
+    @param {categories} list of (hasvehicle field suffix, crosswalk category) e.g. ('car', 'CAR'), like main.py's HASVEHICLE_CATEGORIES
+    @param {crosswalk} list of (nyc_vehicletype, crashmapper_vehicletype) rows from the crosswalk table
+    """
+    def __init__(self, categories, crosswalk):
+        self.categories = categories
+        self.crosswalk = crosswalk
+        self.aliases = {}  # alias => set of categories; an alias can be listed under more than one
+        for alias, category in crosswalk:
+            if alias is None or category is None:
+                continue
+            self.aliases.setdefault(clean_text_value(alias), set()).add(category)
+
+    def flags(self, vehicletypes):
+        """
+        A dict of hasvehicle field suffix => True/False for the given vehicle_type values
+        @param {vehicletypes} list of cleaned vehicle_type values, e.g. from sodarows.text_values()
+        """
+        found = set()
+        for vehicletype in vehicletypes:
+            found.update(self.aliases.get(vehicletype, ()))
+        return {fieldsuffix: category in found for fieldsuffix, category in self.categories}
+
+
+def crosswalk_snapshot(crosswalk):
+    """
+    The crosswalk as a dict of alias => sorted list of categories, for saving and comparing with changed_aliases()
+    Aliases are cleaned as in VehicleClassifier, so the changed ones match crashes' vehicle_type values
+    @param {crosswalk} list of (nyc_vehicletype, crashmapper_vehicletype) rows from the crosswalk table
+    """
+    snapshot = {}
+    for alias, category in crosswalk:
+        if alias is None or category is None:
+            continue
+        snapshot.setdefault(clean_text_value(alias), set()).add(category)
+    return {alias: sorted(categories) for alias, categories in snapshot.items()}
+
+
+def changed_aliases(before, after):
+    """
+    The aliases which were added, removed, or given different categories between two crosswalk_snapshot(), as a sorted list
+    """
+    return sorted([alias for alias in set(before) | set(after) if before.get(alias) != after.get(alias)])
+
+
+def load_vehicle_classifier(sqlapiurl, crosswalktable, categories):
+    """
+    Fetch the crosswalk table and build a VehicleClassifier from it.
+    Returns None if it couldn't be loaded; crashes would then be flagged by the hasvehicle batch job as before.
+    @param {sqlapiurl} CARTO SQL API URL
+    @param {crosswalktable} e.g. vehicletype_crosswalk_prod
+    @param {categories} list of (hasvehicle field suffix, crosswalk category)
+    """
+    sql = "SELECT nyc_vehicletype, crashmapper_vehicletype FROM {}".format(crosswalktable)
+    try:
+        reply = httpclient.get(sqlapiurl, params={'q': sql}).json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        reply = {'error': str(e)}
+
+    if not reply.get('rows'):
+        logger.warning('Could not load {}, new crashes will be flagged by the hasvehicle batch job instead: {}'.format(crosswalktable, reply.get('error')))
+        return None
+
+    classifier = VehicleClassifier(categories, [(row['nyc_vehicletype'], row['crashmapper_vehicletype']) for row in reply['rows']])
+    logger.info('Loaded {} vehicle type aliases from {}'.format(len(classifier.aliases), crosswalktable))
+    return classifier
@@ -1,48 +1,178 @@
 #!/bin/env python3
 """
 Step 1. Go through CARTO and SODA and fetch records, then write them out to CSVs.
+
+The CARTO export is too big for one SQL API request, so the range of socrata_id is split into slices which are fetched in parallel,
+each paged through with WHERE socrata_id > last ORDER BY socrata_id LIMIT n, so every page is a quick index range scan.
+Each slice's pages are appended to its own part file as they arrive, and a checkpoint file records how far each slice got,
+so if this is interrupted, running it again picks up where it left off. Once all slices are done, the part files are joined into the CSV.
 """
 
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from findgeomupdates_config import *
 
 
+EXPORT_SINCE = '2016-01-01T00:00:00Z'  # only crashes from this date on
+EXPORT_SLICES = 32  # split the socrata_id range into this many slices...
+EXPORT_WORKERS = 4  # ...and fetch this many of them at a time; keep it low, CARTO limits concurrent queries per user
+EXPORT_PAGE_SIZE = 50000  # rows per request
+EXPORT_PAGE_RETRIES = 5  # a failed page is tried again this many times, before giving up; run it again to resume
+
+EXPORT_CHECKPOINT_FILE = CSV_DATAFILE_CARTO + '.checkpoint.json'
+CSV_FIELDS = ['socrata_id', 'cartodb_id', 'date_val', 'lng', 'lat']
+
+
 def run():
-    print("Querying Carto")
-    sql = f"""
-    SELECT socrata_id, cartodb_id, date_val, ST_X(the_geom) AS lng, ST_Y(the_geom) AS lat
-    FROM {CARTO_CRASHES_TABLE}
-    WHERE socrata_id IS NOT NULL AND date_val >= '2016-01-01T00:00:00Z'
-    ORDER BY socrata_id
-    """
-    cartodb_rows = performcartoquery(sql)
-    print(f"{len(cartodb_rows)} rows have geometry")
+    checkpoint = load_checkpoint()
+    if checkpoint:
+        print(f"Resuming the export from {EXPORT_CHECKPOINT_FILE}")
+    else:
+        checkpoint = start_checkpoint()
+    slices = checkpoint['slices']
+
+    todo = [i for i, exportslice in enumerate(slices) if not exportslice['done']]
+    print(f"Querying Carto: {len(todo)} of {len(slices)} slices of socrata_id to go, {EXPORT_WORKERS} at a time")
+
+    checkpointlock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+        list(pool.map(lambda i: export_slice(checkpoint, i, checkpointlock), todo))
 
     print(f"Writing CSV {CSV_DATAFILE_CARTO}")
+    howmany = 0
     with open(CSV_DATAFILE_CARTO, 'w') as fh:
         spamwriter = csv.writer(fh)
+        spamwriter.writerow(CSV_FIELDS)
+        for i in range(len(slices)):
+            # newline='' so the rows' line endings are copied as the csv writer wrote them
+            with open(part_filename(i), newline='') as part:
+                for line in part:
+                    fh.write(line)
+                    howmany += 1
+    print(f"{howmany} rows have geometry")
 
-        spamwriter.writerow([
-            'socrata_id',
-            'cartodb_id',
-            'date_val',
-            'lng',
-            'lat',
-        ])
-
-        for row in cartodb_rows:
-            spamwriter.writerow([
-                row['socrata_id'],
-                row['cartodb_id'],
-                row['date_val'],
-                row['lng'],
-                row['lat'],
-            ])
+    for i in range(len(slices)):
+        os.remove(part_filename(i))
+    os.remove(EXPORT_CHECKPOINT_FILE)
 
     # done
     print("")
     print("Done with this step. Proceed to step 1B.")
 
 
+def start_checkpoint():
+    # split the range of socrata_id into slices of equal width; each slice is (after, through]
+    sql = f"""
+    SELECT MIN(socrata_id) AS lowest, MAX(socrata_id) AS highest
+    FROM {CARTO_CRASHES_TABLE}
+    WHERE socrata_id IS NOT NULL AND date_val >= '{EXPORT_SINCE}'
+    """
+    idrange = performcartoquery(sql)[0]
+    lowest = int(idrange['lowest'])
+    highest = int(idrange['highest'])
+    width = (highest - lowest) // EXPORT_SLICES + 1
+
+    slices = []
+    for i in range(EXPORT_SLICES):
+        slices.append({
+            'after': lowest - 1 + i * width,
+            'through': min(lowest - 1 + (i + 1) * width, highest),
+            'last': lowest - 1 + i * width,  # the last socrata_id written to the part file
+            'bytes': 0,  # the part file's size as of that last socrata_id
+            'done': False,
+        })
+
+    checkpoint = {'since': EXPORT_SINCE, 'slices': slices}
+    for i in range(len(slices)):
+        open(part_filename(i), 'w').close()
+    save_checkpoint(checkpoint)
+    return checkpoint
+
+
+def export_slice(checkpoint, i, checkpointlock):
+    """
+    Page through one slice of socrata_id, appending each page to its part file then recording it in the checkpoint
+    Returns the number of rows written this time.
+    """
+    exportslice = checkpoint['slices'][i]
+    howmany = 0
+
+    with open(part_filename(i), 'r+') as fh:
+        # anything past the checkpoint was written by an export which died before recording it; it'll be fetched again
+        fh.truncate(exportslice['bytes'])
+        fh.seek(exportslice['bytes'])
+        spamwriter = csv.writer(fh)
+
+        while True:
+            sql = f"""
+            SELECT socrata_id, cartodb_id, date_val, ST_X(the_geom) AS lng, ST_Y(the_geom) AS lat
+            FROM {CARTO_CRASHES_TABLE}
+            WHERE socrata_id > {exportslice['last']} AND socrata_id <= {exportslice['through']}
+            AND date_val >= '{checkpoint['since']}'
+            ORDER BY socrata_id
+            LIMIT {EXPORT_PAGE_SIZE}
+            """
+            rows = fetch_page(sql)
+
+            for row in rows:
+                spamwriter.writerow([row[field] for field in CSV_FIELDS])
+            fh.flush()
+            os.fsync(fh.fileno())
+            howmany += len(rows)
+
+            with checkpointlock:
+                if rows:
+                    exportslice['last'] = rows[-1]['socrata_id']
+                    exportslice['bytes'] = fh.tell()
+                if len(rows) < EXPORT_PAGE_SIZE:
+                    exportslice['done'] = True
+                save_checkpoint(checkpoint)
+
+            if exportslice['done']:
+                break
+
+    print(f"    slice {i + 1} of {len(checkpoint['slices'])} done, {howmany} rows")
+    return howmany
+
+
+def fetch_page(sql):
+    # like performcartoquery() but retries, and an empty page is an empty list
+    for attempt in range(EXPORT_PAGE_RETRIES + 1):
+        try:
+            data = httpclient.post(CARTO_SQL_API_BASEURL, data={'q': sql, 'api_key': CARTO_API_KEY}).json()
+            if 'rows' in data:
+                return data['rows']
+            print(f"        Query failed: {data.get('error')}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"        Request failed: {e}")
+
+        if attempt < EXPORT_PAGE_RETRIES:
+            print("        Oops, retrying")
+            sleep(20)
+
+    raise RuntimeError(f"Giving up after {EXPORT_PAGE_RETRIES} retries; run this again to resume")
+
+
+def part_filename(i):
+    return f"{CSV_DATAFILE_CARTO}.part{i:04d}"
+
+
+def load_checkpoint():
+    if not os.path.exists(EXPORT_CHECKPOINT_FILE):
+        return None
+    with open(EXPORT_CHECKPOINT_FILE) as fh:
+        return json.load(fh)
+
+
+def save_checkpoint(checkpoint):
+    # write then rename, so dying partway doesn't leave a broken checkpoint
+    with open(EXPORT_CHECKPOINT_FILE + '.tmp', 'w') as fh:
+        json.dump(checkpoint, fh)
+    os.replace(EXPORT_CHECKPOINT_FILE + '.tmp', EXPORT_CHECKPOINT_FILE)
+
+
 if __name__ == '__main__':
     if not CARTO_API_KEY:
         print("No CARTO_API_KEY defined in environment")
@@ -25,7 +25,7 @@ def run():
                 print(f"    {done} of {len(soda_chunks)}")
 
                 thesecrashidstring = ','.join([str(i) for i in thesecrashids])
-                thesecrashdata = requests.get(
+                thesecrashdata = httpclient.get(
                     SODA_API_COLLISIONS_BASEURL,
                     params={
                         '$where': f"collision_id IN ({thesecrashidstring})",
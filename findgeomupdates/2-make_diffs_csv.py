@@ -24,35 +24,44 @@ def run():
     print(f"    Loaded {len(potential_updates)} potential updates")
 
     print(f"Finding changes over {DISTANCE_THRESHOLD} meters")
+    olds = [existing_records[row['collision_id']] for row in potential_updates]
+    lats_old = coordinate_array([old['lat'] for old in olds])
+    lngs_old = coordinate_array([old['lng'] for old in olds])
+    lats_new = coordinate_array([row['latitude'] for row in potential_updates])
+    lngs_new = coordinate_array([row['longitude'] for row in potential_updates])
+
+    # a 0 coordinate is as good as missing, same as always
+    for coords in (lats_old, lngs_old, lats_new, lngs_new):
+        coords[coords == 0] = np.nan
+    hasold = ~np.isnan(lats_old) & ~np.isnan(lngs_old)
+    hasnew = ~np.isnan(lats_new) & ~np.isnan(lngs_new)
+
+    # distances for all of them in one go; any missing coordinate gives NaN, which is never over the threshold
+    distances = haversine_array(lats_old, lngs_old, lats_new, lngs_new)
+    moved = distances > DISTANCE_THRESHOLD
+    nowhascoords = hasnew & ~hasold
+
     updates = []
-    for row in potential_updates:
-        id = row['collision_id']
-        old = existing_records[id]
+    for i in np.flatnonzero(moved | nowhascoords):
+        row = potential_updates[i]
+        old = olds[i]
 
         lat_old = float(old['lat']) if old['lat'] else None
         lng_old = float(old['lng']) if old['lng'] else None
         lat_new = float(row['latitude']) if row['latitude'] else None
         lng_new = float(row['longitude']) if row['longitude'] else None
 
-        underthreshold = True
-
-        if lat_old and lng_old and lat_new and lng_new:
-            # new coordinates; is it sufficiently far to care?
-            meters = haversine(lat_old, lng_old, lat_new, lng_new)
-            if meters > DISTANCE_THRESHOLD:
-                underthreshold = False
+        if moved[i]:
+            # new coordinates, sufficiently far to care
+            meters = int(distances[i])
 
-                print(f"    {row['collision_id']}    {row['crash_date']}    {meters} meters    ({lat_old}, {lng_old}, {lat_new}, {lng_new})")
-        elif lat_new and lng_new and (not lat_old or not lng_old):
+            print(f"    {row['collision_id']}    {row['crash_date']}    {meters} meters    ({lat_old}, {lng_old}, {lat_new}, {lng_new})")
+        else:
             # coordinates for a point that did not previously have coordinates
             meters = "NEWCOORDS"
-            underthreshold = False
 
             print(f"    {row['collision_id']}    {row['crash_date']}    nowhascoords ({lat_new}, {lng_new})")
 
-        if underthreshold:
-            continue
-
         updates.append({
             'socrata_id': old['socrata_id'],
             'cartodb_id': old['cartodb_id'],
@@ -24,6 +24,12 @@ import requests
 import sys
 from time import sleep
 import csv
+import numpy as np
+
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
+from etlcommon.geo import haversine, haversine_array, coordinate_array
 
 
 # hide the annoying InsecureRequestWarning
@@ -40,7 +46,7 @@ def list_chunks(lst, n):
 def performcartoquery(query):
     # POST the given SQL query to CARTO
     try:
-        r = requests.post(CARTO_SQL_API_BASEURL, data={'q': query, 'api_key': CARTO_API_KEY})
+        r = httpclient.post(CARTO_SQL_API_BASEURL, data={'q': query, 'api_key': CARTO_API_KEY})
         data = r.json()
     except requests.exceptions.RequestException as e:
         logger.error(e.message)
@@ -51,20 +57,3 @@ def performcartoquery(query):
     elif 'error' in data:
         print('performcartoquery(): Failed query\n    {}\n    {}'.format(query,  data['error']))
         sys.exit(1)
-
-
-# a Haversine implementationm in Python, modified to return integer meters
-# https://stackoverflow.com/questions/4913349/haversine-formula-in-python-bearing-and-distance-between-two-gps-points
-def haversine(lat1, lon1, lat2, lon2):
-    from math import radians, cos, sin, asin, sqrt
-
-    R = 6372800
-    dLat = radians(lat2 - lat1)
-    dLon = radians(lon2 - lon1)
-    lat1 = radians(lat1)
-    lat2 = radians(lat2)
-
-    a = sin(dLat / 2)**2 + cos(lat1) * cos(lat2) * sin(dLon / 2)**2
-    c = 2 * asin(sqrt(a))
-
-    return int(round(R * c))
@@ -12,6 +12,10 @@ from dateutil.relativedelta import relativedelta
 from time import sleep
 import logging
 
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
+
 
 CARTO_USER_NAME = 'chekpeds'
 CARTO_API_KEY = os.environ['CARTO_API_KEY'] # make sure this is available in bash as $CARTO_API_KEY
@@ -71,7 +75,7 @@ def yyyymm2daterange(yyyymm):
 def get_soda_for_collision_ids(collisionids):
     try:
         whereclause = "collision_id IN ({}) AND latitude IS NOT NULL AND latitude != '0.0000000'".format(','.join([str(i) for i in collisionids]))
-        crashdata = requests.get(
+        crashdata = httpclient.get(
             SODA_API_COLLISIONS_BASEURL,
             params={
                 '$where': whereclause,
@@ -98,7 +102,7 @@ def get_soda_for_collision_ids(collisionids):
 def performcartoquery(query):
     # POST the given SQL query to CARTO
     try:
-        r = requests.post(CARTO_SQL_API_BASEURL, data={'q': query, 'api_key': CARTO_API_KEY})
+        r = httpclient.post(CARTO_SQL_API_BASEURL, data={'q': query, 'api_key': CARTO_API_KEY})
         data = r.json()
     except requests.exceptions.RequestException as e:
         logger.error(e.message)
@@ -10,6 +10,11 @@ import os
 import requests
 from time import sleep
 
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
+from etlcommon.maintenance import plan_table_maintenance
+
 # the input CSV with corrected injury/fatality counts for records that need it
 DIFFS_CSVILE = "crash_diffs.csv"
 
@@ -19,6 +24,9 @@ CARTO_API_KEY = os.environ['CARTO_API_KEY'] # make sure this is available in bas
 CARTO_CRASHES_TABLE = 'crashes_all_prod'
 CARTO_SQL_API_BASEURL = 'https://%s.carto.com/api/v2/sql' % CARTO_USER_NAME
 
+# how many updates between checks whether the table needs a VACUUM
+MAINTENANCE_CHECK_EVERY = 2500
+
 ################################################################################################
 
 def run():
@@ -58,17 +66,25 @@ def run():
         performcartoquery(sql)
         sleep(2)
 
-        # periodic maintenance: progress readout, and a VACUUM
+        # periodic maintenance: progress readout, and a check whether the table needs a VACUUM
         howmanydone += 1
         if howmanydone % 100 == 0:
             print("PROGRESS: {}".format(howmanydone))
             sleep(5)
-        if howmanydone % 2500 == 0:
-            performcartoquery("VACUUM {}".format(CARTO_CRASHES_TABLE))
-            sleep(20)
+        if howmanydone % MAINTENANCE_CHECK_EVERY == 0:
+            performmaintenance()
 
     # done
-    performcartoquery("VACUUM FULL {}".format(CARTO_CRASHES_TABLE))
+    performmaintenance()
+
+
+def performmaintenance():
+    # run whatever maintenance the table's stats call for, if any; see etlcommon/maintenance.py
+    plan = plan_table_maintenance(CARTO_SQL_API_BASEURL, CARTO_API_KEY, CARTO_CRASHES_TABLE)
+    print("MAINTENANCE: {} because {}".format(plan.action, plan.reason))
+    if plan.sql:
+        performcartoquery(plan.sql)
+        sleep(20)
 
 
 def performcartoquery(query):
@@ -76,7 +92,7 @@ def performcartoquery(query):
     payload = {'q': query, 'api_key': CARTO_API_KEY}
 
     try:
-        r = requests.post(CARTO_SQL_API_BASEURL, data=payload)
+        r = httpclient.post(CARTO_SQL_API_BASEURL, data=payload)
         print(r.text)
     except requests.exceptions.RequestException as e:
         print(e.message)
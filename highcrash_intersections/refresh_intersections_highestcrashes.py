@@ -11,6 +11,10 @@ import sys
 import time
 import json
 
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
+
 
 CARTO_USER_NAME = 'chekpeds'
 CARTO_API_KEY = os.environ['CARTO_API_KEY'] # make sure this is available in bash as $CARTO_API_KEY
@@ -58,7 +62,7 @@ def run():
 
     logger.info("Fetching results back")
     try:
-        thetopintersections = requests.get(
+        thetopintersections = httpclient.get(
             CARTO_SQL_API_BASEURL,
             params={
                 'q': "SELECT * FROM {}".format(DBTABLE_THEWORSTONES),
@@ -86,7 +90,7 @@ def start_carto_batchjob(querylist):
     }
 
     try:
-        r = requests.post(url, json=jsonbody)
+        r = httpclient.post(url, json=jsonbody)
         jobinfo = r.json()
         if 'error' in jobinfo and jobinfo['error']:
             raise ValueError(jobinfo['error'])
@@ -104,7 +108,7 @@ def start_carto_batchjob(querylist):
 def status_carto_batchjob(jobid):
     # simply fetch and return the status of a CartoDB batch job
     url = "{}/{}?api_key={}".format(CARTO_BATCH_API_BASEURL, jobid, CARTO_MASTER_KEY)
-    jobstatus = requests.get(url).json()
+    jobstatus = httpclient.get(url).json()
     return jobstatus['status']
 
 
@@ -116,7 +120,7 @@ def wait_carto_batchjob(jobid, waitseconds=30):
     while True:
         time.sleep(waitseconds)
 
-        jobstatus = requests.get(url).json()
+        jobstatus = httpclient.get(url).json()
         logger.info("Status of batch job {} is {}".format(jobid, jobstatus['status']))
 
         if jobstatus['status'] == 'running' or jobstatus['status'] == 'pending':  # still running, give it another sleep-loop
@@ -3,6 +3,10 @@
 
 import requests, os, sys, time
 
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
+
 # the table of new polygons, and what field in crashes is used to relate to them
 POLYGONS_TABLE = "nyc_assembly"
 CRASH_FIELD = "assembly"
@@ -106,7 +110,7 @@ def cartoapi_read(sql):
     payload = {'q': sql}
 
     try:
-        data = requests.get(CARTO_SQL_API_BASEURL, params=payload).json()
+        data = httpclient.get(CARTO_SQL_API_BASEURL, params=payload).json()
     except requests.exceptions.RequestException as e:
         print(e.message)
         sys.exit(1)
@@ -122,7 +126,7 @@ def cartoapi_write(sql):
     payload = {'q': sql, 'api_key': CARTO_API_KEY}
 
     try:
-        reply = requests.post(CARTO_SQL_API_BASEURL, data=payload).json()
+        reply = httpclient.post(CARTO_SQL_API_BASEURL, data=payload).json()
 
         if 'total_rows' not in reply:
             print("ERROR:")
@@ -3,17 +3,31 @@
 
 import requests
 import urllib
-from datetime import datetime
 from datetime import date
+from datetime import timedelta
 from dateutil.relativedelta import relativedelta
 import json
 import logging
 import sys
 import os
 import time
-import re
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
+from etlcommon import httpclient
+from etlcommon.idindex import SocrataIdIndex
+from etlcommon.chunking import AdaptiveChunkSizer, is_timeout_error
+from etlcommon.checkpoints import CheckpointStore
+from etlcommon.geo import haversine_array, coordinate_array, within_extent
+from etlcommon.sodarows import compile_transformer, crash_columns, CRASH_COLUMN_NAMES
+from etlcommon.places import load_place_finder, load_extent
+from etlcommon.intersections import has_intersection_id, load_intersection_finder, NO_INTERSECTION
+from etlcommon.vehicletypes import load_vehicle_classifier, crosswalk_snapshot, changed_aliases
+from etlcommon.blame import BLAME_PASSES, BLAME_COLUMNS, VEHICLE_FLAGS, allocate_blame, sql_literal
+from etlcommon.batchjobs import BatchJob, BatchJobScheduler
+from etlcommon.maintenance import plan_table_maintenance
 
 
 CARTO_USER_NAME = 'chekpeds'
@@ -21,14 +35,79 @@ CARTO_API_KEY = os.environ['CARTO_API_KEY'] # make sure this is available in bas
 CARTO_MASTER_KEY = os.environ['CARTO_MASTER_KEY'] # make sure this is available in bash as $CARTO_MASTER_KEY
 CARTO_CRASHES_TABLE = 'crashes_all_prod'
 CARTO_INTERSECTIONS_TABLE = 'nyc_intersections'
+CARTO_CHECKPOINTS_TABLE = 'etl_checkpoints'
+CARTO_STAGING_TABLE = 'crashes_all_staging'
+CARTO_VEHICLETYPE_CROSSWALK_TABLE = 'vehicletype_crosswalk_prod'
+CARTO_EXTENT_TABLE = 'nyc_borough'  # crashes outside the bounding box of these polygons get no geom, see filter_carto_data()
 CARTO_SQL_API_BASEURL = 'https://%s.carto.com/api/v2/sql' % CARTO_USER_NAME
 CARTO_BATCH_API_BASEURL = 'https://%s.carto.com/api/v2/sql/job' % CARTO_USER_NAME
 SODA_API_COLLISIONS_BASEURL = 'https://data.cityofnewyork.us/resource/h9gi-nx95.json'
 SOCRATA_APP_TOKEN_PUBLIC = os.environ['SOCRATA_APP_TOKEN_PUBLIC'] # make sure this is available in bash as $SOCRATA_APP_TOKEN_PUBLIC
+SOCRATA_ID_INDEX_FILE = os.environ.get('SOCRATA_ID_INDEX_FILE')  # optional; a persistent path for the socrata_id index, see README
+BOUNDARY_CACHE_DIR = os.environ.get('BOUNDARY_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'boundarycache'))  # the boundary polygons are cached here, see load_place_finder()
 
 FETCH_HOWMANY_MONTHS = 2  # when looking for new records in SODA, look back how many months?
+WIDE_SWEEP_EVERY_DAYS = 7  # most nights fetch only what's past the last run's checkpoints, but this often re-read the full windows to catch late backlog
+SODA_FETCH_PARTITION_DAYS = 1  # split that window into partitions of this many days, fetched separately
+SODA_FETCH_PAGE_SIZE = 10000  # page through each partition this many rows at a time, so no $limit cap ever drops rows
+SODA_FETCH_WORKERS = 4  # how many partitions to fetch from SODA concurrently
+SOCRATA_ID_INDEX_PAGE_SIZE = 100000  # when catching up the socrata_id index from CARTO, fetch this many IDs per request
+SOCRATA_ID_INDEX_OVERLAP = 1000  # ...and re-read this many cartodb_ids before the high-water mark, in case of out-of-order commits
 UPDATES_HOW_FAR_BACK = 90  # when looking for later-modified records, look how many days back?
+RECENT_WINDOW_DAYS = 14  # the nightly UPDATEs look only at crashes this recent, or as old as any crash loaded or corrected this run; a wide sweep looks at all of them
+KILLCOUNT_BATCHAPI_THRESHOLD = 1000  # if more than this many records need new injury/fatality counts, send them via the Batch API
+CARTO_INSERT_WORKERS = 3  # how many INSERT chunks to send to CARTO at once; keep it low, CARTO limits concurrent queries per user
+CARTO_INSERT_CHUNK_SIZE = 50  # how many records per INSERT to start with; this is adjusted as we go, see AdaptiveChunkSizer
+CARTO_INSERT_CHUNK_MAX = 500  # ...but never more than this many
+CARTO_INSERT_TARGET_SECONDS = 5  # ...aiming for each INSERT to take under this long, well below CARTO's timeout
+CARTO_INSERT_MODE = os.environ.get('CARTO_INSERT_MODE', 'staging')  # staging = load new crashes into CARTO_STAGING_TABLE then merge them in one query, direct = INSERT each chunk straight into CARTO_CRASHES_TABLE
+CARTO_STAGING_CHUNK_MAX = 2000  # chunks into the staging table don't check for duplicates so they're quick, and can be a lot bigger
+BATCHJOB_WAIT_MAX_SECONDS = 4 * 3600  # wait this long for the Batch API jobs to finish, before giving up on them; they still run but later ones are skipped
 INTERSECTIONS_CRASHCOUNT_MONTHS = 24  # when tallying crash counts for intersections, go back how many months?
+INTERSECTIONS_REBUILD_EVERY_DAYS = 7  # most nights the intersection crash counts are adjusted by what entered and left the window, but this often they're recounted from scratch
+
+# the nyc_intersections count fields, each the number of crashes within the circle in its last so many months which match its severity filter
+# these all come from one pass over the crashes, so more of them cost little; see update_intersections_crashcount()
+# to add one, add its column to nyc_intersections FIRST (see the README), then list it here, and the next run will recount them all
+INTERSECTION_COUNTS = [
+    { 'targetfield': "crashcount", 'months': INTERSECTIONS_CRASHCOUNT_MONTHS, 'severity': "injury" },
+    # { 'targetfield': "crashcount_12mo", 'months': 12, 'severity': "injury" },
+    # { 'targetfield': "crashcount_6mo", 'months': 6, 'severity': "injury" },
+    # { 'targetfield': "fatalcount", 'months': INTERSECTIONS_CRASHCOUNT_MONTHS, 'severity': "fatal" },
+    # { 'targetfield': "pedestriancount", 'months': INTERSECTIONS_CRASHCOUNT_MONTHS, 'severity': "pedestrian" },
+]
+
+# the severity filters for INTERSECTION_COUNTS, as SQL conditions on the crashes table
+INTERSECTION_COUNT_SEVERITIES = {
+    'injury': "number_of_persons_injured > 0 OR number_of_persons_killed > 0",
+    'fatal': "number_of_persons_killed > 0",
+    'pedestrian': "number_of_pedestrian_injured > 0 OR number_of_pedestrian_killed > 0",
+}
+
+# the boundary polygons which crashes are tagged with, for query filtering; see update_places()
+# blankismissing = an empty string also counts as not yet tagged, cast = SQL type cast for the polygon's name e.g. precinct numbers
+BOUNDARY_LAYERS = [
+    { 'targetnamefield': "borough", 'polygontable': "nyc_borough", 'polygonname': "borough", 'blankismissing': True },
+    { 'targetnamefield': "city_council", 'polygontable': "nyc_city_council", 'polygonname': "identifier" },
+    { 'targetnamefield': "nypd_precinct", 'polygontable': "nyc_nypd_precinct", 'polygonname': "identifier", 'cast': "int" },
+    { 'targetnamefield': "community_board", 'polygontable': "nyc_community_board", 'polygonname': "identifier" },
+    { 'targetnamefield': "neighborhood", 'polygontable': "nyc_neighborhood", 'polygonname': "identifier", 'blankismissing': True },
+    { 'targetnamefield': "assembly", 'polygontable': "nyc_assembly", 'polygonname': "identifier" },
+    { 'targetnamefield': "senate", 'polygontable': "nyc_senate", 'polygonname': "identifier" },
+    { 'targetnamefield': "businessdistrict", 'polygontable': "nyc_businessdistrict", 'polygonname': "bidistrict" },
+]
+
+# the hasvehicle_XXX fields, and which crashmapper_vehicletype category in the crosswalk table sets each one
+HASVEHICLE_CATEGORIES = [
+    ('scooter', 'E-BIKE-SCOOT'),
+    ('suv', 'SUV'),
+    ('car', 'CAR'),
+    ('other', 'OTHER'),
+    ('truck', 'TRUCK'),
+    ('motorcycle', 'MOTORCYCLE-MOPED'),
+    ('bicycle', 'BICYCLE'),
+    ('busvan', 'BUS-VAN'),
+]
 
 
 logging.basicConfig(
@@ -62,7 +141,7 @@ def get_date_monthsago_from_carto(monthsago):
     query = "SELECT current_date - INTERVAL '{0} months' AS backthen".format(monthsago)
 
     try:
-        r = requests.get(CARTO_SQL_API_BASEURL, params={'q': query})
+        r = httpclient.get(CARTO_SQL_API_BASEURL, params={'q': query})
         data = r.json()
     except requests.exceptions.RequestException as e:
         logger.error(e.message)
@@ -76,42 +155,216 @@ def get_date_monthsago_from_carto(monthsago):
         sys.exit(1)
 
 
-def get_soda_data():
+def get_soda_partition(whereclause, select=None):
     """
-    Make a GET request to the Socrata SODA API for collision data within the last month.
-    Limit is purposefully set high as it defaults to 1000, and we routinely see 200-500 crashes in a single day.
-    Make a call to CARTO to get the list of all socrata_id IDs in this same time period.
+    Page through all SODA collision records matching the given $where clause, optionally with a $select clause.
+    Pages are ordered by collision_id so that $offset is stable from one page to the next,
+    and we keep asking until a short page tells us there's nothing left.
     """
-    sincewhen = (date.today() - relativedelta(months=FETCH_HOWMANY_MONTHS))
+    rows = []
+    offset = 0
+    while True:
+        params = {
+            '$where': whereclause,
+            '$order': 'collision_id ASC',
+            '$limit': str(SODA_FETCH_PAGE_SIZE),
+            '$offset': str(offset),
+        }
+        if select:
+            params['$select'] = select
+
+        page = httpclient.get(SODA_API_COLLISIONS_BASEURL, params=params).json()
+
+        if isinstance(page, dict):  # error in SODA API call
+            raise Exception("SODA API error for {0}: {1}".format(whereclause, page.get('message')))
+
+        rows += page
+        if len(page) < SODA_FETCH_PAGE_SIZE:
+            break
+        offset += SODA_FETCH_PAGE_SIZE
 
-    logger.info('Getting data from Socrata SODA API as of {0}'.format(sincewhen))
-    try:
-        crashdata = requests.get(
-            SODA_API_COLLISIONS_BASEURL,
-            params={
-                '$where': "crash_date >= '%s'" % sincewhen.strftime('%Y-%m-%d'),
-                '$order': 'crash_date DESC',
-                '$limit': '50000',
-                '$$app_token': '%s' % SOCRATA_APP_TOKEN_PUBLIC
-            }
-        ).json()
-        
-        if isinstance(crashdata, list) and len(crashdata):  # this is good, the expected condition
-            logger.info('Got {0} SODA entries OK'.format(len(crashdata)))
-        elif isinstance(crashdata, dict):  # and crashdata['error'] error in SODA API call 
-            logger.error(crashdata['message'])
-            raise Exception("No data returned from SODA API")
-        else:  # no data?
-            logger.info('No data returned from SODA API, exiting.')
-            sys.exit()
-        
-    except Exception as e:
-        logger.info(e)
-        raise Exception("No data error from SODA API " + str(crashdata['message']) + " Exception detail " + str(e))
+    return rows
+
+
+def fetch_soda_partitions(partitions):
+    """
+    Fetch the SODA partitions via get_soda_partition(), yielding each one's rows as soon as it's in, in no particular order
+    Only SODA_FETCH_WORKERS partitions are fetched at a time, and the next is started only once one has been handed off,
+    so memory is bounded by those few partitions and not the whole window.
+    @param {partitions} list of $where clauses, one per partition
+    """
+    todo = list(partitions)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=SODA_FETCH_WORKERS) as pool:
+        while pending or todo:
+            while todo and len(pending) < SODA_FETCH_WORKERS:
+                pending.add(pool.submit(get_soda_partition, todo.pop(0), ':*,*'))
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    partitionrows = future.result()
+                except Exception as e:
+                    logger.info(e)
+                    raise Exception("No data error from SODA API. Exception detail " + str(e))
+                yield partitionrows
+
+
+def is_wide_sweep_due(checkpoints):
+    """
+    Should this run re-read the full FETCH_HOWMANY_MONTHS and UPDATES_HOW_FAR_BACK windows from SODA,
+    instead of only the records past the last run's checkpoints?
+    Yes if we have no checkpoints, if it's been WIDE_SWEEP_EVERY_DAYS since the last wide sweep,
+    or if it's requested by setting ETL_WIDE_SWEEP in the environment.
+    """
+    if os.environ.get('ETL_WIDE_SWEEP'):
+        return True
+
+    lastsweep = checkpoints.get('soda_last_wide_sweep')
+    if not lastsweep or not checkpoints.get('soda_created_at') or not checkpoints.get('soda_updated_at'):
+        return True
+
+    return date.today() - date.fromisoformat(lastsweep) >= timedelta(days=WIDE_SWEEP_EVERY_DAYS)
+
+
+def get_soda_data(checkpoints, widesweep, vehicleclassifier=None, intersectionfinder=None, extent=None):
+    """
+    Fetch new collision data from the Socrata SODA API.
+    Usually that's only the records created since the last run, per the checkpoints.
+    For a wide sweep it's everything within the last FETCH_HOWMANY_MONTHS; that window is split into
+    partitions of SODA_FETCH_PARTITION_DAYS days, fetched concurrently by a small pool of workers.
+    Either way get_soda_partition() pages through them, so there is no hard cap on the number of rows.
+    Each partition is inserted as it comes in, see format_soda_response(), skipping those already in CARTO per load_socrata_id_index()
+    @param {CheckpointStore} checkpoints
+    @param {bool} widesweep  see is_wide_sweep_due()
+    @param {VehicleClassifier} vehicleclassifier  to fill in the hasvehicle_XXX flags, or None to leave them for the hasvehicle batch job
+    @param {IntersectionFinder} intersectionfinder  to fill in intersection_id, or None to leave it for the intersections batch job
+    @param {tuple} extent  NYC's bounding box, outside which the_geom is left null; or None to leave that for filter_carto_data()
+    Returns the crash_date of the oldest crash fetched e.g. 2026-09-30, or None if there were none; see recent_window_start()
+    """
+    if widesweep:
+        sincewhen = (date.today() - relativedelta(months=FETCH_HOWMANY_MONTHS))
+
+        # one $where clause per partition; the last one is open-ended, same as the old single query was
+        partitions = []
+        startday = sincewhen
+        while True:
+            endday = startday + relativedelta(days=SODA_FETCH_PARTITION_DAYS)
+            if endday > date.today():
+                partitions.append("crash_date >= '{0}'".format(startday.strftime('%Y-%m-%d')))
+                break
+            partitions.append("crash_date >= '{0}' AND crash_date < '{1}'".format(startday.strftime('%Y-%m-%d'), endday.strftime('%Y-%m-%d')))
+            startday = endday
+
+        logger.info('Getting data from Socrata SODA API as of {0}, in {1} partitions'.format(sincewhen, len(partitions)))
+    else:
+        # records created since the last run, or with a higher ID than we've seen; re-fetching the last few is harmless
+        partitions = [
+            "(:created_at >= '{0}' OR collision_id > {1})".format(checkpoints.get('soda_created_at'), checkpoints.get('soda_max_collision_id', 0)),
+        ]
+        logger.info('Getting data from Socrata SODA API created since {0}'.format(checkpoints.get('soda_created_at')))
+
+    # each partition is transformed and inserted as soon as it's fetched, then dropped, so a wide sweep never holds the whole window
+    # the socrata_id index and boundary polygons are loaded along with the first partition, since those need the oldest crash date
+    # and the staging table is set up then too; all of the partitions go into it, and are merged into the crashes table at the end
+    idindex = None
+    failures = 0
+    howmany = 0
+    oldest = None
+    createdat = checkpoints.get('soda_created_at', '')
+    maxcollisionid = int(checkpoints.get('soda_max_collision_id', 0))
+
+    for partitionrows in fetch_soda_partitions(partitions):
+        if not partitionrows:
+            continue
+        howmany += len(partitionrows)
+        partitionoldest = min([row['crash_date'][:10] for row in partitionrows])
+        oldest = min(oldest, partitionoldest) if oldest else partitionoldest
+        createdat = max([row[':created_at'] for row in partitionrows] + [createdat])
+        maxcollisionid = max([int(row['collision_id']) for row in partitionrows] + [maxcollisionid])
+
+        if idindex is None:
+            # the socrata_id list only needs to cover the crash dates we actually got, which may go back further than the window
+            # an incremental fetch is the one partition, so that's known now
+            idindex, index_is_complete = load_socrata_id_index(sincewhen if widesweep else date.fromisoformat(partitionoldest))
+
+            # the boundary polygons, so the new crashes are inserted with their borough, precinct, etc. already filled in
+            placefinder = load_place_finder(CARTO_SQL_API_BASEURL, CARTO_CRASHES_TABLE, BOUNDARY_LAYERS, BOUNDARY_CACHE_DIR)
+
+            staging = set_up_carto_staging()
+
+        (partitionfailures, columnnames) = format_soda_response(partitionrows, idindex, index_is_complete, placefinder, vehicleclassifier, intersectionfinder, extent, staging)
+        failures += partitionfailures
+
+    if howmany and staging:
+        failures += merge_carto_staging(columnnames)
+
+    if howmany:  # this is good, the expected condition
+        logger.info('Got {0} SODA entries OK'.format(howmany))
+    elif widesweep:  # no data? for months?
+        logger.info('No data returned from SODA API, exiting.')
+        sys.exit()
+    else:  # no data since last night, that happens
+        logger.info('No new data from SODA API since last run')
+        return None
+
+    # pick up the records we just inserted, so the saved index is current for next time
+    if index_is_complete:
+        sync_socrata_id_index(idindex)
+
+    # advance the high-water marks past what we just loaded
+    # unless some inserts failed, in which case the next run should look at these again
+    if failures:
+        logger.info('Not advancing SODA checkpoints, since {0} insert chunks failed'.format(failures))
+        return oldest
+
+    checkpoints.set('soda_created_at', createdat)
+    checkpoints.set('soda_max_collision_id', maxcollisionid)
+    if widesweep:
+        checkpoints.set('soda_last_wide_sweep', date.today().isoformat())
+
+    return oldest
+
+
+def recent_window_start(crashdates):
+    """
+    The date from which the nightly UPDATEs should look for crashes needing their fields filled in, see recent_window_clause()
+    That's RECENT_WINDOW_DAYS ago, or earlier if any crash loaded or corrected this run is older than that.
+    @param {crashdates} list of crash dates e.g. 2026-09-30, of the crashes loaded or corrected; None is ignored
+    """
+    recent = (date.today() - timedelta(days=RECENT_WINDOW_DAYS)).isoformat()
+    return min([crashdate for crashdate in crashdates if crashdate] + [recent])
+
+
+def recent_window_clause(windowstart, tablealias=None):
+    """
+    A date_val condition to AND onto a nightly UPDATE's WHERE clause, so the date_val index finds the few crashes needing it
+    instead of the whole table being examined for IS NULL; or an empty string for a wide sweep, which looks at them all
+    @param {windowstart} date string from recent_window_start(), or None for all crashes
+    @param {tablealias} the crashes table's alias in the query, if any
+    """
+    if not windowstart:
+        return ''
+    return " AND {0}date_val >= '{1}'".format(tablealias + '.' if tablealias else '', windowstart)
+
+
+def load_socrata_id_index(sincewhen):
+    """
+    Load the index of socrata_id values already present in CARTO, returning a tuple: (index, is it complete?)
+    If SOCRATA_ID_INDEX_FILE is set, that file is loaded and caught up via sync_socrata_id_index()
+    and it covers the whole table, so records missing from it are known to be new.
+    If not (e.g. Heroku's throwaway filesystem), fall back to an in-memory index of just this time period,
+    same as we have always done; then create_sql_insert() still needs its own duplicate check.
+    """
+    if SOCRATA_ID_INDEX_FILE:
+        logger.info('Loading socrata_id index from {0}'.format(SOCRATA_ID_INDEX_FILE))
+        idindex = SocrataIdIndex(SOCRATA_ID_INDEX_FILE)
+        sync_socrata_id_index(idindex)
+        return (idindex, True)
 
     logger.info('Getting socrata_id list from CARTO as of {0}'.format(sincewhen))
     try:
-        alreadydata = requests.get(
+        alreadydata = httpclient.get(
             CARTO_SQL_API_BASEURL,
             params={
                 'q': "SELECT socrata_id FROM {0} WHERE date_val >= '{1}'".format(CARTO_CRASHES_TABLE, sincewhen.strftime('%Y-%m-%dT00:00:00Z')),
@@ -124,260 +377,170 @@ def get_soda_data():
         logger.error('No socrata_id rows: {0}'.format(json.dumps(alreadydata)))
         sys.exit(1)
 
-    socrata_already = [ r['socrata_id'] for r in alreadydata['rows'] ]
-    # logger.info(socrata_already)
-    logger.info('Got {0} socrata_id entries for existing CARTO records'.format(len(socrata_already)))
+    idindex = SocrataIdIndex()
+    for r in alreadydata['rows']:
+        if r['socrata_id'] is not None:
+            idindex.add(r['socrata_id'])
+    logger.info('Got {0} socrata_id entries for existing CARTO records'.format(len(idindex)))
 
-    # all done! hand off for real processing
-    format_soda_response(crashdata, socrata_already)
+    return (idindex, False)
 
 
-def format_string_for_postgres_array(values, field_name):
+def sync_socrata_id_index(idindex):
     """
-    Takes a values dictionary and field_name string as input and
-    converts them to a string formatted for a postgres text array.
-    @param {values} dictionary
-    @param {field_name} string
-    Any value for either contributing_factor_vehicle_* or vehicle_type_code*
-    from the SODA response are joined into a single string surrounded by {}
+    Catch up the socrata_id index with CARTO: add the socrata_id of every record past the index's
+    cartodb_id high-water mark, then save it. This catches records loaded by anything else too, e.g. the backlog script.
+    On a brand-new index this pages through the whole table; after that it's one small query.
     """
-    tmp_list = []
-
-    if field_name != 'contributing_factor_vehicle' and field_name != 'vehicle_type_code':
-        logger.error('format_postgres_array must take a valid field name type, %s provided' % field_name)
-        sys.exit(1)
-
-    # if field name matches contributing_factor_vehicle_{n} or vehicle_type_code{n}
-    for i in range(1, 6):
-        if field_name == 'contributing_factor_vehicle' or (field_name == 'vehicle_type_code' and i > 2):
-            field_name_full = "{0}_{1}".format(field_name, i)
-        else:
-            field_name_full = "{0}{1}".format(field_name, i)
-
-        if field_name_full in values:
-            for thisvalue in re.split(r'\s*,\s*', values[field_name_full]):  # comma split, strip spaces, skip blanks
-                toinsert = thisvalue.replace("'", "").strip()
-                if toinsert:
-                    tmp_list.append("'{0}'".format(toinsert))
-
-    return "ARRAY[%s]::text[]" % ','.join(tmp_list)
+    startfrom = max(0, idindex.max_cartodb_id - SOCRATA_ID_INDEX_OVERLAP)
+    logger.info('Catching up socrata_id index, {0} IDs known, from cartodb_id {1}'.format(len(idindex), startfrom))
 
+    while True:
+        sql = "SELECT cartodb_id, socrata_id FROM {0} WHERE cartodb_id > {1} ORDER BY cartodb_id LIMIT {2}".format(CARTO_CRASHES_TABLE, startfrom, SOCRATA_ID_INDEX_PAGE_SIZE)
+        try:
+            gotids = httpclient.get(CARTO_SQL_API_BASEURL, params={'q': sql}).json()
+        except requests.exceptions.RequestException as e:
+            logger.error(e.message)
+            sys.exit(1)
+        if not 'rows' in gotids:
+            logger.error('No socrata_id rows: {0}'.format(json.dumps(gotids)))
+            sys.exit(1)
 
-def format_string_for_insert_val():
-    """
-    Creates a placeholder string like \"({0}, {1}, {2}, {3}, {4}, ...)\" for the
-    Postgres INSERT value. Some of the {0} get \"dollar\" quotes for fields in the
-    crashes table that are of type text
-    """
-    val_string_tmp = []
+        for r in gotids['rows']:
+            if r['socrata_id'] is not None:
+                idindex.add(r['socrata_id'])
+            startfrom = r['cartodb_id']
+        idindex.max_cartodb_id = max(idindex.max_cartodb_id, startfrom)
 
-    for i in range(0, 23):
-        if i < 8 or i >= 14:
-            val_string_tmp.append("{%d}" % i)
-        elif i == 13:
-            val_string_tmp.append("'{%d}'::timestamptz" % i)
-        else:
-            val_string_tmp.append("$${%d}$$" % i)
+        if len(gotids['rows']) < SOCRATA_ID_INDEX_PAGE_SIZE:
+            break
 
-    return '(' + ','.join(val_string_tmp) + ')'
+    idindex.save()
+    logger.info('socrata_id index now has {0} IDs, through cartodb_id {1}'.format(len(idindex), idindex.max_cartodb_id))
 
 
-def format_soda_response(datarows, already_ids):
+def format_soda_response(datarows, already_ids, already_ids_complete=False, placefinder=None, vehicleclassifier=None, intersectionfinder=None, extent=None, staging=False):
     """
-    Transforms the JSON SODA response into rows for the SQL insert query
+    Transforms the JSON SODA response into rows for the SQL insert query, and inserts them
+    Returns a tuple: (the number of insert chunks which failed, see update_carto_table(); the list of column names inserted)
     @param {list} data
+    @param {SocrataIdIndex} already_ids
+    @param {bool} already_ids_complete  True if already_ids covers the whole table, see load_socrata_id_index()
+    @param {PlaceFinder} placefinder  to fill in the boundary columns, or None to leave them for the places batch job
+    @param {VehicleClassifier} vehicleclassifier  to fill in the hasvehicle_XXX flags and blame, or None to leave them for the batch jobs
+    @param {IntersectionFinder} intersectionfinder  to fill in intersection_id, or None to leave it for the intersections batch job
+    @param {tuple} extent  NYC's bounding box, outside which the_geom is left null; or None to leave that for filter_carto_data()
+    @param {bool} staging  load them into the staging table, for merge_carto_staging() to merge
     """
     # logger.info('Processing {} rows from SODA API.'.format(len(datarows)))
 
-    # array to store insert value strings
-    vals = []
-
-    # create our value template string once then copy it using string.slice when iterating over data list
-    insert_val_template_string = format_string_for_insert_val()
-
-    # iterate over data array and format each dictionary's values into strings for the INSERT SQL query
-    for row in datarows:
-        # this is already present at CARTO, don't insert a duplicate!
-        # see also create_sql_insert() which has a check as well, but it's A LOT more efficient to bail here
-        if int(row['collision_id']) in already_ids:
-            continue
-
-        datestring = "%sT%s" % (row['crash_date'].split('T')[0], row['crash_time'])
-        date_time = datetime.strptime(datestring, '%Y-%m-%dT%H:%M')
-
-        # latitude and longitude may or may not be present
-        if 'longitude' in row:
-            lng = row['longitude']
-        else:
-            lng = None
+    # skip any which are already present at CARTO, don't insert a duplicate!
+    # see also create_sql_insert() which has a check as well, but it's A LOT more efficient to bail here
+    datarows = [row for row in datarows if row['collision_id'] not in already_ids]
 
-        if 'latitude' in row:
-            lat = row['latitude']
-        else:
-            lat = None
+    # the columns depend on whether we're filling in the boundaries, and the vehicle flags & blame which are worked out for all rows at once
+    columns = crash_columns(placefinder, vehicleclassifier, datarows, intersectionfinder, extent)
+    soda_row_to_values = compile_transformer(columns)
 
-        if lat and lng:
-            the_geom = "ST_GeomFromText('Point({0} {1})', 4326)".format(lng, lat)
-        else:
-            the_geom = 'null'
-            lat = 'null'
-            lng = 'null'
-
-        # ditto for on_street_name
-        # dollar quote strings to escape single quotes in street names like "O'Brien"
-        if 'on_street_name' in row:
-            on_street_name = row['on_street_name'].strip()
-        else:
-            on_street_name = ''
-
-        # ditto for off_street_name
-        if 'off_street_name' in row:
-            off_street_name = row['off_street_name'].strip()
-        else:
-            off_street_name = ''
-
-        # ditto for cross_street_name
-        if 'cross_street_name' in row:
-            cross_street_name = row['cross_street_name'].strip()
-        else:
-            cross_street_name = ''
-
-        # ditto for zip_code
-        if 'zip_code' in row:
-            zipcode = row['zip_code']
-        else:
-            zipcode = ''
-
-        # Nov 2018, a few rare records (4022160, 4051650) lacks number_of_persons_X fields, which is a fatal error if we let it go
-        if 'number_of_persons_killed' not in row:
-            row['number_of_persons_killed'] = int(row['number_of_motorist_killed']) + int(row['number_of_cyclist_killed']) + int(row['number_of_pedestrians_killed'])
-        if 'number_of_persons_injured' not in row:
-            row['number_of_persons_injured'] = int(row['number_of_motorist_injured']) + int(row['number_of_cyclist_injured']) + int(row['number_of_pedestrians_injured'])
-
-        # format 5 potential values for contributing_factor into a string formatted for a Postgres array
-        contributing_factor = format_string_for_postgres_array(row, 'contributing_factor_vehicle')
-
-        # ditto for 5 potential vehicle_type values
-        vehicle_type = format_string_for_postgres_array(row, 'vehicle_type_code')
-
-        # copy our template value string
-        val_string = insert_val_template_string[:]
-
-        # create the sql value string
-        vals.append(val_string.format(
-            row['number_of_motorist_killed'],
-            row['number_of_motorist_injured'],
-            row['number_of_cyclist_killed'],
-            row['number_of_cyclist_injured'],
-            row['number_of_pedestrians_killed'],
-            row['number_of_pedestrians_injured'],
-            row['number_of_persons_killed'],
-            row['number_of_persons_injured'],
-            zipcode,
-            off_street_name,
-            cross_street_name,
-            on_street_name,
-            '',  # leave borough blank, update_borough() does a better job
-            date_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
-            lng,
-            lat,
-            the_geom,
-            vehicle_type,
-            contributing_factor,
-            date_time.strftime('%Y'),
-            date_time.strftime('%m'),
-            '1',
-            str(row['collision_id'])
-        ))
-
-        # logger.info([ str(row['collision_id']), date_time.strftime('%Y-%m-%dT%H:%M:%SZ'),lng, lat ])
+    # format each record's values into a row for the INSERT SQL query, see etlcommon/sodarows.py
+    vals = [soda_row_to_values(row) for row in datarows]
 
     logger.info('Found {0} new rows to insert into CARTO'.format(len(vals)))
 
     # ready, go ahead and submit them
-    update_carto_table(vals)
+    # if the index covers the whole table, whatever got past it is known to be new
+    columnnames = [column.name for column in columns]
+    return (update_carto_table(vals, columnnames, skip_duplicate_check=already_ids_complete, staging=staging), columnnames)
 
 
-def create_sql_insert(vals):
+def create_sql_insert(vals, columnnames=CRASH_COLUMN_NAMES, skip_duplicate_check=False):
     """
     Creates the SQL INSERT statment using a list of formatted strings for
     each row being inserted.
     @param {vals} list of strings
+    @param {columnnames} list of the field names for the crashes table which get values inserted into them, in the same order as the rows
+    @param {skip_duplicate_check} bool  skip the NOT IN check, when the rows are already known to be new
     """
 
-    # field names for the crashes table which get values inserted into them
-    column_names_string = '''
-    number_of_motorist_killed
-    number_of_motorist_injured
-    number_of_cyclist_killed
-    number_of_cyclist_injured
-    number_of_pedestrian_killed
-    number_of_pedestrian_injured
-    number_of_persons_killed
-    number_of_persons_injured
-    zip_code
-    off_street_name
-    cross_street_name
-    on_street_name
-    borough
-    date_val
-    longitude
-    latitude
-    the_geom
-    vehicle_type
-    contributing_factor
-    year
-    month
-    crash_count
-    socrata_id
-    '''
-    column_name_list_tmp = [n.strip() for n in column_names_string.split('\n')]
-    column_name_list = [n for n in column_name_list_tmp if n != '']
-
     # only insert data that doesn't exist in our table already
+    # that check re-reads every socrata_id in the table, so skip it if the caller already knows
+    if skip_duplicate_check:
+        duplicate_check = ''
+    else:
+        duplicate_check = '''
+    WHERE n.socrata_id NOT IN (
+    SELECT socrata_id FROM {0}
+    WHERE socrata_id IS NOT NULL
+    )
+    '''.format(CARTO_CRASHES_TABLE)
+
     sql = '''
     WITH
     n({0}) AS (
     VALUES {1}
     )
     INSERT INTO {2} ({0})
-    SELECT n.number_of_motorist_killed,
-    n.number_of_motorist_injured,
-    n.number_of_cyclist_killed,
-    n.number_of_cyclist_injured,
-    n.number_of_pedestrian_killed,
-    n.number_of_pedestrian_injured,
-    n.number_of_persons_killed,
-    n.number_of_persons_injured,
-    n.zip_code,
-    n.off_street_name,
-    n.cross_street_name,
-    n.on_street_name,
-    n.borough,
-    n.date_val,
-    n.longitude,
-    n.latitude,
-    n.the_geom,
-    n.vehicle_type,
-    n.contributing_factor,
-    n.year,
-    n.month,
-    n.crash_count,
-    n.socrata_id
+    SELECT {4}
     FROM n
-    WHERE n.socrata_id NOT IN (
-    SELECT socrata_id FROM {2}
-    WHERE socrata_id IS NOT NULL
-    )
-    '''.format(','.join(column_name_list), ','.join(vals), CARTO_CRASHES_TABLE)
+    {3}
+    '''.format(','.join(columnnames), ','.join(vals), CARTO_CRASHES_TABLE, duplicate_check, ','.join(['n.' + name for name in columnnames]))
     # logger.info('SQL UPSERT query:\n %s' % sql)
 
     return sql
 
 
-def filter_carto_data():
+def create_sql_staging_table():
+    """
+    SQL to create the staging table afresh: empty, with all of the same columns as the crashes table,
+    so it takes whichever columns we're inserting, e.g. with or without the boundaries filled in.
+    It's recreated for each run, so it picks up any columns added to the crashes table e.g. intersection_id,
+    and rows left over from a run which failed before merging are dropped, not merged with this batch's columns;
+    that run didn't advance the SODA checkpoints, so those crashes have been fetched again anyway.
+    """
+    return '''
+    DROP TABLE IF EXISTS {0};
+    CREATE TABLE {0} AS
+    SELECT * FROM {1} WHERE false
+    '''.format(CARTO_STAGING_TABLE, CARTO_CRASHES_TABLE)
+
+
+def create_sql_staging_insert(vals, columnnames=CRASH_COLUMN_NAMES):
+    """
+    Like create_sql_insert() but into the staging table, with no duplicate check; see create_sql_staging_merge()
+    @param {vals} list of strings
+    @param {columnnames} list of field names, in the same order as the rows
+    """
+    return '''
+    INSERT INTO {0} ({1})
+    VALUES {2}
+    '''.format(CARTO_STAGING_TABLE, ','.join(columnnames), ','.join(vals))
+
+
+def create_sql_staging_merge(columnnames=CRASH_COLUMN_NAMES):
+    """
+    SQL to copy the crashes from the staging table into the crashes table, skipping those already there.
+    This is the one query which has to look over the whole crashes table's socrata_id, instead of one per chunk.
+    A crash may be in staging twice, e.g. a chunk which timed out but went in after all, then was sent again; so DISTINCT ON to insert it only once.
+    @param {columnnames} list of field names which were loaded into staging
+    """
+    return '''
+    INSERT INTO {1} ({2})
+    SELECT DISTINCT ON (s.socrata_id) {3}
+    FROM {0} s
+    WHERE NOT EXISTS (
+    SELECT 1 FROM {1} p
+    WHERE p.socrata_id = s.socrata_id
+    )
+    ORDER BY s.socrata_id
+    '''.format(CARTO_STAGING_TABLE, CARTO_CRASHES_TABLE, ','.join(columnnames), ','.join(['s.' + name for name in columnnames]))
+
+
+def filter_carto_data(windowstart=None):
     """
     SQL query that filters out data outside of NYC, including incorrectly geocoded data.
+    New crashes and lat-long corrections are checked against the same extent as they're loaded, see load_extent(),
+    so this is only run in a wide sweep, or if the extent couldn't be loaded.
+    @param {windowstart} only look at crashes from this date on, see recent_window_clause()
     """
 
     sql = '''
@@ -388,7 +551,7 @@ def filter_carto_data():
     WITH box AS (
     SELECT ST_SetSRID(ST_Extent(the_geom), 4326)::geometry as the_geom,
     666 as cartodb_id
-    FROM nyc_borough
+    FROM {2}
     )
     SELECT
     c.cartodb_id
@@ -397,487 +560,648 @@ def filter_carto_data():
     box AS a ON
     ST_Intersects(c.the_geom, a.the_geom)
     WHERE a.cartodb_id IS NULL
-    AND c.the_geom IS NOT NULL
+    AND c.the_geom IS NOT NULL{1}
     )
-    '''.format(CARTO_CRASHES_TABLE)
+    '''.format(CARTO_CRASHES_TABLE, recent_window_clause(windowstart, 'c'), CARTO_EXTENT_TABLE)
     # logger.info('SQL UPDATE query:\n %s' % sql)
 
     return sql
 
 
-def update_borough():
+def update_places(windowstart=None):
     """
-    SQL query to update the borough column in the crashes table
+    SQL query to update the borough, city council, and other boundary columns in the crashes table, see BOUNDARY_LAYERS
+    New crashes are usually inserted already tagged, see load_place_finder(), so this is a safety net for the rest:
+    those which moved per find_updated_latlongs(), those right on a boundary line, or if the polygons couldn't be loaded.
+    This is one UPDATE for all of the layers, so a crash is rewritten once with all of its boundaries, not once per layer.
+    Only columns not yet tagged are looked up, and only crashes which gain a value are rewritten;
+    e.g. a crash out in the harbor with no borough doesn't get rewritten every night.
+    @param {windowstart} only look at crashes from this date on, see recent_window_clause()
     """
-    logger.info('Cleanup update_borough()')
+    logger.info('Cleanup update_places()')
+
+    lookups = []
+    missing = []
+    setvalues = []
+    gainsvalue = []
+    for i, boundinfo in enumerate(BOUNDARY_LAYERS):
+        ismissing = "c.{0} IS NULL".format(boundinfo['targetnamefield'])
+        if boundinfo.get('blankismissing'):
+            ismissing = "({0} OR c.{1}='')".format(ismissing, boundinfo['targetnamefield'])
+        polygonname = "a.{0}".format(boundinfo['polygonname'])
+        if boundinfo.get('cast'):
+            polygonname = "{0}::{1}".format(polygonname, boundinfo['cast'])
+
+        # the polygon lookup only happens if this column is missing, otherwise the lateral gives a NULL and we keep what's there
+        lookups.append("""
+        LEFT JOIN LATERAL (
+            SELECT {polygonname} AS value FROM {polygontable} a
+            WHERE {ismissing} AND ST_Within(c.the_geom, a.the_geom)
+            LIMIT 1
+        ) l{i} ON true""".format(i=i, polygonname=polygonname, polygontable=boundinfo['polygontable'], ismissing=ismissing))
+        missing.append(ismissing)
+        setvalues.append("{0} = COALESCE(t.{0}, {1}.{0})".format(boundinfo['targetnamefield'], CARTO_CRASHES_TABLE))
+        gainsvalue.append("t.{0} IS NOT NULL".format(boundinfo['targetnamefield']))
 
     sql = '''
     UPDATE {0}
-    SET borough = a.borough
-    FROM nyc_borough a
-    WHERE {0}.the_geom IS NOT NULL AND ST_Within({0}.the_geom, a.the_geom)
-    AND ({0}.borough IS NULL OR {0}.borough='')
-    '''.format(CARTO_CRASHES_TABLE)
+    SET {1}
+    FROM (
+        SELECT c.cartodb_id, {2}
+        FROM {0} c
+        {3}
+        WHERE c.the_geom IS NOT NULL AND ({4}){6}
+    ) t
+    WHERE {0}.cartodb_id = t.cartodb_id
+    AND ({5})
+    '''.format(
+        CARTO_CRASHES_TABLE,
+        ',\n    '.join(setvalues),
+        ', '.join(["l{0}.value AS {1}".format(i, boundinfo['targetnamefield']) for i, boundinfo in enumerate(BOUNDARY_LAYERS)]),
+        ''.join(lookups),
+        ' OR '.join(missing),
+        ' OR '.join(gainsvalue),
+        recent_window_clause(windowstart, 'c')
+    )
     return sql
 
 
-def update_city_council():
+def make_carto_sql_api_request(query):
     """
-    SQL query to update the city_council column in the crashes table
+    Takes an SQL query and uses it with a POST request to
+    the CARTO SQL API. Passing the API key allows for doing
+    INSERT, UPDATE, and DELETE queries.
+    @param {query} string
     """
-    logger.info('Cleanup update_city_council()')
+    payload = {'q': query, 'api_key': CARTO_API_KEY}
 
-    sql = '''
-    UPDATE {0}
-    SET city_council = a.identifier
-    FROM nyc_city_council a
-    WHERE {0}.the_geom IS NOT NULL AND ST_Within({0}.the_geom, a.the_geom)
-    AND ({0}.city_council IS NULL)
-    '''.format(CARTO_CRASHES_TABLE)
-    return sql
+    try:
+        # print(CARTO_SQL_API_BASEURL)
+        # print(payload)
+        r = httpclient.post(CARTO_SQL_API_BASEURL, data=payload)
+        logger.info(r.text)
+    except requests.exceptions.RequestException as e:
+        logger.error(e.message)
+        sys.exit(1)
 
 
-def update_senate():
+def insert_carto_chunk(query, apikey=CARTO_API_KEY):
     """
-    SQL query to update the senate column in the crashes table
+    Like make_carto_sql_api_request() but for one INSERT chunk of several running concurrently:
+    rather than exiting the whole script on failure, return a tuple (reply, error message)
+    where the error message is None if the chunk went in fine.
+    @param {query} string
+    @param {apikey} string  the staging table is only writable with the master key
     """
-    logger.info('Cleanup update_senate()')
+    payload = {'q': query, 'api_key': apikey}
 
-    sql = '''
-    UPDATE {0}
-    SET senate = a.identifier
-    FROM nyc_senate a
-    WHERE {0}.the_geom IS NOT NULL AND ST_Within({0}.the_geom, a.the_geom)
-    AND ({0}.senate IS NULL)
-    '''.format(CARTO_CRASHES_TABLE)
-    return sql
+    try:
+        reply = httpclient.post(CARTO_SQL_API_BASEURL, data=payload).json()
+    except requests.exceptions.RequestException as e:
+        return (None, str(e))
+    except ValueError as e:  # not JSON, e.g. a gateway error page
+        return (None, 'Bad response from CARTO: {}'.format(e))
+
+    if 'error' in reply:
+        return (reply, '; '.join(reply['error']) if isinstance(reply['error'], list) else str(reply['error']))
+
+    return (reply, None)
 
 
-def update_assembly():
+def run_carto_batchjobs(latlongupdates, on_corrections_done, checkpoints, hasvehicle=True, windowstart=None, vehicleclassifier=None, intersections=True, killcountupdates=None):
     """
-    SQL query to update the assembly column in the crashes table
+    Run the longer-running updates via the Batch API, each after those whose results it needs, and wait for them all.
+    * the corrections are first: lat-longs, and injury/fatality counts if there are too many to have done them directly
+    * the intersections crashcounts and places are after the corrections, since those move crashes and change their severity
+    * the blame allocations are after hasvehicle if it's running, since they're calculated from the hasvehicle flags
+      and after the count corrections, since those may have NULLed the blame for this job to recalculate
+    * re-flagging crashes for crosswalk changes is after hasvehicle too, and before blame so they don't contend for the same rows
+    * the VACUUM is after everything else, so it doesn't fight the others for locks and only repacks once
+      if any of them fail the VACUUM is skipped too, and tomorrow's run will get it
+    Failed jobs are reported via email.
+    @param {latlongupdates} list of SQL UPDATE queries from find_updated_latlongs(), maybe empty
+    @param {on_corrections_done} function called once the data loading and corrections are all done
+    @param {checkpoints} CheckpointStore, for the intersections crashcount's incremental updates
+    @param {hasvehicle} bool  include the hasvehicle job; not needed if new crashes were inserted with their flags set
+    @param {windowstart} the jobs which fill in missing fields only look at crashes from this date on, or all of them if None; see recent_window_start()
+    @param {vehicleclassifier} VehicleClassifier, whose crosswalk is compared to the last run's; see reclassify_vehicletypes_job()
+    @param {intersections} bool  include the intersections crashcount job; not until the crashes table has intersection_id, see has_intersection_id()
+    @param {killcountupdates} list of SQL UPDATE queries from find_updated_killcounts() to run as a job, maybe empty
     """
-    logger.info('Cleanup update_assembly()')
+    # before on_corrections_done() may save the checkpoints, since this may set one
+    reclassify = reclassify_vehicletypes_job(vehicleclassifier, checkpoints, after=['hasvehicle'] if hasvehicle else []) if vehicleclassifier else None
 
-    sql = '''
-    UPDATE {0}
-    SET assembly = a.identifier
-    FROM nyc_assembly a
-    WHERE {0}.the_geom IS NOT NULL AND ST_Within({0}.the_geom, a.the_geom)
-    AND ({0}.assembly IS NULL)
-    '''.format(CARTO_CRASHES_TABLE)
-    return sql
+    # the checkpoints are saved once all of the corrections are done, whichever finishes last
+    corrections = [name for name, queries in (('killcounts', killcountupdates), ('latlongs', latlongupdates)) if queries]
+    correctionsleft = set(corrections)
 
+    def correction_done(jobname):
+        correctionsleft.discard(jobname)
+        if not correctionsleft:
+            on_corrections_done(jobname)
 
-def update_businessdistrict():
-    """
-    SQL query to update the businessdistrict column in the crashes table
-    """
-    logger.info('Cleanup update_businessdistrict()')
+    jobs = []
+    if killcountupdates:
+        jobs.append(BatchJob('killcounts', killcountupdates, on_done=correction_done))
+    if latlongupdates:
+        jobs.append(BatchJob('latlongs', latlongupdates, on_done=correction_done))
+    if not corrections:
+        on_corrections_done(None)
 
-    sql = '''
-    UPDATE {0}
-    SET businessdistrict = a.bidistrict
-    FROM nyc_businessdistrict a
-    WHERE {0}.the_geom IS NOT NULL AND ST_Within({0}.the_geom, a.the_geom)
-    AND ({0}.businessdistrict IS NULL)
-    '''.format(CARTO_CRASHES_TABLE)
-    return sql
+    # update the nyc_intersections crashcount field, giving a rough idea of the most crashy intersections citywide
+    if intersections:
+        jobs.append(intersections_crashcount_job(checkpoints, after=corrections, windowstart=windowstart))
 
+    # update the borough, city councily, nypd precinct, and other such containing zones, for query filtering
+    jobs.append(BatchJob('places', [
+        update_places(windowstart),
+    ], after=corrections))
 
-def update_community_board():
-    """
-    SQL query to update the community_board column in the crashes table
-    """
-    logger.info('Cleanup update_community_board()')
+    if hasvehicle:
+        jobs.append(BatchJob('hasvehicle', [update_hasvehicle(fieldsuffix, category, windowstart) for fieldsuffix, category in HASVEHICLE_CATEGORIES]))
 
-    sql = '''
-    UPDATE {0}
-    SET community_board = a.identifier
-    FROM nyc_community_board a
-    WHERE {0}.the_geom IS NOT NULL AND ST_Within({0}.the_geom, a.the_geom)
-    AND ({0}.community_board IS NULL)
-    '''.format(CARTO_CRASHES_TABLE)
-    return sql
+    # crashes with a vehicle type alias which was added or changed in the crosswalk since the last run
+    if reclassify:
+        jobs.append(reclassify)
 
+    # blame allocations is a series of longer-running queries
+    # they have "where is null" clauses, so shouldn't take TOO long to run since they're only for a few hundred records at a time
+    # but if you're doing a bulk backlog, it could take 15 minutes for the series
+    jobs.append(BatchJob('blame', update_blame_allocations(windowstart), after=(['hasvehicle'] if hasvehicle else []) + (['reclassify'] if reclassify else []) + (['killcounts'] if killcountupdates else [])))
 
-def update_neighborhood():
-    """
-    SQL query to update the neighborhood column in the crashes table
-    """
-    logger.info('Cleanup update_neighborhood()')
+    # a final cleanup/repacking of the table
+    # because those updates can bloat the table and falsely hit our storage quota
+    # particularly if we've done a larger update e.g. hasvehicle without NOT NULL, or a "backlog" run
+    # what's needed is decided once the others are done, from the table's stats; usually not a VACUUM FULL
+    jobs.append(BatchJob('vacuum', update_analyzeindex, after=[job.name for job in jobs]))
 
-    sql = '''
-    UPDATE {0}
-    SET neighborhood = a.identifier
-    FROM nyc_neighborhood a
-    WHERE {0}.the_geom IS NOT NULL AND ST_Within({0}.the_geom, a.the_geom)
-    AND ({0}.neighborhood IS NULL OR {0}.neighborhood='')
-    '''.format(CARTO_CRASHES_TABLE)
-    return sql
+    logger.info('Batch jobs launching: {}'.format(', '.join([job.name for job in jobs])))
+    scheduler = BatchJobScheduler(CARTO_BATCH_API_BASEURL, CARTO_MASTER_KEY, wait_max=BATCHJOB_WAIT_MAX_SECONDS)
+    results = scheduler.run(jobs)
 
+    for result in results.values():
+        logger.info('Batch job {}: {}, queued {} seconds, ran {} seconds'.format(result.name, result.status, result.queued_seconds, result.run_seconds))
 
-def update_nypd_precinct():
-    """
-    SQL query to update the nypd_precinct column in the crashes table
-    """
-    logger.info('Cleanup update_nypd_precinct()')
+    problems = ['{} ({}): {} {}'.format(result.name, result.jobid, result.status, result.message) for result in results.values() if result.status != 'done']
+    if problems:
+        send_email_notification("{} batch jobs did not finish".format(len(problems)), "<br/>".join(problems))
 
-    sql = '''
-    UPDATE {0}
-    SET nypd_precinct = a.identifier::int
-    FROM nyc_nypd_precinct a
-    WHERE {0}.the_geom IS NOT NULL AND ST_Within({0}.the_geom, a.the_geom)
-    AND ({0}.nypd_precinct IS NULL)
-    '''.format(CARTO_CRASHES_TABLE)
-    return sql
+    return results
 
 
-def make_carto_sql_api_request(query):
+def get_max_cartodb_id_from_carto():
     """
-    Takes an SQL query and uses it with a POST request to
-    the CARTO SQL API. Passing the API key allows for doing
-    INSERT, UPDATE, and DELETE queries.
-    @param {query} string
+    Find the highest cartodb_id in the crashes table, i.e. the newest crash loaded so far
     """
-    payload = {'q': query, 'api_key': CARTO_API_KEY}
+    query = "SELECT MAX(cartodb_id) AS maxid FROM {0}".format(CARTO_CRASHES_TABLE)
 
     try:
-        # print(CARTO_SQL_API_BASEURL)
-        # print(payload)
-        r = requests.post(CARTO_SQL_API_BASEURL, data=payload)
-        logger.info(r.text)
+        r = httpclient.get(CARTO_SQL_API_BASEURL, params={'q': query})
+        data = r.json()
     except requests.exceptions.RequestException as e:
         logger.error(e.message)
         sys.exit(1)
 
+    if ('rows' in data) and len(data['rows']):
+        return int(data['rows'][0]['maxid'] or 0)
+    else:
+        logger.error('get_max_cartodb_id_from_carto(): No rows in response from %s' % CARTO_CRASHES_TABLE, json.dumps(data))
+        sys.exit(1)
 
-def start_carto_batchjob(querylist):
-    # print(query)
 
-    url = "{}?api_key={}".format(CARTO_BATCH_API_BASEURL, CARTO_MASTER_KEY)
-    jsonbody = {
-        'query': querylist,
-    }
+def is_intersections_rebuild_due(checkpoints, sincewhens):
+    """
+    Should the intersections crash counts be recounted from scratch, instead of adjusted by the crashes entering and leaving the windows?
+    Yes if we have no checkpoints from the last count e.g. a column was added to INTERSECTION_COUNTS, if a window somehow went backward,
+    if it's been INTERSECTIONS_REBUILD_EVERY_DAYS since the last rebuild, or if it's requested by setting ETL_INTERSECTIONS_REBUILD in the environment.
+    The periodic rebuild also catches what the deltas can't see: crashes whose location or injury counts were corrected after being counted.
+    @param {checkpoints} CheckpointStore
+    @param {sincewhens} dict of INTERSECTION_COUNTS targetfield => date string, the start of its window now
+    """
+    if os.environ.get('ETL_INTERSECTIONS_REBUILD'):
+        return True
 
-    try:
-        r = requests.post(url, json=jsonbody)
-        jobinfo = r.json()
-        if 'error' in jobinfo and jobinfo['error']:
-            raise ValueError(jobinfo['error'])
-        jobid = jobinfo['job_id']
-        logger.info('CARTO Batch Job ID: {}'.format(jobid))
-        return jobid
-    except requests.exceptions.RequestException as e:
-        logger.error(e.message)
-        sys.exit(1)
-    except Exception as e:
-        logger.error(e.message)
-        sys.exit(1)
+    lastrebuild = checkpoints.get('intersections_last_rebuild')
+    if not lastrebuild or not checkpoints.get('intersections_max_cartodb_id'):
+        return True
+    for targetfield, sincewhen in sincewhens.items():
+        lastsince = checkpoints.get('intersections_since_{}'.format(targetfield))
+        if not lastsince or sincewhen < lastsince:
+            return True
 
+    return date.today() - date.fromisoformat(lastrebuild) >= timedelta(days=INTERSECTIONS_REBUILD_EVERY_DAYS)
 
-def status_carto_batchjob(jobid):
-    # simply fetch and return the status of a CartoDB batch job
-    url = "{}/{}?api_key={}".format(CARTO_BATCH_API_BASEURL, jobid, CARTO_MASTER_KEY)
-    jobstatus = requests.get(url).json()
-    return jobstatus['status']
 
+def intersections_crashcount_job(checkpoints, after, windowstart=None):
+    """
+    The BatchJob to bring the nyc_intersections count fields up to date, see INTERSECTION_COUNTS
+    giving a rough idea of the most crashy intersections citywide
+    Usually that's an incremental update, see update_intersections_crashcount_delta(), with a full recount now and then.
+    Either way, the checkpoints describing what's been counted are written in the same statement as the counts,
+    so they can't get out of step even if the job fails partway.
+    @param {checkpoints} CheckpointStore
+    @param {after} list of job names which must finish first
+    @param {windowstart} only fill in intersection_id for crashes from this date on, see recent_window_clause()
+        but a full recount fills it in for the whole table, since any crash still without one would be left out of the counts
+    """
+    monthsago = {months: get_date_monthsago_from_carto(months) for months in set([countinfo['months'] for countinfo in INTERSECTION_COUNTS])}
+    sincewhens = OrderedDict([(countinfo['targetfield'], monthsago[countinfo['months']]) for countinfo in INTERSECTION_COUNTS])
+    maxid = get_max_cartodb_id_from_carto()
+
+    newcheckpoints = {'intersections_max_cartodb_id': maxid}
+    for targetfield, sincewhen in sincewhens.items():
+        newcheckpoints['intersections_since_{}'.format(targetfield)] = sincewhen
+
+    if is_intersections_rebuild_due(checkpoints, sincewhens):
+        logger.info('Intersections counts full recount, through cartodb_id {}'.format(maxid))
+        windowstart = None
+        newcheckpoints['intersections_last_rebuild'] = date.today().isoformat()
+        sql = update_intersections_crashcount(sincewhens, maxid, checkpoints.upsert_sql(newcheckpoints))
+    else:
+        lastsinces = OrderedDict([(targetfield, checkpoints.get('intersections_since_{}'.format(targetfield))) for targetfield in sincewhens])
+        lastmaxid = int(checkpoints.get('intersections_max_cartodb_id'))
+        logger.info('Intersections counts adjusted, through cartodb_id {} (was through {})'.format(maxid, lastmaxid))
+        sql = update_intersections_crashcount_delta(lastsinces, lastmaxid, sincewhens, maxid, checkpoints.upsert_sql(newcheckpoints))
+
+    return BatchJob('intersections', [update_crash_intersection_ids(windowstart), sql], after=after)
 
-def wait_carto_batchjob(jobid):
-    # loop and wait, blocking until the batch job has completed
-    url = "{}/{}?api_key={}".format(CARTO_BATCH_API_BASEURL, jobid, CARTO_MASTER_KEY)
-    logger.info("Waiting for batch job {} to complete".format(jobid))
 
-    while True:
-        time.sleep(10)
+def update_crash_intersection_ids(windowstart=None):
+    """
+    Fill in intersection_id for crashes which don't have it yet: those with no location when inserted, those moved
+    by find_updated_latlongs() if the intersections couldn't be loaded, or the whole table the first time.
+    New crashes usually have it already, see load_intersection_finder(). Where circles overlap, the nearest center wins, same as there.
+    Crashes in no circle get NO_INTERSECTION, so they're not looked at again.
+    @param {windowstart} only look at crashes from this date on, see recent_window_clause()
+    """
+    sql = """
+        UPDATE {0}
+        SET intersection_id = COALESCE((
+            SELECT {1}.cartodb_id FROM {1}
+            WHERE ST_CONTAINS({1}.the_geom, {0}.the_geom)
+            ORDER BY ST_Distance(ST_Centroid({1}.the_geom), {0}.the_geom)
+            LIMIT 1
+        ), {2})
+        WHERE intersection_id IS NULL AND the_geom IS NOT NULL{3}
+    """.format(
+        CARTO_CRASHES_TABLE,
+        CARTO_INTERSECTIONS_TABLE,
+        NO_INTERSECTION,
+        recent_window_clause(windowstart, CARTO_CRASHES_TABLE)
+    )
 
-        jobstatus = requests.get(url).json()
-        logger.info("Status of batch job {} is {}".format(jobid, jobstatus['status']))
+    return sql
 
-        if jobstatus['status'] == 'running' or jobstatus['status'] == 'pending':  # still running, give it another sleep-loop
-            continue
-        elif jobstatus['status'] == 'done':  # yay! break which will implicitly return
-            break
-        elif jobstatus['status'] == 'failed':  # failed, throw a fit and exit
-            errmessage = "Batch job {} failed: {}".format(jobid, jobstatus['failed_reason'])
-            logger.error(errmessage)
-            sys.exit(1)
-        else:  # unexpected condition, throw a fit
-            errmessage = "Batch job {} exited with unknown status: {}".format(jobid, jobstatus['status'])
-            logger.error(errmessage)
-            sys.exit(1)
 
-    return jobstatus['status']  # should only return "done" since other conditions exit() here
+def update_intersections_crashcount(sincewhens, maxid, checkpointsql):
+    """
+    Recount the nyc_intersections count fields listed in INTERSECTION_COUNTS e.g. crashcount,
+    the number of crashes found within that circle in the last M months, which match that count's severity filter.
+    Which circle a crash is in was worked out ahead of time as its intersection_id, so this is a GROUP BY and not a spatial join,
+    and all of the counts come from the one pass over the crashes, each a conditional COUNT.
+    Intersections with no such crashes get NULL. Only rows where some count changed are written.
+    @param {sincewhens} dict of targetfield => date string, the start of its window
+    @param {maxid} the highest crashes cartodb_id to count, so the next delta knows where this count left off
+    @param {checkpointsql} INSERT query for the checkpoints, run as part of the same statement
+    """
+    counts = []
+    setvalues = []
+    changed = []
+    for countinfo in INTERSECTION_COUNTS:
+        targetfield = countinfo['targetfield']
+        counts.append("NULLIF(COUNT(CASE WHEN date_val >= '{0}' AND ({1}) THEN 1 END), 0) AS {2}".format(sincewhens[targetfield], INTERSECTION_COUNT_SEVERITIES[countinfo['severity']], targetfield))
+        setvalues.append("{0} = allcounts.{0}".format(targetfield))
+        changed.append("{0}.{1} IS DISTINCT FROM allcounts.{1}".format(CARTO_INTERSECTIONS_TABLE, targetfield))
 
+    sql = """
+        WITH counts AS (
+            SELECT intersection_id AS cartodb_id, {2}
+            FROM {1}
+            WHERE intersection_id > {6}
+                AND date_val >= '{3}'
+                AND cartodb_id <= {4}
+            GROUP BY intersection_id
+        ),
+        allcounts AS (
+            SELECT {0}.cartodb_id, {7}
+            FROM {0}
+            LEFT JOIN counts ON {0}.cartodb_id = counts.cartodb_id
+        ),
+        updated AS (
+            UPDATE {0}
+            SET {8}
+            FROM allcounts
+            WHERE {0}.cartodb_id = allcounts.cartodb_id
+            AND ({9})
+        )
+        {5}
+    """.format(
+        CARTO_INTERSECTIONS_TABLE,
+        CARTO_CRASHES_TABLE,
+        ',\n                '.join(counts),
+        min(sincewhens.values()),
+        maxid,
+        checkpointsql,
+        NO_INTERSECTION,
+        ', '.join(["counts.{0}".format(targetfield) for targetfield in sincewhens]),
+        ', '.join(setvalues),
+        ' OR '.join(changed)
+    )
 
-def clear_intersections_crashcount():
-    logger.info('Intersections crashcount reset')
-    return "UPDATE {} SET crashcount=NULL".format(CARTO_INTERSECTIONS_TABLE)
+    return sql
 
 
-def update_intersections_crashcount():
+def update_intersections_crashcount_delta(lastsinces, lastmaxid, sincewhens, maxid, checkpointsql):
     """
-    Update the nyc_intersections table crashcount field, the number of crashes found within that circle
-    in the last M months, which did have at least 1 fatality or injury.
+    Adjust the nyc_intersections count fields listed in INTERSECTION_COUNTS by only the crashes which changed since the last count:
+    * add those loaded since then (cartodb_id past the last count's) which fall within the window
+    * subtract those which were counted last time, but have now aged out of the window
+    All of the counts come from the one pass over those crashes, each a conditional SUM of +1 and -1.
+    Only the intersections with a net change are written; a count which drops to 0 goes back to NULL, as a recount would leave it.
+    Changes to crashes already counted aren't reflected until the next rebuild, e.g. a corrected injury count or a late intersection_id;
+    such a crash may be subtracted when it ages out without having been added, so the counts are floored at 0 rather than going negative.
+    @param {lastsinces} dict of targetfield => date string, the start of its window as of the last count
+    @param {lastmaxid} the highest crashes cartodb_id as of the last count
+    @param {sincewhens} dict of targetfield => date string, the start of its window now
+    @param {maxid} the highest crashes cartodb_id now
+    @param {checkpointsql} INSERT query for the checkpoints, run as part of the same statement
     """
-
-    sincewhen = get_date_monthsago_from_carto(INTERSECTIONS_CRASHCOUNT_MONTHS)
-    logger.info('Intersections crashcount dated {}'.format(sincewhen))
+    deltas = []
+    setvalues = []
+    changed = []
+    for countinfo in INTERSECTION_COUNTS:
+        targetfield = countinfo['targetfield']
+        deltas.append("""SUM(CASE
+                    WHEN NOT COALESCE(({0}), false) THEN 0
+                    WHEN cartodb_id > {1} AND date_val >= '{3}' THEN 1
+                    WHEN cartodb_id <= {1} AND date_val >= '{2}' AND date_val < '{3}' THEN -1
+                    ELSE 0
+                END) AS {4}""".format(INTERSECTION_COUNT_SEVERITIES[countinfo['severity']], lastmaxid, lastsinces[targetfield], sincewhens[targetfield], targetfield))
+        setvalues.append("{1} = NULLIF(GREATEST(COALESCE({0}.{1}, 0) + delta.{1}, 0), 0)".format(CARTO_INTERSECTIONS_TABLE, targetfield))
+        changed.append("delta.{0} != 0".format(targetfield))
 
     sql = """
-        WITH counts AS (
-            SELECT {0}.the_geom, {0}.cartodb_id, COUNT(*) AS howmany
+        WITH delta AS (
+            SELECT intersection_id AS cartodb_id, {2}
             FROM {1}
-            JOIN {0} ON
-                ST_CONTAINS({0}.the_geom,{1}.the_geom)
-                AND {1}.date_val >= '{2}'
-                AND ({1}.number_of_persons_injured > 0 OR {1}.number_of_persons_killed > 0)
-            GROUP BY {0}.cartodb_id
+            WHERE intersection_id > {7}
+                AND (
+                    (cartodb_id > {3} AND cartodb_id <= {5} AND date_val >= '{4}')
+                    OR
+                    (cartodb_id <= {3} AND date_val >= '{8}' AND date_val < '{9}')
+                )
+            GROUP BY intersection_id
+        ),
+        updated AS (
+            UPDATE {0}
+            SET {10}
+            FROM delta
+            WHERE {0}.cartodb_id = delta.cartodb_id
+            AND ({11})
         )
-        UPDATE {0}
-        SET crashcount = counts.howmany
-        FROM counts
-        WHERE {0}.cartodb_id = counts.cartodb_id
+        {6}
     """.format(
         CARTO_INTERSECTIONS_TABLE,
         CARTO_CRASHES_TABLE,
-        sincewhen
+        ',\n                '.join(deltas),
+        lastmaxid,
+        min(sincewhens.values()),
+        maxid,
+        checkpointsql,
+        NO_INTERSECTION,
+        min(lastsinces.values()),
+        max(sincewhens.values()),
+        ', '.join(setvalues),
+        ' OR '.join(changed)
     )
 
     return sql
 
 
-def update_blame_allocations():
+def update_blame_allocations(windowstart=None, vehicletypes=None):
     """
-    Dan's formulas for allocating blame for fatalities & injuries
+    Dan's formulas for allocating blame for fatalities & injuries, see etlcommon/blame.py
     These form a series of long-running queries which should be executed via batch mode
     * define crashes with no known vehicle types, and those with only bikes & scoters to take the blame
     * multiply blame coefficient * injury/fatality count to get number to blame per mode
     * assign the per mode injury/fatality blames, usually all-or-nothing
+    New crashes usually come in with these filled in already, see vehicle_columns(), so these only catch the rest
+    @param {windowstart} only look at crashes from this date on, see recent_window_clause()
+    @param {vehicletypes} or instead, only look at crashes with any of these vehicle_type values, see reclassify_vehicletypes_job()
     """
+    if vehicletypes:
+        limitto = " AND {}".format(vehicletype_overlap_clause(vehicletypes))
+    else:
+        limitto = recent_window_clause(windowstart)
+
     return [
-        """
-        UPDATE {0}
-            --set other to TRUE if nothing else is selected, which catches crashes with no vtype data
-            SET hasvehicle_other_unspecified = 
-            CASE
-                WHEN 
-                    (hasvehicle_bicycle::int + hasvehicle_motorcycle::int + hasvehicle_scooter::int + hasvehicle_busvan::int + hasvehicle_car::int + hasvehicle_suv::int + hasvehicle_truck::int + hasvehicle_other::int = 0)
-                THEN 
-                    TRUE
-                ELSE hasvehicle_other 
-            END,
-            -- Determine if this record will "blame" bikes or scooters for injuries or deaths, only in cases with no other motor vehicles
-            bike_blame = 
-            CASE
-                WHEN
-                    (hasvehicle_bicycle OR hasvehicle_scooter) AND (hasvehicle_motorcycle::int + hasvehicle_busvan::int + hasvehicle_car::int + hasvehicle_suv::int + hasvehicle_truck::int + hasvehicle_other::int = 0)
-                THEN
-                    TRUE
-                ELSE
-                    FALSE
-            END,
-            --determine the number of blameable vehicles involved and then turn to percentage blame. Run as suqquery to it can be used for math
-            blame_factor = 
-            CASE
-                WHEN
-                    (hasvehicle_bicycle OR hasvehicle_scooter) AND (hasvehicle_motorcycle::int + hasvehicle_busvan::int + hasvehicle_car::int + hasvehicle_suv::int + hasvehicle_truck::int + hasvehicle_other::int = 0)
-                THEN
-                    (1 / CAST (NULLIF((hasvehicle_bicycle::int + hasvehicle_scooter::int),0) as FLOAT))
-                ELSE
-                    (1 / CAST (
-                            NULLIF(
-                                (hasvehicle_motorcycle::int + hasvehicle_busvan::int + hasvehicle_car::int + hasvehicle_suv::int + hasvehicle_truck::int + hasvehicle_other::int)
-                                + 
-                                (CASE 
-                                    WHEN (hasvehicle_bicycle::int + hasvehicle_motorcycle::int + hasvehicle_scooter::int + hasvehicle_busvan::int + hasvehicle_car::int + hasvehicle_suv::int + hasvehicle_truck::int + hasvehicle_other::int = 0) 
-                                    THEN 
-                                        1 
-                                    ELSE 
-                                    0 END
-                                ),0) as FLOAT))
-            END
-        WHERE hasvehicle_other_unspecified IS NULL
-        """.format(CARTO_CRASHES_TABLE),
-        """
-        UPDATE {0} SET
-            cyclist_injured_allocated = (blame_factor * number_of_cyclist_injured),
-            cyclist_killed_allocated = (blame_factor * number_of_cyclist_killed),
-            motorist_injured_allocated = (blame_factor * number_of_motorist_injured),
-            motorist_killed_allocated = (blame_factor * number_of_motorist_killed),
-            pedestrian_injured_allocated = (blame_factor * number_of_pedestrian_injured),
-            pedestrian_killed_allocated = (blame_factor * number_of_pedestrian_killed),
-            persons_injured_allocated = (blame_factor * (number_of_pedestrian_injured + number_of_cyclist_injured + number_of_motorist_injured) ),
-            persons_killed_allocated = (blame_factor * (number_of_pedestrian_killed + number_of_cyclist_killed + number_of_motorist_killed))
-        WHERE persons_injured_allocated IS NULL
-        """.format(CARTO_CRASHES_TABLE),
         """
         UPDATE {0} SET
-            --hasvehicle_bicycle
-            cyclist_injured_bybike = CASE WHEN (bike_blame is TRUE AND hasvehicle_bicycle is TRUE) THEN cyclist_injured_allocated ELSE 0 END,
-            cyclist_killed_bybike = CASE WHEN (bike_blame is TRUE AND hasvehicle_bicycle is TRUE) THEN cyclist_killed_allocated ELSE 0 END,
-            motorist_injured_bybike = CASE WHEN (bike_blame is TRUE AND hasvehicle_bicycle is TRUE) THEN motorist_injured_allocated ELSE 0 END,
-            motorist_killed_bybike = CASE WHEN (bike_blame is TRUE AND hasvehicle_bicycle is TRUE) THEN motorist_killed_allocated ELSE 0 END,
-            pedestrian_injured_bybike = CASE WHEN (bike_blame is TRUE AND hasvehicle_bicycle is TRUE) THEN pedestrian_injured_allocated ELSE 0 END,
-            pedestrian_killed_bybike = CASE WHEN (bike_blame is TRUE AND hasvehicle_bicycle is TRUE) THEN pedestrian_killed_allocated ELSE 0 END,
-            persons_injured_bybike = CASE WHEN (bike_blame is TRUE AND hasvehicle_bicycle is TRUE) THEN persons_injured_allocated ELSE 0 END,
-            persons_killed_bybike = CASE WHEN (bike_blame is TRUE AND hasvehicle_bicycle is TRUE) THEN persons_killed_allocated ELSE 0 END,
-            --hasvehicle_scooter
-            cyclist_injured_byscooter = CASE WHEN (bike_blame is TRUE AND hasvehicle_scooter is TRUE) THEN cyclist_injured_allocated ELSE 0 END,
-            cyclist_killed_byscooter = CASE WHEN (bike_blame is TRUE AND hasvehicle_scooter is TRUE) THEN cyclist_killed_allocated ELSE 0 END,
-            motorist_injured_byscooter = CASE WHEN (bike_blame is TRUE AND hasvehicle_scooter is TRUE) THEN motorist_injured_allocated ELSE 0 END,
-            motorist_killed_byscooter = CASE WHEN (bike_blame is TRUE AND hasvehicle_scooter is TRUE) THEN motorist_killed_allocated ELSE 0 END,
-            pedestrian_injured_byscooter = CASE WHEN (bike_blame is TRUE AND hasvehicle_scooter is TRUE) THEN pedestrian_injured_allocated ELSE 0 END,
-            pedestrian_killed_byscooter = CASE WHEN (bike_blame is TRUE AND hasvehicle_scooter is TRUE) THEN pedestrian_killed_allocated ELSE 0 END,
-            persons_injured_byscooter = CASE WHEN (bike_blame is TRUE AND hasvehicle_scooter is TRUE) THEN persons_injured_allocated ELSE 0 END,
-            persons_killed_byscooter = CASE WHEN (bike_blame is TRUE AND hasvehicle_scooter is TRUE) THEN persons_killed_allocated ELSE 0 END,
-            --hasvehicle_motorcycle
-            cyclist_injured_bymotorcycle = CASE WHEN (hasvehicle_motorcycle is TRUE) THEN cyclist_injured_allocated ELSE 0 END,
-            cyclist_killed_bymotorcycle = CASE WHEN (hasvehicle_motorcycle is TRUE) THEN cyclist_killed_allocated ELSE 0 END,
-            motorist_injured_bymotorcycle = CASE WHEN (hasvehicle_motorcycle is TRUE) THEN motorist_injured_allocated ELSE 0 END,
-            motorist_killed_bymotorcycle = CASE WHEN (hasvehicle_motorcycle is TRUE) THEN motorist_killed_allocated ELSE 0 END,
-            pedestrian_injured_bymotorcycle = CASE WHEN (hasvehicle_motorcycle is TRUE) THEN pedestrian_injured_allocated ELSE 0 END,
-            pedestrian_killed_bymotorcycle = CASE WHEN (hasvehicle_motorcycle is TRUE) THEN pedestrian_killed_allocated ELSE 0 END,
-            persons_injured_bymotorcycle = CASE WHEN (hasvehicle_motorcycle is TRUE) THEN persons_injured_allocated ELSE 0 END,
-            persons_killed_bymotorcycle = CASE WHEN (hasvehicle_motorcycle is TRUE) THEN persons_killed_allocated ELSE 0 END,
-            --hasvehicle_busvan
-            cyclist_injured_bybusvan = CASE WHEN (hasvehicle_busvan is TRUE) THEN cyclist_injured_allocated ELSE 0 END,
-            cyclist_killed_bybusvan = CASE WHEN (hasvehicle_busvan is TRUE) THEN cyclist_killed_allocated ELSE 0 END,
-            motorist_injured_bybusvan = CASE WHEN (hasvehicle_busvan is TRUE) THEN motorist_injured_allocated ELSE 0 END,
-            motorist_killed_bybusvan = CASE WHEN (hasvehicle_busvan is TRUE) THEN motorist_killed_allocated ELSE 0 END,
-            pedestrian_injured_bybusvan = CASE WHEN (hasvehicle_busvan is TRUE) THEN pedestrian_injured_allocated ELSE 0 END,
-            pedestrian_killed_bybusvan = CASE WHEN (hasvehicle_busvan is TRUE) THEN pedestrian_killed_allocated ELSE 0 END,
-            persons_injured_bybusvan = CASE WHEN (hasvehicle_busvan is TRUE) THEN persons_injured_allocated ELSE 0 END,
-            persons_killed_bybusvan = CASE WHEN (hasvehicle_busvan is TRUE) THEN persons_killed_allocated ELSE 0 END,
-            --hasvehicle_car
-            cyclist_injured_bycar = CASE WHEN (hasvehicle_car is TRUE) THEN cyclist_injured_allocated ELSE 0 END,
-            cyclist_killed_bycar = CASE WHEN (hasvehicle_car is TRUE) THEN cyclist_killed_allocated ELSE 0 END,
-            motorist_injured_bycar = CASE WHEN (hasvehicle_car is TRUE) THEN motorist_injured_allocated ELSE 0 END,
-            motorist_killed_bycar = CASE WHEN (hasvehicle_car is TRUE) THEN motorist_killed_allocated ELSE 0 END,
-            pedestrian_injured_bycar = CASE WHEN (hasvehicle_car is TRUE) THEN pedestrian_injured_allocated ELSE 0 END,
-            pedestrian_killed_bycar = CASE WHEN (hasvehicle_car is TRUE) THEN pedestrian_killed_allocated ELSE 0 END,
-            persons_injured_bycar = CASE WHEN (hasvehicle_car is TRUE) THEN persons_injured_allocated ELSE 0 END,
-            persons_killed_bycar = CASE WHEN (hasvehicle_car is TRUE) THEN persons_killed_allocated ELSE 0 END,
-            --hasvehicle_suv
-            cyclist_injured_bysuv = CASE WHEN (hasvehicle_suv is TRUE) THEN cyclist_injured_allocated ELSE 0 END,
-            cyclist_killed_bysuv = CASE WHEN (hasvehicle_suv is TRUE) THEN cyclist_killed_allocated ELSE 0 END,
-            motorist_injured_bysuv = CASE WHEN (hasvehicle_suv is TRUE) THEN motorist_injured_allocated ELSE 0 END,
-            motorist_killed_bysuv = CASE WHEN (hasvehicle_suv is TRUE) THEN motorist_killed_allocated ELSE 0 END,
-            pedestrian_injured_bysuv = CASE WHEN (hasvehicle_suv is TRUE) THEN pedestrian_injured_allocated ELSE 0 END,
-            pedestrian_killed_bysuv = CASE WHEN (hasvehicle_suv is TRUE) THEN pedestrian_killed_allocated ELSE 0 END,
-            persons_injured_bysuv = CASE WHEN (hasvehicle_suv is TRUE) THEN persons_injured_allocated ELSE 0 END,
-            persons_killed_bysuv = CASE WHEN (hasvehicle_suv is TRUE) THEN persons_killed_allocated ELSE 0 END,
-            --hasvehicle_truck
-            cyclist_injured_bytruck = CASE WHEN (hasvehicle_truck is TRUE) THEN cyclist_injured_allocated ELSE 0 END,
-            cyclist_killed_bytruck = CASE WHEN (hasvehicle_truck is TRUE) THEN cyclist_killed_allocated ELSE 0 END,
-            motorist_injured_bytruck = CASE WHEN (hasvehicle_truck is TRUE) THEN motorist_injured_allocated ELSE 0 END,
-            motorist_killed_bytruck = CASE WHEN (hasvehicle_truck is TRUE) THEN motorist_killed_allocated ELSE 0 END,
-            pedestrian_injured_bytruck = CASE WHEN (hasvehicle_truck is TRUE) THEN pedestrian_injured_allocated ELSE 0 END,
-            pedestrian_killed_bytruck = CASE WHEN (hasvehicle_truck is TRUE) THEN pedestrian_killed_allocated ELSE 0 END,
-            persons_injured_bytruck = CASE WHEN (hasvehicle_truck is TRUE) THEN persons_injured_allocated ELSE 0 END,
-            persons_killed_bytruck = CASE WHEN (hasvehicle_truck is TRUE) THEN persons_killed_allocated ELSE 0 END,    
-            --hasvehicle_other_unspecified
-            cyclist_injured_byother = CASE WHEN (hasvehicle_other_unspecified is TRUE) THEN cyclist_injured_allocated ELSE 0 END,
-            cyclist_killed_byother = CASE WHEN (hasvehicle_other_unspecified is TRUE) THEN cyclist_killed_allocated ELSE 0 END,
-            motorist_injured_byother = CASE WHEN (hasvehicle_other_unspecified is TRUE) THEN motorist_injured_allocated ELSE 0 END,
-            motorist_killed_byother = CASE WHEN (hasvehicle_other_unspecified is TRUE) THEN motorist_killed_allocated ELSE 0 END,
-            pedestrian_injured_byother = CASE WHEN (hasvehicle_other_unspecified is TRUE) THEN pedestrian_injured_allocated ELSE 0 END,
-            pedestrian_killed_byother = CASE WHEN (hasvehicle_other_unspecified is TRUE) THEN pedestrian_killed_allocated ELSE 0 END,
-            persons_injured_byother = CASE WHEN (hasvehicle_other_unspecified is TRUE) THEN persons_injured_allocated ELSE 0 END,
-            persons_killed_byother = CASE WHEN (hasvehicle_other_unspecified is TRUE) THEN persons_killed_allocated ELSE 0 END
-        WHERE cyclist_injured_bycar IS NULL
-        """.format(CARTO_CRASHES_TABLE),
+            {1}
+        WHERE {2}{3}
+        """.format(
+            CARTO_CRASHES_TABLE,
+            ',\n            '.join(['{} = {}'.format(column, expression) for column, expression in expressions.items()]),
+            where,
+            limitto
+        )
+        for expressions, where in BLAME_PASSES
     ]
 
 
-def update_carto_table(crashrecords):
+def update_carto_table(crashrecords, columnnames=CRASH_COLUMN_NAMES, skip_duplicate_check=False, staging=False):
     """
     Updates the master crashes table on CARTO.
     We need to do this in chunks because CARTO keeps lowering their query timeouts,
     and we can't even handle a single day's crash records (500+ per day) in a single query anymore.
+    With staging, the chunks go into the staging table instead, and merge_carto_staging() copies them into the crashes table
+    once all of this run's crashes are in; see set_up_carto_staging()
+    Returns the number of chunks which failed.
+    @param {crashrecords} list of VALUES row strings
+    @param {columnnames} list of field names, in the same order as the rows
+    @param {skip_duplicate_check} bool  see create_sql_insert()
+    @param {staging} bool  load into the staging table, which the caller has set up
     """
     if not len(crashrecords):
         logger.info('No rows to insert; moving on')
-        return
-
-    crashesperslice = 50
-    for crashslice in array_split(crashrecords, crashesperslice):
-        logger.info("Insert chunk of up to {} crash records".format(crashesperslice))
-        sql = create_sql_insert(crashslice)
-        make_carto_sql_api_request(sql)
+        return 0
 
+    # the staging table doesn't need a duplicate check per chunk, just the one when merging
+    if staging:
+        apikey = CARTO_MASTER_KEY
+        chunkmax = CARTO_STAGING_CHUNK_MAX
+    else:
+        apikey = CARTO_API_KEY
+        chunkmax = CARTO_INSERT_CHUNK_MAX
+
+    # the chunks are sent by a few workers at once, see CARTO_INSERT_WORKERS
+    # the chunk size adapts to how long CARTO takes, and a chunk which times out is split in half and sent again
+    # a chunk which fails otherwise is logged and reported, but doesn't stop the others; those crashes will be picked up again tomorrow
+    sizer = AdaptiveChunkSizer(initial=CARTO_INSERT_CHUNK_SIZE, maximum=chunkmax, target_seconds=CARTO_INSERT_TARGET_SECONDS)
+    position = 0
+    retries = []
+    failures = []
+    howmanydone = 0
+
+    with ThreadPoolExecutor(max_workers=CARTO_INSERT_WORKERS) as pool:
+        pending = {}
+        while pending or retries or position < len(crashrecords):
+            # keep all of the workers busy, with retries first
+            while len(pending) < CARTO_INSERT_WORKERS and (retries or position < len(crashrecords)):
+                # a retried slice always gets the duplicate check, in case some of it went in after all
+                if retries:
+                    crashslice = retries.pop(0)
+                    skipcheck = False
+                else:
+                    crashslice = crashrecords[position:position + sizer.size]
+                    position += len(crashslice)
+                    skipcheck = skip_duplicate_check
+                if staging:
+                    sql = create_sql_staging_insert(crashslice, columnnames)
+                else:
+                    sql = create_sql_insert(crashslice, columnnames, skipcheck)
+                pending[pool.submit(insert_carto_chunk, sql, apikey)] = crashslice
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                crashslice = pending.pop(future)
+                (reply, error) = future.result()
+
+                if error and is_timeout_error(error) and len(crashslice) > 1:
+                    sizer.timed_out()
+                    half = len(crashslice) // 2
+                    retries += [crashslice[:half], crashslice[half:]]
+                    logger.warning("Insert chunk of {} crash records timed out; retrying in halves, chunk size now {}".format(len(crashslice), sizer.size))
+                elif error:
+                    logger.error("Insert chunk of {} crash records failed: {}".format(len(crashslice), error))
+                    failures.append("{} crash records: {}".format(len(crashslice), error))
+                else:
+                    sizer.record(float(reply.get('time', 0)))
+                    howmanydone += len(crashslice)
+                    logger.info("Insert chunk of {} crash records: {} rows in {} seconds, {} of {} done, chunk size now {}".format(
+                        len(crashslice), reply.get('total_rows'), reply.get('time'), howmanydone, len(crashrecords), sizer.size
+                    ))
+
+    if failures:
+        logger.error("{} insert chunks failed".format(len(failures)))
+        send_email_notification("{} insert chunks failed".format(len(failures)), "<br/>".join(failures))
+
+    return len(failures)
+
+
+def set_up_carto_staging():
+    """
+    Create the staging table afresh for this run's new crashes, see create_sql_staging_table()
+    Returns True if it's ready, or False if it couldn't be set up, in which case the crashes are INSERTed directly instead.
+    """
+    if CARTO_INSERT_MODE != 'staging':
+        return False
 
-def array_split(inputlist, itemsperchunk):
-    # break an array into chunks of X elements apiece
-    # https://www.geeksforgeeks.org/break-list-chunks-size-n-python/
-    chunks = [inputlist[i * itemsperchunk:(i + 1) * itemsperchunk] for i in range((len(inputlist) + itemsperchunk - 1) // itemsperchunk )]  
-    return chunks
+    (reply, error) = insert_carto_chunk(create_sql_staging_table(), CARTO_MASTER_KEY)
+    if error:
+        logger.warning("Could not set up staging table {}, inserting directly instead: {}".format(CARTO_STAGING_TABLE, error))
+        return False
+    return True
 
 
-def find_updated_killcounts():
+def merge_carto_staging(columnnames):
     """
-    Issue 12 and 13: a crash can be changed later when an injury turns out to be fatal, sometimes several 2-3 months later.
-    Look for recently-updated records where their injury & killed counts are now different from CARTO.
-    Then update the CARTO copy with the new injury & fatality counts.
+    Copy whatever made it into the staging table into the crashes table, once for the whole run, then empty staging.
+    If the merge fails, it counts as a failure so the checkpoints aren't advanced, and the next run loads these crashes again.
+    Returns 1 if the merge failed, else 0, to add to the insert chunk failures.
+    @param {columnnames} list of field names which were loaded into staging
+    """
+    (reply, error) = insert_carto_chunk(create_sql_staging_merge(columnnames), CARTO_MASTER_KEY)
+    if error:
+        logger.error("Merging staging table {} failed: {}".format(CARTO_STAGING_TABLE, error))
+        send_email_notification("Merging staging table failed", "Merging staging table {}: {}".format(CARTO_STAGING_TABLE, error))
+        return 1
+
+    logger.info("Merged {} new crash records from staging table in {} seconds".format(reply.get('total_rows'), reply.get('time')))
+    (reply, error) = insert_carto_chunk("TRUNCATE TABLE {}".format(CARTO_STAGING_TABLE), CARTO_MASTER_KEY)
+    if error:
+        logger.warning("Could not empty staging table {}: {}".format(CARTO_STAGING_TABLE, error))
+    return 0
+
+
+# the fields of a SODA record which the reconcilers care about, see get_soda_changefeed()
+ChangedCrash = namedtuple('ChangedCrash', [
+    'crash_date',
+    'latitude', 'longitude',
+    'motorist_killed', 'motorist_injured',
+    'cyclist_killed', 'cyclist_injured',
+    'pedestrians_killed', 'pedestrians_injured',
+    'persons_killed', 'persons_injured',
+])
+
+
+def get_soda_changefeed(checkpoints, widesweep):
+    """
+    Fetch the SODA records updated/modified since the last run per the checkpoints, or for a wide sweep
+    since UPDATES_HOW_FAR_BACK days ago; once, for all of the reconcilers e.g. find_updated_killcounts() and find_updated_latlongs()
+    Returns a dict of collision_id => ChangedCrash, keeping only the fields we compare, already typed.
     """
     # fetch the SODA records updated since X days ago, where the update-date is NOT the same as the created-date
     # most records are updated seconds to minutes after creation, (seemingly) as an artifact of their workflow
     # those don't really count because we would have grabbed them the next day
-    # generate an assoc:  sodacrashrecords[crashid] = crashdetails
-    sincewhen = (date.today() - relativedelta(days=UPDATES_HOW_FAR_BACK))
-    logger.info('find_updated_killcounts() Find SODA records updated/modified since {0}'.format(sincewhen))
+    if widesweep:
+        sincewhen = (date.today() - relativedelta(days=UPDATES_HOW_FAR_BACK)).strftime('%Y-%m-%d')
+    else:
+        sincewhen = checkpoints.get('soda_updated_at')
+    logger.info('get_soda_changefeed() Find SODA records updated/modified since {0}'.format(sincewhen))
 
-    try:
-        crashdata = requests.get(
-            SODA_API_COLLISIONS_BASEURL,
-            params={
-                '$select': ':*,*',
-                '$where': ":updated_at >= '%s'" % sincewhen.strftime('%Y-%m-%d'),
-                '$limit': '50000'
-            }
-        ).json()
-    except requests.exceptions.RequestException as e:
-        logger.error(e.message)
-        sys.exit(1)
+    crashdata = get_soda_partition(":updated_at >= '%s'" % sincewhen, select=':*,*')
 
-    if isinstance(crashdata, list) and len(crashdata):  # this is good, the expected condition
-        sodacrashrecords = {}
-        for crash in crashdata:
-            if crash[':updated_at'][:10] > crash[':created_at'][:10]:  # per above, updated AFTER it was created
-                sodacrashrecords[int(crash['collision_id'])] = crash
-        logger.info('Got {0} SODA entries updated since {1}'.format(len(sodacrashrecords), sincewhen))
-    elif isinstance(crashdata, dict) and crashdata['error']:  # error in SODA API call
-        logger.error(crashdata['message'])
-        sys.exit(1)
-    else:  # no data?
-        logger.info('No data returned from Socrata, exiting.')
-        sys.exit()
+    # next run picks up from the latest update we saw here; this is only saved once the run is done, see main()
+    if crashdata:
+        checkpoints.set('soda_updated_at', max([crash[':updated_at'] for crash in crashdata] + [checkpoints.get('soda_updated_at', '')]))
 
-    # SODA uses JSON but doesn't use typing; the tallies and IDs come across as strings; fix that
-    intfields = (
-        'collision_id',
-        'number_of_motorist_killed', 'number_of_motorist_injured',
-        'number_of_cyclist_killed', 'number_of_cyclist_injured',
-        'number_of_pedestrians_killed', 'number_of_pedestrians_injured',
-        'number_of_persons_killed', 'number_of_persons_injured',
-    )
-    for crashid,crash in sodacrashrecords.items():
+    changefeed = {}
+    for crash in crashdata:
+        if crash[':updated_at'][:10] <= crash[':created_at'][:10]:  # per above, only those updated AFTER they were created
+            continue
+
+        # SODA uses JSON but doesn't use typing; the tallies and IDs come across as strings; fix that
         # Nov 2018, a few rare records (4022160, 4051650) lacks number_of_persons_X fields, which is a fatal error if we let it go
-        if 'number_of_persons_killed' not in sodacrashrecords[crashid]:
-            sodacrashrecords[crashid]['number_of_persons_killed'] = int(sodacrashrecords[crashid]['number_of_motorist_killed']) + int(sodacrashrecords[crashid]['number_of_cyclist_killed']) + int(sodacrashrecords[crashid]['number_of_pedestrians_killed'])
-        if 'number_of_persons_injured' not in sodacrashrecords[crashid]:
-            sodacrashrecords[crashid]['number_of_persons_injured'] = int(sodacrashrecords[crashid]['number_of_motorist_injured']) + int(sodacrashrecords[crashid]['number_of_cyclist_injured']) + int(sodacrashrecords[crashid]['number_of_pedestrians_injured'])
+        mk = int(crash['number_of_motorist_killed'])
+        mi = int(crash['number_of_motorist_injured'])
+        ck = int(crash['number_of_cyclist_killed'])
+        ci = int(crash['number_of_cyclist_injured'])
+        pk = int(crash['number_of_pedestrians_killed'])
+        pi = int(crash['number_of_pedestrians_injured'])
+        tk = int(crash['number_of_persons_killed']) if 'number_of_persons_killed' in crash else mk + ck + pk
+        ti = int(crash['number_of_persons_injured']) if 'number_of_persons_injured' in crash else mi + ci + pi
 
-        for field in intfields:
-            sodacrashrecords[crashid][field] = int(sodacrashrecords[crashid][field])
+        # latitude and longitude may or may not be present, and 0 means not geocoded
+        lat = float(crash['latitude']) if crash.get('latitude') else None
+        lng = float(crash['longitude']) if crash.get('longitude') else None
 
+        changefeed[int(crash['collision_id'])] = ChangedCrash(crash['crash_date'][:10], lat, lng, mk, mi, ck, ci, pk, pi, tk, ti)
+
+    logger.info('get_soda_changefeed() Got {0} SODA entries updated since {1}'.format(len(changefeed), sincewhen))
+    return changefeed
+
+
+def find_updated_killcounts(changefeed):
+    """
+    Issue 12 and 13: a crash can be changed later when an injury turns out to be fatal, sometimes several 2-3 months later.
+    Look for recently-updated records where their injury & killed counts are now different from CARTO.
+    Then update the CARTO copy with the new injury & fatality counts.
+    Usually there are few enough to update right here; more than KILLCOUNT_BATCHAPI_THRESHOLD are handed back to run as a batch job instead,
+    so the jobs which depend on the counts e.g. blame run after them, see run_carto_batchjobs()
+    Returns a tuple: (list of UPDATE queries for the batch job, maybe empty; the number of chunks whose CARTO records couldn't be fetched)
+    @param {changefeed} dict of recently-updated SODA records, from get_soda_changefeed()
+    """
     # fetch the CARTO records corresponding to these recently-updated SODA records
     # length of the above is on the order of 50 updates per week or 225 per month,
     # EXCEPT in weird cases (issue 17) where there's a massive update like 1200 records in 2018-08-22 through 2018-08-25
     # so, we do them in chunks of 200 and there will USUALLY be only one such chunk
-    allcrashids = list(sodacrashrecords.keys())
+    allcrashids = list(changefeed.keys())
     chunkstart = 0
     howmanyperchunk = 200
+    updatestatements = []
+    howmanyupdated = 0
+    failures = 0
     while True:
         chunkend = chunkstart + howmanyperchunk
         thesecrashes = allcrashids[chunkstart:chunkend]
@@ -888,18 +1212,22 @@ def find_updated_killcounts():
         chunkstart += howmanyperchunk  # for next loop
 
         try:
-            cartocrashdata = requests.get(
+            cartocrashdata = httpclient.get(
                 CARTO_SQL_API_BASEURL,
                 params={
                     'q': "SELECT * FROM {0} WHERE socrata_id IN ({1})".format(CARTO_CRASHES_TABLE, crashidlist),
                 }
             ).json()
-        except requests.exceptions.RequestException as e:
-            logger.error(e.message)
-            sys.exit(1)
-        if not 'rows' in cartocrashdata or not len(cartocrashdata['rows']):
-            logger.error('No socrata_id rows: {0}'.format(json.dumps(cartocrashdata)))
-            sys.exit(1)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            cartocrashdata = {'error': str(e)}
+        if not 'rows' in cartocrashdata:
+            logger.error('Fetching CARTO records for this block failed: {0}'.format(json.dumps(cartocrashdata)))
+            failures += 1
+            continue
+        # none of them may be in CARTO, e.g. crashes not yet inserted, or filtered out
+        if not len(cartocrashdata['rows']):
+            logger.info('    Found no CARTO entries in this block')
+            continue
         cartocrashdata = cartocrashdata['rows']
         logger.info('    Found {0} CARTO entries in this block'.format(len(cartocrashdata)))
 
@@ -907,18 +1235,19 @@ def find_updated_killcounts():
         # if their kill/injury counts don't match, stick them onto a list for updating
         # tip: pedestrian fields have variation: number_of_pedestrian_killed & number_of_pedestrians_killed (with/without S) and also injured
         recordstoupdate = []
+        recordflags = []
         for cartocrash in cartocrashdata:
             crashid = cartocrash['socrata_id']
-            sodacrash = sodacrashrecords[crashid]
+            sodacrash = changefeed[crashid]
 
-            smk = sodacrash['number_of_motorist_killed']
-            smi = sodacrash['number_of_motorist_injured']
-            sck = sodacrash['number_of_cyclist_killed']
-            sci = sodacrash['number_of_cyclist_injured']
-            spk = sodacrash['number_of_pedestrians_killed']
-            spi = sodacrash['number_of_pedestrians_injured']
-            stk = sodacrash['number_of_persons_killed']
-            sti = sodacrash['number_of_persons_injured']
+            smk = sodacrash.motorist_killed
+            smi = sodacrash.motorist_injured
+            sck = sodacrash.cyclist_killed
+            sci = sodacrash.cyclist_injured
+            spk = sodacrash.pedestrians_killed
+            spi = sodacrash.pedestrians_injured
+            stk = sodacrash.persons_killed
+            sti = sodacrash.persons_injured
 
             cmk = cartocrash['number_of_motorist_killed']
             cmi = cartocrash['number_of_motorist_injured']
@@ -940,69 +1269,110 @@ def find_updated_killcounts():
                 stk=stk, sti=sti, spk=spk, spi=spi, smk=smk, smi=smi, sck=sck, sci=sci
             ))
 
-            # don't forget to NULL out fields used by update_blame_allocations() so the blame counts will be recalculated
-            sql = """UPDATE {table} SET 
-                    number_of_motorist_killed={smk}, number_of_motorist_injured={smi},
-                    number_of_cyclist_killed={sck}, number_of_cyclist_injured={sci},
-                    number_of_pedestrian_killed={spk}, number_of_pedestrian_injured={spi},
-                    number_of_persons_killed={stk}, number_of_persons_injured={sti},
-                    hasvehicle_other_unspecified=NULL, persons_injured_allocated=NULL, cyclist_injured_bycar=NULL
-                    WHERE socrata_id={id}""".format(
-                    table=CARTO_CRASHES_TABLE,
-                    stk=stk, sti=sti,
-                    spk=spk, spi=spi,
-                    smk=smk, smi=smi,
-                    sck=sck, sci=sci,
-                    id=crashid
-                )
-            # logger.info(sql)
-            make_carto_sql_api_request(sql)
-            time.sleep(1)  # 1 query per second rate limit
+            recordstoupdate.append((crashid, smk, smi, sck, sci, spk, spi, stk, sti))
+            recordflags.append([cartocrash.get('hasvehicle_{}'.format(flag)) for flag in VEHICLE_FLAGS])
+
+        # one UPDATE for the whole chunk, rather than one per record
+        # those whose hasvehicle flags are all known get their blame recalculated right here, see etlcommon/blame.py
+        # the rest have their blame fields NULLed, for the blame batch job to recalculate
+        if recordstoupdate:
+            logger.info('    {0} records in this block need new counts'.format(len(recordstoupdate)))
+            flagsknown = [None not in flags for flags in recordflags]
+            withflags = [record for record, known in zip(recordstoupdate, flagsknown) if known]
+            withoutflags = [record for record, known in zip(recordstoupdate, flagsknown) if not known]
+            if withflags:
+                flags = [flags for flags, known in zip(recordflags, flagsknown) if known]
+                flagarrays = {flag: [rowflags[i] for rowflags in flags] for i, flag in enumerate(VEHICLE_FLAGS)}
+                countarrays = {
+                    'number_of_motorist_killed': [record[1] for record in withflags],
+                    'number_of_motorist_injured': [record[2] for record in withflags],
+                    'number_of_cyclist_killed': [record[3] for record in withflags],
+                    'number_of_cyclist_injured': [record[4] for record in withflags],
+                    'number_of_pedestrian_killed': [record[5] for record in withflags],
+                    'number_of_pedestrian_injured': [record[6] for record in withflags],
+                }
+                updatestatements.append(create_sql_killcount_update(withflags, allocate_blame(flagarrays, countarrays)))
+            if withoutflags:
+                updatestatements.append(create_sql_killcount_update(withoutflags))
+            howmanyupdated += len(recordstoupdate)
 
         # done with this chunk
 
+    # usually a handful of records, fine for the SQL API; an unusually large set (see issue 17 above) goes via the Batch API
+    if howmanyupdated > KILLCOUNT_BATCHAPI_THRESHOLD:
+        logger.info('Updating {0} records in {1} statements via the killcounts batch job'.format(howmanyupdated, len(updatestatements)))
+        return (updatestatements, failures)
+
+    logger.info('Updating {0} records in {1} statements'.format(howmanyupdated, len(updatestatements)))
+    for sql in updatestatements:
+        make_carto_sql_api_request(sql)
+
     # done with all updates
     logger.info('Done updating records')
+    return ([], failures)
 
 
-def find_updated_latlongs():
-    # fetch the SODA records updated since X days ago, where the update-date is NOT the same as the created-date
-    # most records are updated seconds to minutes after creation, (seemingly) as an artifact of their workflow
-    # those don't really count because we would have grabbed them the next day
-    # generate an assoc:  sodacrashrecords[crashid] = crashdetails
-    sincewhen = (date.today() - relativedelta(days=UPDATES_HOW_FAR_BACK))
-    logger.info('find_updated_latlongs() Find SODA records updated/modified since {0}'.format(sincewhen))
-
-    try:
-        crashdata = requests.get(
-            SODA_API_COLLISIONS_BASEURL,
-            params={
-                '$select': ':*,*',
-                '$where': ":updated_at >= '%s' AND latitude IS NOT NULL AND latitude != '0'" % sincewhen.strftime('%Y-%m-%d'),
-                '$limit': '50000'
-            }
+def create_sql_killcount_update(records, blame=None):
+    """
+    SQL query to set new injury & fatality counts for a set of crashes in one statement
+    @param {records} list of tuples: (socrata_id, motorist killed, motorist injured, cyclist killed, cyclist injured,
+                     pedestrian killed, pedestrian injured, persons killed, persons injured)
+    @param {blame} the recalculated blame allocations for those records from allocate_blame(), or None if we don't have them
+    """
+    if blame:
+        # the new counts and the recalculated blame fields, see BLAME_COLUMNS
+        values = ','.join([
+            '({0},{1},{2},{3},{4},{5},{6},{7},{8},{9})'.format(*(list(record) + [','.join([sql_literal(blame[column][i]) for column in BLAME_COLUMNS])]))
+            for i, record in enumerate(records)
+        ])
+        setblame = ', '.join(['{0}=v.{0}'.format(column) for column in BLAME_COLUMNS])
+        blamecolumns = ', ' + ', '.join(BLAME_COLUMNS)
+    else:
+        # don't forget to NULL out fields used by update_blame_allocations() so the blame counts will be recalculated
+        values = ','.join(['({0},{1},{2},{3},{4},{5},{6},{7},{8})'.format(*record) for record in records])
+        setblame = 'hasvehicle_other_unspecified=NULL, persons_injured_allocated=NULL, cyclist_injured_bycar=NULL'
+        blamecolumns = ''
+
+    sql = """UPDATE {table} SET
+            number_of_motorist_killed=v.mk, number_of_motorist_injured=v.mi,
+            number_of_cyclist_killed=v.ck, number_of_cyclist_injured=v.ci,
+            number_of_pedestrian_killed=v.pk, number_of_pedestrian_injured=v.pi,
+            number_of_persons_killed=v.tk, number_of_persons_injured=v.ti,
+            {setblame}
+            FROM (VALUES {values}) AS v(socrata_id, mk, mi, ck, ci, pk, pi, tk, ti{blamecolumns})
+            WHERE {table}.socrata_id=v.socrata_id""".format(
+            table=CARTO_CRASHES_TABLE,
+            values=values,
+            setblame=setblame,
+            blamecolumns=blamecolumns
         )
-        crashdata = crashdata.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(e.message)
-        sys.exit(1)
+    return sql
 
-    if isinstance(crashdata, list) and len(crashdata):  # this is good, the expected condition
-        sodacrashrecords = {}
-        for crash in crashdata:
-            if crash[':updated_at'][:10] > crash[':created_at'][:10]:  # per above, updated AFTER it was created
-                sodacrashrecords[int(crash['collision_id'])] = crash
-        logger.info('find_updated_latlongs() Got {0} SODA entries updated since {1}'.format(len(sodacrashrecords), sincewhen))
-    elif isinstance(crashdata, dict) and crashdata['error']:  # error in SODA API call
-        logger.error(crashdata['message'])
-        sys.exit(1)
-    else:  # no data?
-        logger.info('No data returned from Socrata, exiting.')
-        sys.exit()
+
+def find_updated_latlongs(changefeed, intersectionfinder=None, extent=None, intersectionids=True):
+    """
+    A crash's latlong can be changed later, sometimes by multiple kilometers.
+    Look for recently-updated records whose location is now different from CARTO, and generate the SQL to update them.
+    @param {changefeed} dict of recently-updated SODA records, from get_soda_changefeed()
+    @param {IntersectionFinder} intersectionfinder  to reassign intersection_id, or None to clear it for the intersections batch job
+    @param {tuple} extent  NYC's bounding box; a crash isn't moved to a new location outside it e.g. null island
+    @param {bool} intersectionids  whether the crashes table has intersection_id yet, see has_intersection_id()
+    Returns a tuple: (list of UPDATE queries, the number of chunks whose CARTO records couldn't be fetched)
+    """
+    # only those which do have a location; lat-longs going away is not something we handle
+    sodacrashrecords = {crashid: crash for crashid, crash in changefeed.items() if crash.latitude and crash.longitude}
+    if extent:
+        outside = [crashid for crashid, crash in sodacrashrecords.items() if not within_extent(extent, crash.longitude, crash.latitude)]
+        for crashid in outside:
+            del sodacrashrecords[crashid]
+        if outside:
+            logger.info('find_updated_latlongs() skipping {0} updated SODA entries with a lat-long outside NYC'.format(len(outside)))
+    logger.info('find_updated_latlongs() {0} updated SODA entries have a lat-long'.format(len(sodacrashrecords)))
 
     # find the corresponding records in CARTO
     cartocrashrecords = []
     done = 0
+    failures = 0
     batch_size = 500
     idchunks = list_chunks(list(sodacrashrecords.keys()), batch_size)
     for idchunk in idchunks:
@@ -1018,14 +1388,15 @@ def find_updated_latlongs():
             ','.join([str(i) for i in idchunk]),
         )
 
+        # none of them may be in CARTO, e.g. crashes not yet inserted, which is fine
         try:
-            gotcrashes = requests.get( CARTO_SQL_API_BASEURL, params={ 'q': sql, }).json()
-        except requests.exceptions.RequestException as e:
-            logger.error(e.message)
-            sys.exit(1)
-        if not 'rows' in gotcrashes or not len(gotcrashes['rows']):
-            logger.error('No socrata_id rows: {0}'.format(json.dumps(gotcrashes)))
-            sys.exit(1)
+            gotcrashes = httpclient.get( CARTO_SQL_API_BASEURL, params={ 'q': sql, }).json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            gotcrashes = {'error': str(e)}
+        if not 'rows' in gotcrashes:
+            logger.error('find_updated_latlongs() Fetching CARTO records for this block failed: {0}'.format(json.dumps(gotcrashes)))
+            failures += 1
+            continue
         # logger.info('    Found {0} CARTO entries in this block'.format(len(gotcrashes['rows'])))
         cartocrashrecords += gotcrashes['rows']
 
@@ -1038,73 +1409,150 @@ def find_updated_latlongs():
     # - carto record has geom, and distance between SODA and CARTO geoms is > 15 meters
     meters_threshold = 15
 
+    # distances for all of them at once; a CARTO record without a geom comes out as NaN
+    distances = haversine_array(
+        coordinate_array([crash['lat'] for crash in cartocrashrecords]),
+        coordinate_array([crash['lng'] for crash in cartocrashrecords]),
+        coordinate_array([sodacrashrecords[crash['socrata_id']].latitude for crash in cartocrashrecords]),
+        coordinate_array([sodacrashrecords[crash['socrata_id']].longitude for crash in cartocrashrecords]),
+    )
+
     updates = []
-    for crash in cartocrashrecords:
+    for crash, meters in zip(cartocrashrecords, distances):
         socrataid = crash['socrata_id']
         soda = sodacrashrecords[socrataid]
-        lat_old = crash['lat']
-        lng_old = crash['lng']
-        lat_new = float(soda['latitude'])
-        lng_new = float(soda['longitude'])
-
-        updateme = False
-        if (not lat_old or not lng_old) and lat_new and lng_new:
-            updateme = True
+        lat_new = soda.latitude
+        lng_new = soda.longitude
+
+        if np.isnan(meters):
             logger.info('find_updated_latlongs() socrata_id {} has no lat-long in CARTO, is now {} {}'.format(socrataid, lng_new, lat_new))
+        elif meters >= meters_threshold:
+            logger.info('find_updated_latlongs() socrata_id {} has moved {} meters'.format(socrataid, int(meters)))
         else:
-            meters = haversine(lat_old, lng_old, lat_new, lng_new)
-            if meters >= meters_threshold:
-                updateme = True
-                logger.info('find_updated_latlongs() socrata_id {} has moved {} meters'.format(socrataid, meters))
-
-        if not updateme:
             continue
 
+        if not intersectionids:
+            intersectionid = ''
+        elif intersectionfinder:
+            intersectionid = ',\n            intersection_id={}'.format(intersectionfinder.find(float(lng_new), float(lat_new)))
+        else:
+            intersectionid = ',\n            intersection_id=NULL'
+
         sql = """
         UPDATE {}
         SET
             the_geom=ST_SETSRID(ST_GEOMFROMTEXT('POINT({} {})'), 4326),
             longitude={}, latitude={},
-            borough=NULL, city_council=NULL, senate=NULL, assembly=NULL, businessdistrict=NULL, community_board=NULL, neighborhood=NULL, nypd_precinct=NULL
+            borough=NULL, city_council=NULL, senate=NULL, assembly=NULL, businessdistrict=NULL, community_board=NULL, neighborhood=NULL, nypd_precinct=NULL{}
         WHERE socrata_id={}
         """.format(
             CARTO_CRASHES_TABLE,
             lng_new, lat_new,
             lng_new, lat_new,
+            intersectionid,
             socrataid
         )
         updates.append(sql)
 
     logger.info('find_updated_latlongs() Found {} geom updates'.format(len(updates)))
-    return updates
+    return (updates, failures)
+
+
+def reclassify_vehicletypes_job(vehicleclassifier, checkpoints, after):
+    """
+    Compare the vehicle type crosswalk to the snapshot of it from the last run, and if any aliases were added, removed, or recategorized
+    return a BatchJob to re-flag only the crashes with those aliases in their vehicle_type, and recalculate their blame.
+    The new snapshot is saved as the job's last query, so if the job fails the next run tries these again.
+    Returns None if there's nothing to do; the first time, that's after saving the first snapshot.
+    @param {vehicleclassifier} VehicleClassifier, with the crosswalk as of this run
+    @param {checkpoints} CheckpointStore, holding the snapshot
+    @param {after} list of job names which must finish first
+    """
+    snapshot = crosswalk_snapshot(vehicleclassifier.crosswalk)
+    snapshotjson = json.dumps(snapshot, sort_keys=True)
+
+    lastsnapshot = checkpoints.get('vehicletype_crosswalk_snapshot')
+    if not lastsnapshot:
+        logger.info('reclassify_vehicletypes_job() No previous crosswalk snapshot, saving one of {} aliases'.format(len(snapshot)))
+        checkpoints.set('vehicletype_crosswalk_snapshot', snapshotjson)
+        return None
+
+    aliases = changed_aliases(json.loads(lastsnapshot), snapshot)
+    if not aliases:
+        return None
+    logger.info('reclassify_vehicletypes_job() {} aliases changed in the crosswalk: {}'.format(len(aliases), ', '.join(aliases)))
+
+    queries = [update_hasvehicle_for_aliases(aliases)] + update_blame_allocations(vehicletypes=aliases) + [checkpoints.upsert_sql({'vehicletype_crosswalk_snapshot': snapshotjson})]
+    return BatchJob('reclassify', queries, after=after)
+
+
+def crosswalk_aliases_array(category):
+    # the category's aliases, cleaned the way vehicle_type values are when inserted, see etlcommon/sodarows.py clean_text_value()
+    # VehicleClassifier cleans them the same, so crashes flagged here and crashes flagged locally always agree
+    return "(SELECT ARRAY_AGG(btrim(replace(nyc_vehicletype, '''', ''), E' \\t\\n\\r\\f\\v')) FROM {} WHERE crashmapper_vehicletype = '{}')".format(CARTO_VEHICLETYPE_CROSSWALK_TABLE, category)
+
+
+def vehicletype_overlap_clause(vehicletypes):
+    # crashes with any of these in their vehicle_type array; a GIN index on vehicle_type makes this quick
+    return "vehicle_type && ARRAY[{}]::text[]".format(','.join(["$${}$$".format(alias) for alias in vehicletypes]))
+
+
+def update_hasvehicle_for_aliases(vehicletypes):
+    """
+    SQL query to re-flag all of the hasvehicle_XXX fields for crashes with any of the given vehicle_type values,
+    e.g. aliases just added to the crosswalk, and to clear their blame allocations so update_blame_allocations() redoes them
+    @param {vehicletypes} list of nyc_vehicletype aliases, cleaned as by crosswalk_snapshot()
+    """
+    setflags = ["hasvehicle_{} = vehicle_type && {}".format(fieldsuffix, crosswalk_aliases_array(category)) for fieldsuffix, category in HASVEHICLE_CATEGORIES]
+    setblame = ["{} = NULL".format(column) for column in BLAME_COLUMNS]
+
+    sql = '''
+    UPDATE {0}
+    SET {1}
+    WHERE {2}
+    '''.format(
+        CARTO_CRASHES_TABLE,
+        ',\n        '.join(setflags + setblame),
+        vehicletype_overlap_clause(vehicletypes)
+    )
+    return sql
 
 
-def update_hasvehicle(vehicleboolfieldfieldname, standardizedalias):
+def update_hasvehicle(vehicleboolfieldfieldname, standardizedalias, windowstart=None):
     """
     SQL query to update hasvehicle_XXX fields
     checking the crash table's vehicle_type[] array
     against a set of defined aliases from vehicletype_crosswalk_prod
+    New crashes usually come in with these set already, see load_vehicle_classifier(), so this is the fallback if it couldn't be loaded
+    @param {windowstart} only look at crashes from this date on, see recent_window_clause()
     """
 
     # for performance, we update where it is null so basically only new records
     # however, it's inevitable that new "aliases" will be added since it's free-form text, e.g. "tesla 5" or "morotcycel"
-    # and now and then you may need to run this without the IS NULL clause so as to bulk-update ALL records
+    # the crashes with those are re-flagged when the crosswalk changes, see reclassify_vehicletypes_job()
     sql = '''
     UPDATE {}
-    SET hasvehicle_{} = vehicle_type && (SELECT ARRAY_AGG(nyc_vehicletype) FROM vehicletype_crosswalk_prod WHERE crashmapper_vehicletype = '{}')
-    WHERE hasvehicle_{} IS NULL
+    SET hasvehicle_{} = vehicle_type && {}
+    WHERE hasvehicle_{} IS NULL{}
     '''.format(
         CARTO_CRASHES_TABLE,
         vehicleboolfieldfieldname,
-        standardizedalias,
-        vehicleboolfieldfieldname
+        crosswalk_aliases_array(standardizedalias),
+        vehicleboolfieldfieldname,
+        recent_window_clause(windowstart)
     )
     return sql
 
 
 def update_analyzeindex():
+    """
+    The maintenance the crashes table needs after tonight's updates, as a list of 0 or 1 queries
+    This is called only once the other batch jobs are done, so it sees the dead rows they left; see etlcommon/maintenance.py
+    A VACUUM FULL only when the table is badly bloated, otherwise a plain VACUUM or ANALYZE, or nothing.
+    """
     logger.info('update_analyzeindex()')
-    return 'VACUUM FULL {}'.format(CARTO_CRASHES_TABLE)
+    plan = plan_table_maintenance(CARTO_SQL_API_BASEURL, CARTO_MASTER_KEY, CARTO_CRASHES_TABLE)
+    return [plan.sql] if plan.sql else []
 
 
 # https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks
@@ -1112,23 +1560,6 @@ def list_chunks(lst, n):
     return [lst[i:i + n] for i in range(0, len(lst), n)]
 
 
-# a Haversine implementationm in Python, modified to return integer meters
-# https://stackoverflow.com/questions/4913349/haversine-formula-in-python-bearing-and-distance-between-two-gps-points
-def haversine(lat1, lon1, lat2, lon2):
-    from math import radians, cos, sin, asin, sqrt
-
-    R = 6372800
-    dLat = radians(lat2 - lat1)
-    dLon = radians(lon2 - lon1)
-    lat1 = radians(lat1)
-    lat2 = radians(lat2)
-
-    a = sin(dLat / 2)**2 + cos(lat1) * cos(lat2) * sin(dLon / 2)**2
-    c = 2 * asin(sqrt(a))
-
-    return int(round(R * c))
-
-
 def main():
     try:
         # some longer-running and non-sequential updates are launched via the Batch Query API
@@ -1139,66 +1570,58 @@ def main():
         # the main data loading of crash data from Socrata to CARTO
         # get the most recent data from New York's data endpoint, and load it
         # then, filter out any poorly geocoded data afterward (e.g. null island)
-        get_soda_data()
-        make_carto_sql_api_request(filter_carto_data())
+        # checkpoints from the last run let us fetch only what's new since then; see is_wide_sweep_due() for when we look wider
+        checkpoints = CheckpointStore(CARTO_SQL_API_BASEURL, CARTO_CHECKPOINTS_TABLE)
+        checkpoints.load()
+        widesweep = is_wide_sweep_due(checkpoints)
+        logger.info('This run is a {0}'.format('wide sweep' if widesweep else 'incremental fetch since the last checkpoints'))
+
+        # the vehicle type crosswalk, so new crashes are inserted with their hasvehicle_XXX flags already set
+        vehicleclassifier = load_vehicle_classifier(CARTO_SQL_API_BASEURL, CARTO_VEHICLETYPE_CROSSWALK_TABLE, HASVEHICLE_CATEGORIES)
+
+        # the intersection circles, so new and moved crashes get their intersection_id for the crash counts
+        # but only once the crashes table has that column; until then the intersection counts are skipped too
+        intersectionids = has_intersection_id(CARTO_SQL_API_BASEURL, CARTO_CRASHES_TABLE)
+        intersectionfinder = load_intersection_finder(CARTO_SQL_API_BASEURL, CARTO_INTERSECTIONS_TABLE, BOUNDARY_CACHE_DIR) if intersectionids else None
+
+        # the UPDATEs which fill in missing fields need only look back as far as the oldest crash loaded or corrected this run
+        # except in a wide sweep, when they look at the whole table to catch any stragglers; see recent_window_start()
+        # NYC's bounding box, so badly geocoded crashes e.g. null island are loaded without a geom in the first place
+        # filter_carto_data() clears any which got past that, but only in a wide sweep or if we couldn't load the box
+        extent = load_extent(CARTO_SQL_API_BASEURL, CARTO_EXTENT_TABLE)
+
+        oldestloaded = get_soda_data(checkpoints, widesweep, vehicleclassifier, intersectionfinder, extent)
+        if widesweep or not extent:
+            make_carto_sql_api_request(filter_carto_data(None if widesweep else recent_window_start([oldestloaded])))
 
         # a quirk we didn't discover for some time: records may be retroactively updated
         # and their injury/killed counts may have changed, e.g. a injury later reported, or an injury that was later fatal
-        find_updated_killcounts()
+        # the SODA records updated since they were created are fetched once, and shared by the checks below
+        # if some couldn't be checked, the next run reads the same updates again
+        changefeed = get_soda_changefeed(checkpoints, widesweep)
+        (killcountupdates, killcountfailures) = find_updated_killcounts(changefeed)
 
         # a quirk we didn't discover for some time: they sometimes go back and change a crash's latlong
         # sometimes by multiple kilometers, so a different borough, precinct, neighborhood, ...
-        start_carto_batchjob( find_updated_latlongs() )
-
-        # update the nyc_intersections crashcount field, giving a rough idea of the most crashy intersections citywide
-        # this can be done via batch, as it doesn't need to be specifically sequenced like the steps above
-        logger.info('update_intersections() series launching')
-        start_carto_batchjob([
-            clear_intersections_crashcount(),
-            update_intersections_crashcount(),
-        ])
-
-        # update the borough, city councily, nypd precinct, and other such containing zones, for query filtering
-        # these don't need to follow a specific sequence nor to be done immediately, so use the Batch Query API
-        logger.info('update_places() series launching')
-        start_carto_batchjob([
-            update_borough(),
-            update_city_council(),
-            update_nypd_precinct(),
-            update_community_board(),
-            update_neighborhood(),
-            update_assembly(),
-            update_senate(),
-            update_businessdistrict(),
-        ])
-
-        logger.info('update_hasvehicle() series launching')
-        start_carto_batchjob([
-            update_hasvehicle('scooter', 'E-BIKE-SCOOT'),
-            update_hasvehicle('suv', 'SUV'),
-            update_hasvehicle('car', 'CAR'),
-            update_hasvehicle('other', 'OTHER'),
-            update_hasvehicle('truck', 'TRUCK'),
-            update_hasvehicle('motorcycle', 'MOTORCYCLE-MOPED'),
-            update_hasvehicle('bicycle', 'BICYCLE'),
-            update_hasvehicle('busvan', 'BUS-VAN'),
-        ])
-
-        # blame allocations is a series of longer-running queries, so needs to run via batch API
-        # they have "where is null" clauses, so shouldn't take TOO long to run since they're only for a few hundred records at a time
-        # but if you're doing a bulk backlog, it could take 15 minutes for the series
-        start_carto_batchjob(update_blame_allocations())
-
-        # a final cleanup/repacking of the table
-        # because those updates can bloat the table and falsely hit our storage quota
-        # particularly if we've done a larger update e.g. hasvehicle without NOT NULL, or a "backlog" run
-        start_carto_batchjob([
-            update_analyzeindex(),
-        ])
+        (latlongupdates, latlongfailures) = find_updated_latlongs(changefeed, intersectionfinder, extent, intersectionids)
+        if killcountfailures or latlongfailures:
+            logger.info('Not advancing the SODA updates checkpoint, since {0} blocks of updated records could not be checked'.format(killcountfailures + latlongfailures))
+            checkpoints.discard('soda_updated_at')
+
+        # the rest are longer-running updates, run via the Batch API; see run_carto_batchjobs() for the order they go in
+        # once data loading and corrections went fine, the next run can pick up from here
+        # if there are corrections to run as batch jobs, that means once those are done
+        # the hasvehicle job is only needed if we couldn't set the flags ourselves, or in a wide sweep to catch any stragglers
+        windowstart = None if widesweep else recent_window_start([oldestloaded] + [crash.crash_date for crash in changefeed.values()])
+        logger.info('Batch job UPDATEs will look at {0}'.format('all crashes' if widesweep else 'crashes since {0}'.format(windowstart)))
+        run_carto_batchjobs(latlongupdates, on_corrections_done=lambda jobname: checkpoints.save(), checkpoints=checkpoints, hasvehicle=widesweep or not vehicleclassifier, windowstart=windowstart, vehicleclassifier=vehicleclassifier, intersections=intersectionids, killcountupdates=killcountupdates)
     except Exception as e:
         logger.info(e)
         send_email_notification("Script failed check error log for detail", "Script failed " + str(e))
 
+    for line in httpclient.stats_lines():
+        logger.info('HTTP traffic: {}'.format(line))
+
 
 if __name__ == '__main__':
     if not CARTO_API_KEY:
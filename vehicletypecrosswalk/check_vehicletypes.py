@@ -5,52 +5,198 @@ import requests
 import os
 import sys
 import json
+import csv
+import re
+from collections import Counter
+
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
 
 
 CARTO_USER_NAME = 'chekpeds'
 CARTO_API_KEY = os.environ['CARTO_API_KEY'] # make sure this is available in your shell as $CARTO_API_KEY
 CARTO_SQL_API_BASEURL = 'https://%s.carto.com/api/v2/sql' % CARTO_USER_NAME
 
+# the proposed crosswalk entries are written here, for review before loading into vehicletype_crosswalk_prod
+SUGGESTIONS_CSVFILE = "proposed_crosswalk_inserts.csv"
+
+# suggest a category only if the closest known alias is within this many edits, per character of the unknown type
+# e.g. 0.34 allows 1 edit for a 3-letter type, 3 edits for a 9-letter type
+MAX_EDITS_PER_CHARACTER = 0.34
+
 
 def main():
+    # every unknown vehicle_type and how many crashes have it, in one pass over the crashes table
+    # aliases are cleaned the same as vehicle_type values are when inserted, as main.py's crosswalk_aliases_array() does
     sql = """
     WITH alltypes AS (
-        SELECT DISTINCT UNNEST(vehicle_type) AS vehtype
+        SELECT UNNEST(vehicle_type) AS vehtype
         FROM crashes_all_prod
         WHERE vehicle_type::text != '{}'
     )
-    SELECT vehtype AS unknowntype FROM alltypes
-    WHERE vehtype NOT IN (SELECT nyc_vehicletype FROM vehicletype_crosswalk_prod)
-    ORDER BY unknowntype
+    SELECT vehtype AS unknowntype, COUNT(*) AS howmany FROM alltypes
+    WHERE NOT EXISTS (SELECT 1 FROM vehicletype_crosswalk_prod WHERE btrim(replace(nyc_vehicletype, '''', ''), E' \\t\\n\\r\\f\\v') = vehtype)
+    GROUP BY vehtype
+    ORDER BY howmany DESC, unknowntype
     """
     unknowntypes = cartoapi_query(sql)
-    unknowntypes = [ i['unknowntype'] for i in unknowntypes ]
 
     if not unknowntypes:
         print("All vehicle_type values are accounted for in vehicletype_crosswalk_prod")
         return
 
     print("Found {} vehicle_type values without corresponding crosswalk entries".format(len(unknowntypes)))
-    #for unknowntype in unknowntypes:
-    #    print("    {}".format(unknowntype.encode('ascii', 'replace')))
     print("")
 
-    for unknowntype in unknowntypes:
-        print(unknowntype.encode('ascii', 'replace'))
+    # the known aliases, indexed for finding the closest to each unknown type
+    crosswalk = cartoapi_query("SELECT nyc_vehicletype, crashmapper_vehicletype FROM vehicletype_crosswalk_prod WHERE nyc_vehicletype IS NOT NULL AND crashmapper_vehicletype IS NOT NULL")
+    suggester = AliasSuggester([(row['nyc_vehicletype'], row['crashmapper_vehicletype']) for row in crosswalk])
+    print("Loaded {} known aliases from vehicletype_crosswalk_prod".format(len(crosswalk)))
+
+    with open(SUGGESTIONS_CSVFILE, 'w', newline='') as fh:
+        output = csv.writer(fh)
+        output.writerow(['nyc_vehicletype', 'crashmapper_vehicletype', 'crashes', 'closest_alias', 'edits', 'alternatives'])
+
+        suggested = 0
+        for unknown in unknowntypes:
+            category, closest, edits, alternatives = suggester.suggest(unknown['unknowntype'])
+            if category:
+                suggested += 1
+            output.writerow([unknown['unknowntype'], category or '', unknown['howmany'], closest or '', '' if edits is None else edits, ' '.join(alternatives)])
+            print("    {} ({} crashes) => {}".format(unknown['unknowntype'], unknown['howmany'], category or '?'))
 
-        unkarray = '\'{"' + unknowntype + '"}\'::text[]'
-        sql = u"SELECT cartodb_id FROM crashes_all_prod WHERE vehicle_type && {}".format(unkarray)
-        rows = cartoapi_query(sql)
-        print("    Found in {} records".format(len(rows)))
-        for row in rows:
-            print("    cartodb_id = {}".format(row['cartodb_id']))
     print("")
+    print("Suggested a category for {} of {}; review {} then load it into vehicletype_crosswalk_prod".format(suggested, len(unknowntypes), SUGGESTIONS_CSVFILE))
+
+
+class AliasSuggester:
+    """
+    Suggest a crosswalk category for an unknown vehicle type, from the known alias closest to it
+    Aliases are compared normalized: lowercase with punctuation and spaces removed, so "Box Truck" and "box-truck" are the same.
+    The normalized aliases go into a BK-tree keyed on edit distance, so finding those within N edits
+    only visits a small part of the tree instead of comparing against every alias.
+    """
+    def __init__(self, crosswalk):
+        self.categories = {}  # normalized alias => Counter of categories, since variants of one alias may be mapped differently
+        for alias, category in crosswalk:
+            key = normalize(alias)
+            if key:
+                self.categories.setdefault(key, Counter())[category] += 1
+
+        self.tree = BKTree()
+        for key in self.categories:
+            self.tree.add(key)
+
+    def suggest(self, unknowntype):
+        """
+        Returns a tuple: (suggested category, closest known alias, edits away, [other categories equally close])
+        or (None, None, None, []) if nothing is close enough
+        """
+        key = normalize(unknowntype)
+        if not key:
+            return (None, None, None, [])
+
+        maxedits = max(1, int(len(key) * MAX_EDITS_PER_CHARACTER))
+        matches = self.tree.search(key, maxedits)
+        if not matches:
+            return (None, None, None, [])
+
+        # the nearest aliases, and which category most of them map to
+        edits = min([distance for distance, alias in matches])
+        nearest = sorted([alias for distance, alias in matches if distance == edits])
+        votes = Counter()
+        for alias in nearest:
+            votes.update(self.categories[alias])
+        ranked = [category for category, count in votes.most_common()]
+        return (ranked[0], nearest[0], edits, ranked[1:])
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of strings under edit_distance(): each child is filed under its distance from the parent,
+    so by the triangle inequality a search within N edits of a word only needs to follow children whose distance
+    from their parent is within N of the word's own distance from that parent.
+    """
+    def __init__(self):
+        self.root = None  # (word, {distance: child node})
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+
+        node = self.root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (word, {})
+                return
+            node = node[1][distance]
+
+    def search(self, word, maxdistance):
+        """
+        All words within maxdistance edits of the given word, as a list of (distance, word)
+        """
+        found = []
+        if self.root is None:
+            return found
+
+        tovisit = [self.root]
+        while tovisit:
+            nodeword, children = tovisit.pop()
+            distance = edit_distance(word, nodeword)
+            if distance <= maxdistance:
+                found.append((distance, nodeword))
+            for childdistance, child in children.items():
+                if distance - maxdistance <= childdistance <= distance + maxdistance:
+                    tovisit.append(child)
+        return found
+
+
+NORMALIZE_STRIP = re.compile(r'[^a-z0-9]')
+
+
+def normalize(alias):
+    return NORMALIZE_STRIP.sub('', alias.lower())
+
+
+def edit_distance(a, b):
+    """
+    Damerau-Levenshtein distance: how many insertions, deletions, substitutions, or swaps of adjacent characters turn a into b
+    Swaps count as 1 since they're such a common typo e.g. "morotcycel"; this is the unrestricted version, which is a true metric as the BK-tree needs.
+    """
+    infinity = len(a) + len(b)
+    lastrow = {}  # character => last row of a it was seen in
+    table = [[infinity] * (len(b) + 2)] + [[infinity] + list(range(len(b) + 1))] + [[infinity, i] + [0] * len(b) for i in range(1, len(a) + 1)]
+
+    for i in range(1, len(a) + 1):
+        lastcol = 0  # last column of b matching a[i-1] in this row
+        for j in range(1, len(b) + 1):
+            k = lastrow.get(b[j - 1], 0)
+            l = lastcol
+            if a[i - 1] == b[j - 1]:
+                cost = 0
+                lastcol = j
+            else:
+                cost = 1
+            table[i + 1][j + 1] = min(
+                table[i][j] + cost,  # substitution
+                table[i + 1][j] + 1,  # insertion
+                table[i][j + 1] + 1,  # deletion
+                table[k][l] + (i - k - 1) + 1 + (j - l - 1),  # transposition
+            )
+        lastrow[a[i - 1]] = i
+
+    return table[len(a) + 1][len(b) + 1]
 
 
 def cartoapi_query(sql):
     try:
         payload = {'q': sql}
-        data = requests.get(CARTO_SQL_API_BASEURL, params=payload).json()
+        data = httpclient.get(CARTO_SQL_API_BASEURL, params=payload).json()
     except requests.exceptions.RequestException as e:
         print(e.message)
         sys.exit(1)
@@ -69,4 +215,3 @@ if __name__ == '__main__':
     main()
     print("")
     print("ALL DONE")
-
@@ -54,8 +54,13 @@ import requests
 import mysql.connector
 import logging
 import sys
+import os
 import json
 
+# the shared etlcommon package lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from etlcommon import httpclient
+
 
 class ObstructionMyqlToCartoLoader:
     def __init__(self):
@@ -85,7 +90,7 @@ class ObstructionMyqlToCartoLoader:
                 'q': sqlquery,
                 'api_key': self.cartoapikey,
             }
-            reply = requests.get(self.cartoapiurl, params=params).json()
+            reply = httpclient.get(self.cartoapiurl, params=params).json()
 
             if 'rows' not in reply:
                 raise requests.exceptions.RequestException(f"No rows found in returned data: {json.dumps(reply)}")